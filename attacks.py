@@ -0,0 +1,326 @@
+"""
+This module contains the strategies that the eavesdropper can use,
+plugged between the sender and the receiver of the array-backed engine.
+Every attack is a kernel that works on the arrays of all the particles
+at once and is registered in ATTACKS with a name:
+
+- 'intercept-resend' measures a fraction of the particles in a random
+  basis and resends what she found, causing a QBER of fraction/4;
+- 'breidbart' measures a fraction of the particles in the Breidbart
+  basis, halfway between X and Z, and resends the state she found,
+  which gives her the most information for a QBER of 25%;
+- 'photon-number-splitting' attacks weak laser pulses, which sometimes
+  carry more than one photon: Eve keeps a photon of these pulses, reads
+  it after the bases are announced and blocks single photons to hide
+  the loss, causing no errors at all. The sender can use decoy states,
+  pulses with other intensities, and the yields of the intensities
+  reveal that the single photons are missing.
+
+Along with the QBER, every run reports Eve's information on the shared
+key, as the mutual information per shared bit, to compare the attacks.
+"""
+import math
+from dataclasses import dataclass
+import numpy as np
+import engine
+import randomness
+
+#Probability that the Breidbart measurement gives the wrong value
+BREIDBART_ERROR = math.sin(math.pi/8)**2
+
+#Attacks that can be chosen by name, filled by 'register'
+ATTACKS = {}
+
+@dataclass
+class Interception:
+    """
+    What the eavesdropper does to the particles sent.
+
+    Attributes
+    ----------
+        bases : ndarray
+            The bases of the states that arrive to the receiver
+        values : ndarray
+            The values of the states that arrive to the receiver
+        eve_error : ndarray
+            For every particle, the probability that Eve's guess of the
+            value of the sender is wrong, after the bases are announced
+        detected : ndarray
+            An array of bool, true where the receiver gets the particle,
+            None if all the particles arrive
+        intensities : ndarray
+            For pulses of light, the index of the intensity used by the
+            sender for every pulse, None otherwise
+    """
+    bases: np.ndarray
+    values: np.ndarray
+    eve_error: np.ndarray
+    detected: np.ndarray = None
+    intensities: np.ndarray = None
+
+@dataclass
+class AttackResult:
+    """
+    Summary of a run of the protocol under an attack.
+
+    Attributes
+    ----------
+        sifted_length : int
+            Number of bits of the shared key
+        errors : int
+            Number of errors in the shared key
+        eve_information : float
+            Mutual information between Eve's guess and the shared key,
+            in bits per shared bit
+        yields : ndarray
+            For pulses of light, the fraction of the pulses of every
+            intensity that were detected, None otherwise
+        single_photon_yield : float
+            Lower bound of the probability that a single photon is
+            detected, estimated with the decoy states, None without
+            decoy states
+    """
+    sifted_length: int
+    errors: int
+    eve_information: float
+    yields: np.ndarray = None
+    single_photon_yield: float = None
+
+    @property
+    def qber(self):
+        """Error rate of the shared key, or nan if it's empty"""
+        if self.sifted_length == 0:
+            return math.nan
+        return self.errors/self.sifted_length
+
+def register(name):
+    """Decorator that adds an attack to ATTACKS with the given name"""
+    def decorator(kernel):
+        ATTACKS[name] = kernel
+        return kernel
+    return decorator
+
+@register("intercept-resend")
+def intercept_resend(bases, values, strength, rng):
+    """
+    Eve measures a fraction 'strength' of the particles in random bases
+    and resends the states she found.
+
+    Parameters
+    ----------
+        bases : ndarray
+            The bases of the states sent
+        values : ndarray
+            The values of the states sent
+        strength : float
+            The fraction of the particles intercepted
+        rng : RandomSource
+            The source of randomness
+
+    Returns
+    -------
+        interception : Interception
+            The states that arrive and Eve's knowledge
+    """
+    intercepted = rng.random(np.shape(bases)) < strength
+    eve_bases, eve_values = engine.measure(bases, values, rng)
+    #After the announcement Eve knows the values measured in the right
+    #basis, and nothing about the others
+    eve_error = np.where(intercepted & (eve_bases == bases), 0., 0.5)
+    return Interception(np.where(intercepted, eve_bases, bases),
+                        np.where(intercepted, eve_values, values), eve_error)
+
+@register("breidbart")
+def breidbart(bases, values, strength, rng):
+    """
+    Eve measures a fraction 'strength' of the particles in the Breidbart
+    basis and resends the states she found. Her result is wrong with
+    probability sin^2(pi/8) in both bases, and so is the measurement of
+    the resent state in the basis of the sender, with the same
+    parameters and results of 'intercept_resend'.
+    """
+    shape = np.shape(bases)
+    intercepted = rng.random(shape) < strength
+    guesses = values ^ (rng.random(shape) < BREIDBART_ERROR)
+    resent = guesses ^ (rng.random(shape) < BREIDBART_ERROR)
+    eve_error = np.where(intercepted, BREIDBART_ERROR, 0.5)
+    return Interception(bases, np.where(intercepted, resent, values),
+                        eve_error)
+
+@register("photon-number-splitting")
+def photon_number_splitting(bases, values, strength, rng, mean_photons=0.5,
+                            transmittance=0.1, decoys=(),
+                            decoy_fraction=0.2):
+    """
+    The sender emits weak pulses with a Poisson number of photons, and
+    Eve attacks a fraction 'strength' of them. She keeps a photon of the
+    pulses with more than one and reads it after the bases are
+    announced, then sends the pulses to the receiver over a lossless
+    channel, blocking enough of them to detect as many pulses as the
+    honest channel of the given transmittance would.
+
+    Parameters
+    ----------
+        bases, values, strength, rng
+            Like in 'intercept_resend'
+        mean_photons : float, optional
+            Mean number of photons of the signal pulses, default 0.5
+        transmittance : float, optional
+            Probability that a photon of the honest channel is detected,
+            default 0.1
+        decoys : tuple, optional
+            Mean numbers of photons of the decoy pulses, default none
+        decoy_fraction : float, optional
+            Fraction of the pulses that are decoys, default 0.2
+
+    Returns
+    -------
+        interception : Interception
+            The states that arrive and Eve's knowledge
+    """
+    shape = np.shape(bases)
+    levels = np.array((mean_photons, *decoys), dtype=float)
+    intensities = np.zeros(shape, dtype=np.int64)
+    if decoys:
+        is_decoy = rng.random(shape) < decoy_fraction
+        intensities[is_decoy] = 1 + (rng.random(np.count_nonzero(is_decoy))
+                                     *len(decoys)).astype(np.int64)
+    photons = rng.generator().poisson(levels[intensities])
+    #Eve makes the signal pulses arrive as often as the honest channel,
+    #sending the multi-photon pulses first
+    honest_yield = 1 - math.exp(-transmittance*mean_photons)
+    multi_photon = 1 - math.exp(-mean_photons)*(1 + mean_photons)
+    single_photon = math.exp(-mean_photons)*mean_photons
+    multi_passed = min(1., honest_yield/multi_photon) if multi_photon else 1.
+    single_passed = min(1., max(0., honest_yield - multi_photon)
+                        / single_photon) if single_photon else 0.
+    attacked = rng.random(shape) < strength
+    passed = np.where(photons >= 2, multi_passed,
+                      np.where(photons == 1, single_passed, 0.))
+    honest_detected = rng.random(shape) < 1 - (1 - transmittance)**photons
+    detected = np.where(attacked, rng.random(shape) < passed,
+                        honest_detected)
+    eve_error = np.where(attacked & (photons >= 2), 0., 0.5)
+    return Interception(bases, values, eve_error, detected, intensities)
+
+def _information(error_probabilities):
+    """Mean of 1 - h(p) over the probabilities of error of Eve"""
+    p = np.clip(error_probabilities, 1e-300, 1 - 1e-16)
+    entropy = -p*np.log2(p) - (1 - p)*np.log2(1 - p)
+    return float(np.mean(1 - entropy)) if len(p) else 0.
+
+def single_photon_yield(yields, signal, decoy):
+    """
+    Lower bound of the yield of single photons from the yields of the
+    signal and of a weaker decoy intensity, assuming no dark counts.
+
+    Parameters
+    ----------
+        yields : tuple
+            The fractions of detected pulses of the signal and the decoy
+        signal : float
+            The mean number of photons of the signal
+        decoy : float
+            The mean number of photons of the decoy, lower
+
+    Returns
+    -------
+        float
+            The lower bound of the single photon yield
+    """
+    signal_yield, decoy_yield = yields
+    return (signal/(signal*decoy - decoy**2)
+            *(decoy_yield*math.exp(decoy)
+              - signal_yield*math.exp(signal)*decoy**2/signal**2))
+
+def run_attack(attack, n_particles, strength=1., rng=None, **options):
+    """
+    Run the protocol with the arrays of the engine, with an attack
+    between the sender and the receiver.
+
+    Parameters
+    ----------
+        attack : string
+            The name of the attack in ATTACKS
+        n_particles : int
+            How many particles will be used
+        strength : float, optional
+            The fraction of the particles attacked, default 1
+        rng : RandomSource, Generator or int, optional
+            The source of randomness, or a NumPy generator or a seed
+            to create one
+        **options
+            The other parameters of the attack
+
+    Returns
+    -------
+        result : AttackResult
+            The QBER and Eve's information on the shared key
+    """
+    if attack not in ATTACKS:
+        raise ValueError(f"Unknown attack {attack}, use one of "
+                         f"{', '.join(ATTACKS)}")
+    if n_particles<1:
+        raise ValueError("Invalid number of particles, use at least 1")
+    rng = randomness.as_source(rng)
+    sender_bases, sender_values = engine.prepare(n_particles, rng)
+    interception = ATTACKS[attack](sender_bases, sender_values, strength,
+                                   rng, **options)
+    receiver_bases, receiver_values = engine.measure(interception.bases,
+                                                     interception.values, rng)
+    shared = sender_bases == receiver_bases
+    if interception.detected is not None:
+        shared &= interception.detected
+    result = AttackResult(
+        sifted_length=int(np.count_nonzero(shared)),
+        errors=int(np.count_nonzero(shared
+                                    & (sender_values != receiver_values))),
+        eve_information=_information(interception.eve_error[shared]))
+    if interception.intensities is not None:
+        sent = np.bincount(interception.intensities)
+        detected = np.bincount(interception.intensities,
+                               weights=interception.detected,
+                               minlength=len(sent))
+        result.yields = detected/np.maximum(sent, 1)
+        decoys = options.get("decoys", ())
+        if decoys:
+            result.single_photon_yield = single_photon_yield(
+                result.yields[:2], options.get("mean_photons", 0.5),
+                decoys[0])
+    return result
+
+def attack_grid(attack, strengths, key_lengths, rng=None, **options):
+    """
+    Run an attack for every combination of strength and number of
+    particles.
+
+    Parameters
+    ----------
+        attack : string
+            The name of the attack in ATTACKS
+        strengths : array_like
+            The fractions of the particles attacked
+        key_lengths : array_like
+            The numbers of particles sent
+        rng : RandomSource, Generator or int, optional
+            The source of randomness
+        **options
+            The other parameters of the attack
+
+    Returns
+    -------
+        qber : ndarray
+            The QBER of every point, with shape
+            (len(strengths), len(key_lengths))
+        eve_information : ndarray
+            Eve's information per shared bit of every point
+    """
+    rng = randomness.as_source(rng)
+    qber = np.zeros((len(strengths), len(key_lengths)))
+    eve_information = np.zeros_like(qber)
+    for i, strength in enumerate(strengths):
+        for j, length in enumerate(key_lengths):
+            result = run_attack(attack, length, strength, rng, **options)
+            qber[i, j] = result.qber
+            eve_information[i, j] = result.eve_information
+    return qber, eve_information
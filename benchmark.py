@@ -0,0 +1,298 @@
+"""
+This module contains a benchmark of the hot paths of the simulation,
+from the single steps of 'simulation.py' to the complete runs and the
+arrays of the engine, for numbers of particles from 10^2 to 10^7.
+Every path is timed on inputs prepared in advance, keeping the best of a
+few repetitions, and its peak memory is measured with tracemalloc in a
+separate call, because tracing slows down the allocations. The paths of
+the DataFrames that loop in Python have a maximum size, above which they
+are skipped, so that the whole benchmark runs in a few minutes.
+The results can be saved as JSON and compared with a baseline saved
+before: the comparison fails when a path is slower than the baseline by
+more than the tolerance. From the terminal:
+
+    python benchmark.py --output new.json --baseline old.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import engine
+import graph
+import packed
+import postprocessing
+import randomness
+import simulation
+
+#Default numbers of particles of the benchmark
+SIZES = [10**exponent for exponent in range(2, 8)]
+
+#Number of runs of the simulations done by 'graph.simulate_fixed'
+FIXED_RUNS = 10
+
+#Seed of the inputs and of the runs, so that every benchmark does the same
+SEED = 12345
+
+#Error rate of the keys corrected and hashed by the post-processing
+KEY_ERROR_RATE = 0.02
+
+def _two_results(size):
+    """Results of a sender and a receiver, prepared without printing"""
+    rng = randomness.as_source(SEED)
+    sender = simulation.prepare_particles(size, "Alice", None, rng)
+    receiver = simulation.receive_particles(sender, "Bob", None, rng)
+    return sender, receiver
+
+def _setup_choose_bases(size):
+    rng = randomness.as_source(SEED)
+    return lambda: simulation.randomly_choose_bases(size, rng)
+
+def _setup_prepare(size):
+    rng = randomness.as_source(SEED)
+    return lambda: simulation.prepare_particles(size, "Alice", None, rng)
+
+def _setup_receive(size):
+    rng = randomness.as_source(SEED)
+    sender = simulation.prepare_particles(size, "Alice", None, rng)
+    return lambda: simulation.receive_particles(sender, "Bob", None, rng)
+
+def _setup_compare_bases(size):
+    sender, receiver = _two_results(size)
+    return lambda: simulation.compare_bases(sender, receiver, None)
+
+def _setup_compare_keys(size, indexed=False):
+    sender, receiver = _two_results(size)
+    shared = simulation.compare_bases(sender, receiver, None)
+    rng = randomness.as_source(SEED)
+    return lambda: simulation.compare_keys(shared, sender, receiver,
+                                           reporter=None, rng=rng,
+                                           indexed=indexed)
+
+def _setup_compare_keys_indexed(size):
+    return _setup_compare_keys(size, indexed=True)
+
+def _setup_run(size):
+    rng = randomness.as_source(SEED)
+    return lambda: simulation.run(size, eavesdropping=True, reporter=None,
+                                  rng=rng)
+
+def _setup_simulate_fixed(size):
+    np.random.seed(SEED)
+    return lambda: graph.simulate_fixed(FIXED_RUNS, size)
+
+def _setup_engine_run(size):
+    rng = randomness.as_source(SEED)
+    return lambda: engine.run(size, eavesdropping=True, rng=rng)
+
+def _setup_packed_run(size):
+    rng = randomness.as_source(SEED)
+    return lambda: packed.run(size, eavesdropping=True, rng=rng)
+
+def _two_keys(size):
+    """Keys of 'size' bits that differ in KEY_ERROR_RATE of the bits"""
+    rng = randomness.as_source(SEED)
+    sender_key = rng.bits(size)
+    errors = (rng.random(size) < KEY_ERROR_RATE).astype(np.uint8)
+    return sender_key, sender_key ^ errors
+
+def _setup_cascade(size):
+    sender_key, receiver_key = _two_keys(size)
+    rng = randomness.as_source(SEED)
+    return lambda: postprocessing.cascade(sender_key, receiver_key,
+                                          KEY_ERROR_RATE, rng=rng)
+
+def _setup_toeplitz_hash(size):
+    sender_key, _ = _two_keys(size)
+    output_length = int(size*(1 - postprocessing.binary_entropy(
+        KEY_ERROR_RATE))*0.8)
+    seed_bits = randomness.as_source(SEED).bits(size + output_length - 1)
+    return lambda: postprocessing.toeplitz_hash(sender_key, output_length,
+                                                seed_bits)
+
+def _setup_distill(size):
+    sender_key, receiver_key = _two_keys(size)
+    rng = randomness.as_source(SEED)
+    return lambda: postprocessing.distill(sender_key, receiver_key,
+                                          KEY_ERROR_RATE, rng=rng)
+
+#For every path the function that prepares it for a number of particles,
+#the largest number of particles used and how many particles a call
+#simulates for each particle of the size, for the throughput
+PATHS = {
+    "randomly_choose_bases": (_setup_choose_bases, 10**7, 1),
+    "prepare_particles": (_setup_prepare, 10**6, 1),
+    "receive_particles": (_setup_receive, 10**6, 1),
+    "compare_bases": (_setup_compare_bases, 10**5, 1),
+    "compare_keys": (_setup_compare_keys, 10**5, 1),
+    "compare_keys_indexed": (_setup_compare_keys_indexed, 10**6, 1),
+    "run": (_setup_run, 10**5, 1),
+    "simulate_fixed": (_setup_simulate_fixed, 10**4, FIXED_RUNS),
+    "engine.run": (_setup_engine_run, 10**7, 1),
+    "packed.run": (_setup_packed_run, 10**7, 1),
+    "cascade": (_setup_cascade, 10**7, 1),
+    "toeplitz_hash": (_setup_toeplitz_hash, 10**7, 1),
+    "distill": (_setup_distill, 10**7, 1),
+}
+
+def measure(function, repeats=3):
+    """
+    Time a function and measure the peak of the memory it allocates.
+
+    Parameters
+    ----------
+        function : callable
+            The function to measure, called without arguments
+        repeats : int, optional
+            The number of timed calls, of which the fastest is kept
+
+    Returns
+    -------
+        seconds : float
+            The duration of the fastest call
+        peak_memory : int
+            The highest number of bytes allocated during a call
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), peak_memory
+
+def run_benchmarks(sizes=None, paths=None, repeats=3, output=sys.stdout):
+    """
+    Measure every path for every number of particles up to its maximum.
+
+    Parameters
+    ----------
+        sizes : list, optional
+            The numbers of particles, by default SIZES
+        paths : list, optional
+            The names of the paths in PATHS, by default all of them
+        repeats : int, optional
+            The number of timed calls of every measure
+        output : file, optional
+            Where a line is written for each measure, if None nothing
+            is written
+
+    Returns
+    -------
+        results : list
+            A dictionary for every measure, with the path, the size, the
+            seconds, the throughput in qubits/s and the peak memory
+    """
+    if sizes is None:
+        sizes = SIZES
+    if paths is None:
+        paths = list(PATHS)
+    unknown = set(paths) - set(PATHS)
+    if unknown:
+        raise ValueError(f"Unknown paths: {', '.join(sorted(unknown))}")
+    results = []
+    for path in paths:
+        setup, max_size, qubits_per_particle = PATHS[path]
+        for size in sizes:
+            if size > max_size:
+                continue
+            seconds, peak_memory = measure(setup(size), repeats)
+            result = {"path": path, "size": size, "seconds": seconds,
+                      "qubits_per_second":
+                          size*qubits_per_particle/max(seconds, 1e-12),
+                      "peak_memory": peak_memory}
+            results.append(result)
+            if output is not None:
+                print(f"{path:<24}{size:>10}{seconds:>12.5f} s"
+                      f"{result['qubits_per_second']:>14.3g} qubits/s"
+                      f"{peak_memory/2**20:>10.1f} MiB", file=output)
+    return results
+
+def save_results(results, path):
+    """Save the results as JSON, with the versions used to get them"""
+    report = {"python": platform.python_version(),
+              "numpy": np.__version__,
+              "results": results}
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+
+def load_results(path):
+    """Load the results saved by 'save_results'"""
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)["results"]
+
+def compare_results(results, baseline, tolerance=0.25):
+    """
+    Find the measures that are slower than the baseline by more than the
+    tolerance. Measures that are not in both lists are ignored.
+
+    Parameters
+    ----------
+        results : list
+            The new results, as returned by 'run_benchmarks'
+        baseline : list
+            The results to compare with
+        tolerance : float, optional
+            The accepted relative slowdown, 0.25 means 25% slower
+
+    Returns
+    -------
+        regressions : list
+            A dictionary for every slower measure, with the path, the
+            size and the ratio between the new and the old time
+    """
+    old_times = {(old["path"], old["size"]): old["seconds"]
+                 for old in baseline}
+    regressions = []
+    for new in results:
+        old_seconds = old_times.get((new["path"], new["size"]))
+        if old_seconds is None:
+            continue
+        ratio = new["seconds"]/max(old_seconds, 1e-12)
+        if ratio > 1 + tolerance:
+            regressions.append({"path": new["path"], "size": new["size"],
+                                "ratio": ratio})
+    return regressions
+
+def main(argv=None):
+    """
+    Run the benchmark from the terminal. Returns 1 if a path is slower
+    than the baseline, otherwise 0.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES,
+                        help="numbers of particles to measure")
+    parser.add_argument("--paths", nargs="+", choices=list(PATHS),
+                        help="paths to measure, by default all of them")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="timed calls of every measure")
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--baseline", help="JSON file of old results")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="accepted relative slowdown, default 0.25")
+    arguments = parser.parse_args(argv)
+    results = run_benchmarks(arguments.sizes, arguments.paths,
+                             arguments.repeats)
+    if arguments.output:
+        save_results(results, arguments.output)
+    if arguments.baseline:
+        regressions = compare_results(results,
+                                      load_results(arguments.baseline),
+                                      arguments.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression['path']} with "
+                  f"{regression['size']} particles is "
+                  f"{regression['ratio']:.2f} times slower")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""
+This module contains a persistent cache of the numbers of detections
+found by the sweeps of simulations, saved in a SQLite database.
+The runs of a point of a sweep are split in blocks of a fixed number of
+runs, and the runs of a block have random generators derived from the
+seed (see 'sweep.block_seed'), so the detections of a block depend only
+on the simulator, on the parameters of the protocol, on the seed and on
+the position of the block, and its first runs are the same whatever the
+number of runs simulated. These are the keys of the cache, which saves
+the outcome of every run simulated of a block. In this way asking for
+more runs of a point only simulates the runs that are not saved, also
+inside a block, and re-plotting a sweep doesn't simulate anything.
+The cache keeps at most 'max_blocks' blocks, and when it's full the ones
+used least recently are removed.
+"""
+import sqlite3
+import numpy as np
+
+#File used when no other is given
+DEFAULT_PATH = "bb84_cache.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outcomes (
+    simulator TEXT NOT NULL,
+    block_runs INTEGER NOT NULL,
+    particles INTEGER NOT NULL,
+    eavesdropping INTEGER NOT NULL,
+    percentage REAL NOT NULL,
+    seed TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    runs INTEGER NOT NULL,
+    outcomes BLOB NOT NULL,
+    last_used INTEGER NOT NULL,
+    PRIMARY KEY (simulator, block_runs, particles, eavesdropping,
+                 percentage, seed, block)
+);
+CREATE INDEX IF NOT EXISTS outcomes_last_used ON outcomes (last_used);
+"""
+
+_KEY = ("simulator = ? AND block_runs = ? AND particles = ? AND "
+        "eavesdropping = ? AND percentage = ? AND seed = ? AND block = ?")
+
+class ResultCache:
+    """
+    Cache of the detections of blocks of runs, saved in a file.
+
+    Parameters
+    ----------
+        path : string, optional
+            The file of the database, created if it doesn't exist, by
+            default DEFAULT_PATH. With ":memory:" nothing is saved.
+        max_blocks : int, optional
+            The maximum number of blocks kept, default 100000
+    """
+    def __init__(self, path=DEFAULT_PATH, max_blocks=100000):
+        if max_blocks < 1:
+            raise ValueError("The cache must keep at least 1 block")
+        self.max_blocks = max_blocks
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(_SCHEMA)
+        #Increasing counter that marks when every block was last used
+        self._clock = self.connection.execute(
+            "SELECT COALESCE(MAX(last_used), 0) FROM outcomes").fetchone()[0]
+
+    def __len__(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM outcomes").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Save the changes and close the database"""
+        self.connection.commit()
+        self.connection.close()
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def outcomes(self, point, block):
+        """
+        Return the outcomes of the runs of a block of a point saved in
+        the cache, true for the runs with a detection.
+
+        Parameters
+        ----------
+            point : tuple
+                The key of the point, see 'point_key'
+            block : int
+                The position of the block among the blocks of the point
+
+        Returns
+        -------
+            outcomes : ndarray
+                The outcomes of the first runs of the block, empty if the
+                block is not in the cache
+        """
+        values = (*point, block)
+        row = self.connection.execute(
+            f"SELECT runs, outcomes FROM outcomes WHERE {_KEY}",
+            values).fetchone()
+        if row is None:
+            return np.zeros(0, dtype=bool)
+        self.connection.execute(
+            f"UPDATE outcomes SET last_used = ? WHERE {_KEY}",
+            (self._tick(), *values))
+        runs, packed = row
+        return np.unpackbits(np.frombuffer(packed, dtype=np.uint8),
+                             count=runs).astype(bool)
+
+    def get(self, point, block, runs):
+        """
+        Return the detections of the first runs of a block of a point, or
+        None if they are not all in the cache.
+
+        Parameters
+        ----------
+            point : tuple
+                The key of the point, see 'point_key'
+            block : int
+                The position of the block among the blocks of the point
+            runs : int
+                The number of runs counted, at most the runs of a block
+
+        Returns
+        -------
+            detections : int or None
+                The number of runs with a detection
+        """
+        outcomes = self.outcomes(point, block)
+        if len(outcomes) < runs:
+            return None
+        return int(np.count_nonzero(outcomes[:runs]))
+
+    def put(self, point, block, outcomes):
+        """
+        Save the outcomes of the first runs of a block of a point, true
+        for the runs with a detection, replacing the ones saved before
+        and removing the blocks used least recently if the cache is full.
+        """
+        if len(outcomes) > point[1]:
+            raise ValueError("A block has at most block_runs runs")
+        packed = np.packbits(np.asarray(outcomes, dtype=bool)).tobytes()
+        self.connection.execute(
+            "INSERT OR REPLACE INTO outcomes VALUES (?, ?, ?, ?, ?, ?, ?, ?, "
+            "?, ?)", (*point, block, len(outcomes), packed, self._tick()))
+        excess = len(self) - self.max_blocks
+        if excess > 0:
+            self.connection.execute(
+                "DELETE FROM outcomes WHERE rowid IN (SELECT rowid FROM "
+                "outcomes ORDER BY last_used LIMIT ?)", (excess,))
+        self.connection.commit()
+
+    def count(self, point, number_of_runs, simulate_runs):
+        """
+        Count the detections of the first 'number_of_runs' runs of a
+        point, taking from the cache the runs already simulated and
+        simulating and saving the others.
+
+        Parameters
+        ----------
+            point : tuple
+                The key of the point, see 'point_key'
+            number_of_runs : int
+                The number of runs
+            simulate_runs : callable
+                Called as simulate_runs(block, start, stop) for the runs
+                of a block that are missing, returns the outcome of every
+                run from 'start' to 'stop', true for a detection
+
+        Returns
+        -------
+            detections : int
+                The number of runs with a detection
+        """
+        block_runs = point[1]
+        detections = 0
+        for block, start in enumerate(range(0, number_of_runs, block_runs)):
+            runs = min(block_runs, number_of_runs - start)
+            outcomes = self.outcomes(point, block)
+            if len(outcomes) < runs:
+                outcomes = np.concatenate((outcomes, np.asarray(
+                    simulate_runs(block, len(outcomes), runs), dtype=bool)))
+                self.put(point, block, outcomes)
+            detections += int(np.count_nonzero(outcomes[:runs]))
+        return detections
+
+def point_key(simulator, block_runs, particles, eavesdropping, percentage,
+              seed):
+    """
+    Create the key of a point of a sweep.
+
+    Parameters
+    ----------
+        simulator : string
+            The name and the version of the simulator, which must change
+            when the same seed starts giving different results
+        block_runs : int
+            The maximum number of runs of a block
+        particles : int
+            The number of particles of every run
+        eavesdropping : bool
+            Flag of the runs with or without eavesdropping
+        percentage : float
+            Percentage of the shared bits compared
+        seed : int
+            The master seed of the sweep
+
+    Returns
+    -------
+        point : tuple
+            The key, as used by the methods of ResultCache
+    """
+    return (simulator, int(block_runs), int(particles), int(eavesdropping),
+            float(percentage), str(seed))
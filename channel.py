@@ -0,0 +1,176 @@
+"""
+This module contains a model of a realistic channel between the sender
+and the receiver, to replace the perfect one of the other simulations.
+Particles are lost in the fibre and in the detector, the detector can
+click without a particle (dark count) and the state can be depolarized
+or flipped along the way. All the random choices are drawn for all the
+particles at once, and 'link_grid' also skips the lost particles by
+drawing only the number of clicks, so that grids of distances and noise
+levels can be simulated with millions of particles per point.
+"""
+from dataclasses import dataclass
+import numpy as np
+import engine
+import randomness
+
+@dataclass
+class Channel:
+    """
+    Parameters of the channel and of the detector of the receiver.
+
+    Attributes
+    ----------
+        length_km : float
+            Length of the fibre in km, default 0
+        attenuation : float
+            Attenuation of the fibre in dB/km, default 0.2
+        detector_efficiency : float
+            Probability that the detector clicks when a particle
+            arrives, default 1
+        dark_count_probability : float
+            Probability that the detector clicks without a particle,
+            giving a random result, default 0
+        depolarization : float
+            Probability that the state is replaced by a random one,
+            which is an error half of the times, default 0
+        flip_probability : float
+            Probability that the value of the state is flipped, default 0
+    """
+    length_km: float = 0.
+    attenuation: float = 0.2
+    detector_efficiency: float = 1.
+    dark_count_probability: float = 0.
+    depolarization: float = 0.
+    flip_probability: float = 0.
+
+    @property
+    def transmittance(self):
+        """Probability that a particle is detected by the receiver"""
+        loss = 10**(-self.attenuation*self.length_km/10)
+        return loss*self.detector_efficiency
+
+    @property
+    def error_probability(self):
+        """Probability of an error on a detected particle"""
+        random_state = self.depolarization/2
+        return (random_state*(1 - self.flip_probability)
+                + (1 - random_state)*self.flip_probability)
+
+    def add_noise(self, values, rng):
+        """
+        Depolarize and flip the values of the states, without losses.
+
+        Parameters
+        ----------
+            values : ndarray
+                The values of the states sent
+            rng : RandomSource
+                The source of randomness
+
+        Returns
+        -------
+            values : ndarray
+                The values of the states after the noise
+        """
+        shape = np.shape(values)
+        depolarized = rng.random(shape) < self.depolarization
+        values = np.where(depolarized, rng.bits(shape), values)
+        flipped = rng.random(shape) < self.flip_probability
+        return values ^ flipped.astype(values.dtype)
+
+    def transmit(self, bases, values, rng):
+        """
+        Send the states through the channel.
+
+        Parameters
+        ----------
+            bases : ndarray
+                The bases of the states sent
+            values : ndarray
+                The values of the states sent
+            rng : RandomSource
+                The source of randomness
+
+        Returns
+        -------
+            values : ndarray
+                The values of the states that arrive, after the noise
+            detected : ndarray
+                An array of bool, true where the detector clicks
+        """
+        shape = np.shape(bases)
+        arrived = rng.random(shape) < self.transmittance
+        #A dark count without a particle gives a random result
+        dark = ~arrived & (rng.random(shape) < self.dark_count_probability)
+        values = self.add_noise(values, rng)
+        values = np.where(dark, rng.bits(shape), values)
+        return values, arrived | dark
+
+def link_grid(lengths_km, error_probabilities, n_pulses, channel=None,
+              eavesdropping=False, rng=None):
+    """
+    Simulate a link for every combination of fibre length and flip
+    probability. The number of clicks of every point is drawn from the
+    binomial distribution, and then only the particles that were detected
+    are simulated, all together with arrays.
+
+    Parameters
+    ----------
+        lengths_km : array_like
+            The lengths of the fibre
+        error_probabilities : array_like
+            The flip probabilities of the channel
+        n_pulses : int
+            The number of particles sent for each point of the grid
+        channel : Channel, optional
+            The other parameters of the channel, by default the ones of
+            a Channel()
+        eavesdropping : bool, optional
+            Flag to simulate the links with or without eavesdropping
+        rng : RandomSource, Generator or int, optional
+            The source of randomness, or a NumPy generator or a seed
+            to create one
+
+    Returns
+    -------
+        sifted : ndarray
+            The number of shared bits of every point, with shape
+            (len(lengths_km), len(error_probabilities))
+        errors : ndarray
+            The number of errors in the shared bits of every point
+    """
+    rng = randomness.as_source(rng)
+    if channel is None:
+        channel = Channel()
+    lengths = np.asarray(lengths_km, dtype=float)[:, None]
+    flips = np.asarray(error_probabilities, dtype=float)[None, :]
+    shape = np.broadcast(lengths, flips).shape
+    transmittance = (10**(-channel.attenuation*lengths/10)
+                     *channel.detector_efficiency)
+    transmittance = np.broadcast_to(transmittance, shape)
+    generator = rng.generator()
+    arrived = generator.binomial(n_pulses, transmittance)
+    dark = generator.binomial(n_pulses - arrived,
+                              channel.dark_count_probability)
+    sifted = np.zeros(shape, dtype=np.int64)
+    errors = np.zeros(shape, dtype=np.int64)
+    for point in np.ndindex(shape):
+        point_channel = Channel(depolarization=channel.depolarization,
+                                flip_probability=flips[0, point[1]])
+        #Only the particles that clicked need to be simulated, the first
+        #ones arrived and the last ones are dark counts
+        clicks = arrived[point] + dark[point]
+        sender_bases, sender_values = engine.prepare(clicks, rng)
+        sent_bases, sent_values = sender_bases, sender_values
+        if eavesdropping:
+            sent_bases, sent_values = engine.measure(sender_bases,
+                                                     sender_values, rng)
+        sent_values = point_channel.add_noise(sent_values, rng)
+        sent_values[arrived[point]:] = rng.bits(dark[point])
+        receiver_bases, receiver_values = engine.measure(sent_bases,
+                                                         sent_values, rng)
+        shared = sender_bases == receiver_bases
+        sifted[point] = np.count_nonzero(shared)
+        errors[point] = np.count_nonzero(shared
+                                         & (sender_values != receiver_values))
+    return sifted, errors
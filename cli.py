@@ -0,0 +1,202 @@
+"""
+This module contains the command line interface of the simulation. The
+'run' command simulates the protocol with the array-backed engine, which
+only needs NumPy, and prints the results as a table, as JSON or as CSV;
+with --explain every step is explained with the DataFrames of
+'simulation.py' instead. The 'graph' command draws the detection rate
+for increasing numbers of particles, like 'graph.simulate_and_graph'.
+Pandas and matplotlib are imported only by the commands that use them,
+so the simulations start as quickly as NumPy does.
+
+    python cli.py run --particles 100000 --runs 10 --eavesdropping
+    python cli.py run --particles 20 --explain
+    python cli.py run --particles 100000 --sender-z 0.9 --receiver-z 0.9
+    python cli.py graph --particles 100 --runs 1000 --batch
+"""
+import argparse
+import csv
+import json
+import math
+import sys
+import engine
+import randomness
+
+#Columns of the results of the runs
+FIELDS = ("run", "sifted_length", "errors", "sample_size", "mismatches",
+          "qber", "interference")
+
+def _add_biases(command):
+    """Add the options of the probabilities of the base Z to a command"""
+    command.add_argument("--sender-z", type=float, default=0.5,
+                         help="probability that Alice chooses Z, 0.5")
+    command.add_argument("--receiver-z", type=float, default=0.5,
+                         help="probability that Bob chooses Z, 0.5")
+
+def _parser():
+    """Create the parser of the arguments"""
+    parser = argparse.ArgumentParser(
+        prog="cli.py", description="Simulation of the BB84 protocol")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="simulate the protocol")
+    run.add_argument("--particles", type=int, default=1000,
+                     help="particles of every run, default 1000")
+    run.add_argument("--runs", type=int, default=1,
+                     help="number of runs, default 1")
+    run.add_argument("--seed", type=int,
+                     help="seed of the random numbers, random by default")
+    run.add_argument("--eavesdropping", action="store_true",
+                     help="simulate Eve between Alice and Bob")
+    run.add_argument("--percentage", type=float, default=0.5,
+                     help="fraction of the shared bits compared, 0.5")
+    run.add_argument("--format", choices=("text", "json", "csv"),
+                     default="text", help="format of the results")
+    run.add_argument("--explain", action="store_true",
+                     help="explain every step, with pandas")
+    _add_biases(run)
+    graph = commands.add_parser("graph", help="plot the detection rate")
+    graph.add_argument("--particles", type=int, default=100,
+                       help="largest number of particles, default 100")
+    graph.add_argument("--runs", type=int, default=5,
+                       help="runs for every number of particles, 5")
+    graph.add_argument("--seed", type=int,
+                       help="seed of the random numbers, random by default")
+    graph.add_argument("--batch", action="store_true",
+                       help="simulate with the array-backed engine")
+    graph.add_argument("--analytic", action="store_true",
+                       help="also draw the exact detection rate")
+    graph.add_argument("--width", type=float,
+                       help="run until the confidence interval is this wide")
+    graph.add_argument("--output", help="save the graph in this file")
+    _add_biases(graph)
+    return parser
+
+def simulate(particles, runs, seed=None, eavesdropping=False,
+             percentage=0.5, explain=False, sender_z_probability=0.5,
+             receiver_z_probability=0.5):
+    """
+    Simulate the protocol 'runs' times.
+
+    Parameters
+    ----------
+        particles : int
+            The number of particles of every run
+        runs : int
+            The number of runs
+        seed : int, optional
+            The seed of the random numbers, random if None
+        eavesdropping : bool, optional
+            Flag to simulate with or without eavesdropping
+        percentage : float, optional
+            Percentage of the shared bits compared, defaults to 0.5
+        explain : bool, optional
+            Flag to explain every step with 'simulation.py'
+        sender_z_probability : float, optional
+            The probability that the sender chooses the base Z
+        receiver_z_probability : float, optional
+            The probability that the receiver chooses the base Z, with
+            biased bases only the rare base is compared
+
+    Returns
+    -------
+        results : list
+            A dictionary with the FIELDS of every run
+    """
+    biases = {"sender_z_probability": sender_z_probability,
+              "receiver_z_probability": receiver_z_probability}
+    if explain:
+        #The didactic version and pandas are imported only when needed
+        import pandas as pd
+        import simulation
+        #Change a pandas setting to show a long dataframe without newlines
+        pd.set_option('display.expand_frame_repr', False)
+        rng = None if seed is None else randomness.as_source(seed)
+        protocol_results = [simulation.run_protocol(
+            particles, eavesdropping=eavesdropping, rng=rng,
+            percentage=percentage, **biases)
+                            for _ in range(runs)]
+    else:
+        rng = randomness.as_source(seed)
+        protocol_results = [engine.run_protocol(particles, eavesdropping,
+                                                percentage, rng=rng,
+                                                **biases)
+                            for _ in range(runs)]
+    return [{"run": run, "sifted_length": result.sifted_length,
+             "errors": result.errors, "sample_size": result.sample_size,
+             "mismatches": result.mismatches, "qber": result.qber,
+             "interference": result.interference}
+            for run, result in enumerate(protocol_results)]
+
+def write_results(results, output_format, file=None):
+    """
+    Write the results of the runs as a table ('text'), as JSON or as CSV,
+    on 'file' or on the standard output.
+    """
+    if file is None:
+        file = sys.stdout
+    detection_rate = (sum(result["interference"] for result in results)
+                      / max(len(results), 1))
+    if output_format == "json":
+        #NaN is not valid JSON, the error rate of an empty sample is null
+        rows = [{**result, "qber": None if math.isnan(result["qber"])
+                 else result["qber"]} for result in results]
+        json.dump({"runs": rows, "detection_rate": detection_rate}, file,
+                  indent=2)
+        print(file=file)
+    elif output_format == "csv":
+        writer = csv.DictWriter(file, FIELDS, lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(results)
+    else:
+        print("".join(f"{field:>15}" for field in FIELDS), file=file)
+        for result in results:
+            print("".join(f"{result[field]:>15.4f}"
+                          if isinstance(result[field], float)
+                          else f"{str(result[field]):>15}"
+                          for field in FIELDS), file=file)
+        print(f"Detection rate: {detection_rate:.4f}", file=file)
+
+def main(argv=None):
+    """
+    Run a command of the command line interface.
+
+    Parameters
+    ----------
+        argv : list, optional
+            The arguments, by default the ones of the command line
+
+    Returns
+    -------
+        int
+            The exit status, 0 if there were no errors
+    """
+    parser = _parser()
+    arguments = parser.parse_args(argv)
+    if arguments.particles < 1 or arguments.runs < 1:
+        parser.error("particles and runs must be at least 1")
+    if not (0 < arguments.sender_z < 1 and 0 < arguments.receiver_z < 1):
+        parser.error("the probabilities of Z must be between 0 and 1")
+    if arguments.command == "run":
+        results = simulate(arguments.particles, arguments.runs,
+                           arguments.seed, arguments.eavesdropping,
+                           arguments.percentage, arguments.explain,
+                           arguments.sender_z, arguments.receiver_z)
+        write_results(results, arguments.format)
+    else:
+        #The modules of the graphs are imported only by this command
+        import random
+        import numpy as np
+        import graph
+        if arguments.seed is not None:
+            #The simulations of 'simulation.py' use the global generators
+            np.random.seed(arguments.seed)
+            random.seed(arguments.seed)
+        graph.simulate_and_graph(arguments.runs, arguments.particles,
+                                 arguments.batch, arguments.analytic,
+                                 seed=arguments.seed, width=arguments.width,
+                                 output=arguments.output,
+                                 sender_z_probability=arguments.sender_z,
+                                 receiver_z_probability=arguments.receiver_z)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
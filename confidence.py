@@ -0,0 +1,112 @@
+"""
+This module contains the confidence intervals of a rate estimated by
+counting the successes of repeated runs, like the failure rates of the
+simulations in 'graph.py'. The Wilson score interval is quick and
+accurate even when the rate is close to 0 or 1, while the
+Clopper-Pearson interval is exact, found by bisection on the tails of
+the binomial distribution, and slightly wider. The quantiles of the
+normal distribution are taken from statistics.NormalDist.
+"""
+import math
+from statistics import NormalDist
+import numpy as np
+
+def _z_score(confidence):
+    """Quantile of the normal distribution for a two-sided interval"""
+    if not 0 < confidence < 1:
+        raise ValueError("The confidence must be between 0 and 1")
+    return NormalDist().inv_cdf(0.5 + confidence/2)
+
+def wilson_interval(successes, trials, confidence=0.95):
+    """
+    Wilson score interval of a rate.
+
+    Parameters
+    ----------
+        successes : int
+            The number of successes
+        trials : int
+            The number of trials
+        confidence : float, optional
+            The probability that the interval contains the rate,
+            default 0.95
+
+    Returns
+    -------
+        lower : float
+            The lower end of the interval
+        upper : float
+            The upper end of the interval
+    """
+    if trials == 0:
+        return 0., 1.
+    z = _z_score(confidence)
+    rate = successes/trials
+    denominator = 1 + z**2/trials
+    center = (rate + z**2/(2*trials))/denominator
+    half_width = (z*math.sqrt(rate*(1 - rate)/trials + z**2/(4*trials**2))
+                  /denominator)
+    return max(center - half_width, 0.), min(center + half_width, 1.)
+
+def _binomial_cdf(successes, trials, rate, log_factorials):
+    """Probability of at most 'successes' successes in 'trials' trials"""
+    if rate <= 0:
+        return 1.
+    if rate >= 1:
+        return 1. if successes >= trials else 0.
+    k = np.arange(successes + 1)
+    log_pmf = (log_factorials[trials] - log_factorials[k]
+               - log_factorials[trials - k] + k*math.log(rate)
+               + (trials - k)*math.log1p(-rate))
+    return float(np.exp(log_pmf).sum())
+
+def _bisect(function, target, increasing):
+    """Find the rate in [0, 1] where a monotonic function is 'target'"""
+    low, high = 0., 1.
+    for _ in range(60):
+        middle = (low + high)/2
+        if (function(middle) < target) == increasing:
+            low = middle
+        else:
+            high = middle
+    return (low + high)/2
+
+def clopper_pearson_interval(successes, trials, confidence=0.95):
+    """
+    Exact Clopper-Pearson interval of a rate, with the same parameters
+    and results of 'wilson_interval'.
+    """
+    if trials == 0:
+        return 0., 1.
+    _z_score(confidence)
+    alpha = 1 - confidence
+    log_factorials = np.concatenate(([0.],
+                                     np.cumsum(np.log(np.arange(1,
+                                                                trials + 1)))))
+    lower = 0.
+    if successes > 0:
+        #Lowest rate for which 'successes' or more are likely enough
+        lower = _bisect(lambda rate: 1 - _binomial_cdf(successes - 1, trials,
+                                                       rate, log_factorials),
+                        alpha/2, increasing=True)
+    upper = 1.
+    if successes < trials:
+        #Highest rate for which 'successes' or fewer are likely enough
+        upper = _bisect(lambda rate: _binomial_cdf(successes, trials, rate,
+                                                   log_factorials),
+                        alpha/2, increasing=False)
+    return lower, upper
+
+#Intervals that can be chosen by name
+METHODS = {"wilson": wilson_interval,
+           "clopper-pearson": clopper_pearson_interval}
+
+def interval(successes, trials, confidence=0.95, method="wilson"):
+    """
+    Confidence interval of a rate, with the method chosen by name among
+    'wilson' and 'clopper-pearson'.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method}, use one of "
+                         f"{', '.join(METHODS)}")
+    return METHODS[method](successes, trials, confidence)
@@ -0,0 +1,607 @@
+"""
+This module contains an array-backed version of the BB84 protocol
+simulated in 'simulation.py'. Bases and values are stored in NumPy
+arrays of 0s and 1s instead of DataFrames, so every step of the protocol
+is done on all the particles at once, without loops in Python and
+without printing anything. This is the engine to use when the number of
+particles is large, while 'simulation.py' remains the didactic version
+that explains every step.
+"""
+import math
+from dataclasses import dataclass, field
+import numpy as np
+import randomness
+
+#Maximum number of words of 64 particles handled at once by 'run_batch',
+#which bounds the memory used by its 2-D arrays
+BATCH_WORDS = 1 << 18
+
+#Version of the results of the engine, to increase when the same random
+#numbers start giving different results, like simulation.VERSION
+VERSION = 1
+
+#Bases are coded as integers instead of the strings used in simulation.py
+X_BASE = 0
+Z_BASE = 1
+
+#Binary digits of the probability of the bits drawn by '_biased_words'
+BIAS_BITS = 32
+
+#Number of set bits of every possible byte, used when NumPy is too old to
+#have np.bitwise_count
+_BYTE_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)],
+                          dtype=np.uint8)
+
+@dataclass
+class ProtocolResult:
+    """
+    Summary of a complete run of the protocol, with the numbers that
+    'simulation.compare_keys' explains when printing.
+
+    Attributes
+    ----------
+        sifted_length : int
+            Number of bits of the shared key, before the comparison
+        errors : int
+            Number of bits of the shared key that don't match
+        sample_size : int
+            Number of bits compared publicly
+        mismatches : int
+            Number of compared bits that don't match
+        interference : bool
+            True if there was interference or if the key was too small
+            to be compared
+        key_indexes : ndarray
+            Indexes of the shared bits that were not compared, which
+            form the key, None when they are not kept
+    """
+    sifted_length: int
+    errors: int
+    sample_size: int
+    mismatches: int
+    interference: bool
+    key_indexes: np.ndarray = field(default=None, compare=False, repr=False)
+
+    @property
+    def qber(self):
+        """Error rate measured on the compared bits, nan without them"""
+        if self.sample_size == 0:
+            return math.nan
+        return self.mismatches/self.sample_size
+
+def rare_base(sender_z_probability=0.5, receiver_z_probability=0.5):
+    """
+    Find the base in which the sender and the receiver agree less often,
+    which is the one used to check the key when the bases are biased.
+
+    Parameters
+    ----------
+    sender_z_probability : float, optional
+        The probability that the sender chooses the base Z
+    receiver_z_probability : float, optional
+        The probability that the receiver chooses the base Z
+
+    Returns
+    -------
+    base: int
+        X_BASE or Z_BASE, or None when both choose with equal
+        probabilities and the whole key is checked like in the original
+        protocol
+    """
+    for probability in (sender_z_probability, receiver_z_probability):
+        if not 0 < probability < 1:
+            raise ValueError("The probability of the base Z must be "
+                             "between 0 and 1")
+    if sender_z_probability == receiver_z_probability == 0.5:
+        return None
+    both_z = sender_z_probability*receiver_z_probability
+    both_x = (1 - sender_z_probability)*(1 - receiver_z_probability)
+    return Z_BASE if both_z < both_x else X_BASE
+
+def choose_bases(n_particles, rng, z_probability=0.5):
+    """
+    Create an array of random choices of orthogonal bases for the
+    quantum measurement, coded as X_BASE (0) and Z_BASE (1).
+
+    Parameters
+    ----------
+    n_particles : integer or tuple
+        Specifies the number of bases that will be chosen, or the shape
+        of the array of bases
+    rng : RandomSource
+        The source of randomness used for the choice
+    z_probability : float, optional
+        The probability of choosing Z, 0.5 by default
+
+    Returns
+    -------
+    bases: ndarray
+        An array of uint8 with shape n_particles of random 0s and 1s
+    """
+    if z_probability == 0.5:
+        return rng.bits(n_particles)
+    return (rng.random(n_particles) < z_probability).astype(np.uint8)
+
+def prepare(n_particles, rng, z_probability=0.5):
+    """
+    Emulates the preparation of the states done by the sender, choosing
+    random bases and obtaining random values.
+
+    Parameters
+    ----------
+    n_particles : integer or tuple
+        Specifies the number of particles that will be prepared, or the
+        shape of the arrays of bases and values
+    rng : RandomSource
+        The source of randomness used for the preparation
+    z_probability : float, optional
+        The probability of choosing the base Z, 0.5 by default
+
+    Returns
+    -------
+    bases: ndarray
+        The bases chosen for the preparation
+    values: ndarray
+        The values of the prepared states, random 0s and 1s
+    """
+    bases = choose_bases(n_particles, rng, z_probability)
+    values = rng.bits(n_particles)
+    return bases, values
+
+def measure(bases, values, rng, z_probability=0.5):
+    """
+    Emulates the measurement of received states done with random bases.
+    When the base chosen matches the one of the state the value is kept,
+    otherwise the result is random.
+
+    Parameters
+    ----------
+    bases : ndarray
+        The bases of the states that get received
+    values : ndarray
+        The values of the states that get received
+    rng : RandomSource
+        The source of randomness used for the measurement
+    z_probability : float, optional
+        The probability of choosing the base Z, 0.5 by default
+
+    Returns
+    -------
+    measured_bases: ndarray
+        The bases chosen for the measurement
+    measured_values: ndarray
+        The results of the measurement
+    """
+    shape = np.shape(bases)
+    measured_bases = choose_bases(shape, rng, z_probability)
+    random_values = rng.bits(shape)
+    measured_values = np.where(measured_bases == bases, values, random_values)
+    return measured_bases, measured_values
+
+def sift(sender_bases, receiver_bases):
+    """
+    Compares two arrays of bases and finds where they match, which are
+    the positions that form the shared key.
+
+    Parameters
+    ----------
+    sender_bases : ndarray
+        One of the two arrays of bases to compare
+    receiver_bases : ndarray
+        One of the two arrays of bases to compare
+
+    Returns
+    -------
+    shared_indexes: ndarray
+        The indexes in which both the sender and the receiver chose the
+        same base
+    """
+    return np.flatnonzero(sender_bases == receiver_bases)
+
+def compare_keys(shared_indexes, sender_values, receiver_values, rng,
+                 percentage=0.5, threshold=0., candidates=None):
+    """
+    Compare the values in a random sample of the shared indexes, with
+    the same rules of 'simulation.compare_keys'.
+
+    Parameters
+    ----------
+        shared_indexes : ndarray
+            The indexes of the values that form the shared key
+        sender_values : ndarray
+            The complete values of the sender
+        receiver_values : ndarray
+            The complete values of the receiver
+        rng : RandomSource
+            The source of randomness used for the sample
+        percentage : float, optional
+            Percentage of bits that will be compared, defaults to 0.5
+        threshold : float, optional
+            Highest error rate in the sample that is accepted, defaults
+            to 0 so that any mismatch is an interference
+        candidates : ndarray, optional
+            The positions in 'shared_indexes' of the bits that can be
+            compared, like the ones of the rare base when the bases are
+            biased, all of them if None
+
+    Returns
+    -------
+        result : ProtocolResult
+            The summary of the comparison
+    """
+    errors = int(np.count_nonzero(sender_values[shared_indexes]
+                                  != receiver_values[shared_indexes]))
+    if candidates is None:
+        samples_number = round(percentage*len(shared_indexes))
+        sample_positions = rng.choice(len(shared_indexes), samples_number)
+    else:
+        samples_number = round(percentage*len(candidates))
+        sample_positions = candidates[rng.choice(len(candidates),
+                                                 samples_number)]
+    chosen_bits = shared_indexes[sample_positions]
+    mismatches = int(np.count_nonzero(sender_values[chosen_bits]
+                                      != receiver_values[chosen_bits]))
+    #The bits that were not disclosed form the key
+    in_key = np.ones(len(shared_indexes), dtype=bool)
+    in_key[sample_positions] = False
+    #If the key was too small with no bits in sample, it's an interference
+    interference = (samples_number == 0
+                    or mismatches > threshold*samples_number)
+    return ProtocolResult(sifted_length=len(shared_indexes), errors=errors,
+                          sample_size=samples_number, mismatches=mismatches,
+                          interference=interference,
+                          key_indexes=shared_indexes[in_key])
+
+def run_protocol(n_particles=1000, eavesdropping=False, percentage=0.5,
+                 channel=None, threshold=0., rng=None,
+                 sender_z_probability=0.5, receiver_z_probability=0.5):
+    """
+    Run the complete simulation on arrays, without printing, and return
+    the numbers of the final comparison of the keys.
+
+    Parameters
+    ----------
+        n_particles : int, optional
+            How many particles will be used
+        eavesdropping : bool, optional
+            Flag to start the simulation with or without eavesdropping
+        percentage : float, optional
+            Percentage of the shared bits compared, defaults to 0.5
+        channel : Channel, optional
+            The channel between sender and receiver, perfect if None
+        threshold : float, optional
+            Highest error rate in the sample that is accepted, defaults
+            to 0
+        rng : RandomSource, Generator or int, optional
+            The source of randomness, or a NumPy generator or a seed
+            to create one
+        sender_z_probability : float, optional
+            The probability that the sender chooses the base Z
+        receiver_z_probability : float, optional
+            The probability that the receiver chooses the base Z. With
+            biased bases only the shared bits of the rare base are
+            compared, see 'rare_base', while Eve still chooses her bases
+            with equal probabilities
+
+    Returns
+    -------
+        result : ProtocolResult
+            The summary of the run
+    """
+    if n_particles<1:
+        raise ValueError("Invalid number of particles, use at least 1")
+    sample_base = rare_base(sender_z_probability, receiver_z_probability)
+    rng = randomness.as_source(rng)
+    sender_bases, sender_values = prepare(n_particles, rng,
+                                          sender_z_probability)
+    if eavesdropping:
+        #Eve measures the states and sends to Bob what she obtained
+        sent_bases, sent_values = measure(sender_bases, sender_values, rng)
+    else:
+        sent_bases, sent_values = sender_bases, sender_values
+    detected = None
+    if channel is not None:
+        sent_values, detected = channel.transmit(sent_bases, sent_values, rng)
+    receiver_bases, receiver_values = measure(sent_bases, sent_values, rng,
+                                              receiver_z_probability)
+    shared_indexes = sift(sender_bases, receiver_bases)
+    if detected is not None:
+        #Particles that didn't reach the detector are discarded
+        shared_indexes = shared_indexes[detected[shared_indexes]]
+    candidates = None
+    if sample_base is not None:
+        candidates = np.flatnonzero(sender_bases[shared_indexes]
+                                    == sample_base)
+    return compare_keys(shared_indexes, sender_values, receiver_values, rng,
+                        percentage, threshold, candidates)
+
+def run(n_particles=1000, eavesdropping=False, percentage=0.5, rng=None):
+    """
+    Run the complete simulation on arrays, without printing.
+
+    Parameters
+    ----------
+        n_particles : int, optional
+            How many particles will be used
+        eavesdropping : bool, optional
+            Flag to start the simulation with or without eavesdropping
+        percentage : float, optional
+            Percentage of the shared bits compared, defaults to 0.5
+        rng : RandomSource, Generator or int, optional
+            The source of randomness, or a NumPy generator or a seed
+            to create one
+
+    Returns
+    -------
+        interference : bool
+            Is true if there was some interference, otherwise it's false
+    """
+    return run_protocol(n_particles, eavesdropping, percentage,
+                        rng=rng).interference
+
+def popcount(packed, axis=None):
+    """
+    Count the bits set to 1 in a buffer of packed bits, along 'axis'.
+
+    Parameters
+    ----------
+        packed : ndarray
+            Packed bits, of any unsigned integer type
+        axis : int, optional
+            The last axis, along which to count, by default the whole
+            buffer
+
+    Returns
+    -------
+        int or ndarray
+            The number of bits set to 1
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(packed).sum(axis=axis, dtype=np.int64)
+    packed_bytes = packed.view(np.uint8)
+    if axis is not None:
+        packed_bytes = packed_bytes.reshape(packed.shape[:-1] + (-1,))
+    return _BYTE_POPCOUNT[packed_bytes].sum(axis=axis, dtype=np.int64)
+
+def _biased_words(shape, probability, rng):
+    """
+    Draw an array of uint64 whose bits are 1 with 'probability', rounded
+    to BIAS_BITS binary digits. Starting from 0 and from the last digit,
+    every digit 1 sets the bits of a new random word and every digit 0
+    clears them, so each digit halves the probability and adds itself.
+    """
+    if probability == 0.5:
+        return rng.words(shape)
+    digits = min(max(round(probability*2**BIAS_BITS), 1), 2**BIAS_BITS - 1)
+    words = np.zeros(shape, dtype=np.uint64)
+    #The digits 0 after the last 1 would clear words that are already 0
+    for position in range((digits & -digits).bit_length() - 1, BIAS_BITS):
+        if digits >> position & 1:
+            words |= rng.words(shape)
+        else:
+            words &= rng.words(shape)
+    return words
+
+def _run_batch_chunk(n_particles, n_runs, eavesdropping, percentage, rng,
+                     sender_z_probability=0.5, receiver_z_probability=0.5):
+    """
+    Run 'n_runs' simulations as the rows of 2-D arrays. To make the runs
+    fast, each element of the arrays is a uint64 word whose bits are 64
+    successive particles, so every measurement is done with bitwise
+    operations on 64 particles at once.
+    """
+    n_words = -(-n_particles//64)
+    shape = (n_runs, n_words)
+    #Bits after the last particle in the last word must be ignored
+    valid = np.full(n_words, np.iinfo(np.uint64).max, dtype=np.uint64)
+    if n_particles % 64:
+        valid[-1] = np.uint64((1 << (n_particles % 64)) - 1)
+    sender_bases = _biased_words(shape, sender_z_probability, rng)
+    sender_values = rng.words(shape)
+    sent_bases, sent_values = sender_bases, sender_values
+    if eavesdropping:
+        #Eve keeps the value where her base matches, otherwise it's random
+        eve_bases = rng.words(shape)
+        same_base = ~(eve_bases ^ sender_bases)
+        sent_values = ((same_base & sender_values)
+                       | (~same_base & rng.words(shape)))
+        sent_bases = eve_bases
+    receiver_bases = _biased_words(shape, receiver_z_probability, rng)
+    same_base = ~(receiver_bases ^ sent_bases)
+    receiver_values = ((same_base & sent_values)
+                       | (~same_base & rng.words(shape)))
+    shared = ~(sender_bases ^ receiver_bases) & valid
+    #With biased bases only the shared bits of the rare base are sampled
+    sample_base = rare_base(sender_z_probability, receiver_z_probability)
+    if sample_base == Z_BASE:
+        shared &= sender_bases
+    elif sample_base == X_BASE:
+        shared &= ~sender_bases
+    errors = shared & (sender_values ^ receiver_values)
+    shared_number = popcount(shared, axis=1)
+    errors_number = popcount(errors, axis=1)
+    #Same rounding of 'compare_keys', np.round also rounds half to even
+    samples_number = np.round(percentage*shared_number).astype(np.int64)
+    #The errors found in a sample without replacement of the shared bits
+    #follow the hypergeometric distribution, so the sample doesn't need
+    #to be drawn bit by bit
+    errors_found = rng.hypergeometric(errors_number,
+                                      shared_number - errors_number,
+                                      samples_number)
+    return (samples_number == 0) | (errors_found > 0)
+
+def run_batch(n_particles, n_runs, eavesdropping=True, percentage=0.5,
+              rng=None, sender_z_probability=0.5, receiver_z_probability=0.5):
+    """
+    Run the complete simulation many times with the same number of
+    particles. All the runs are done together as the rows of 2-D arrays,
+    split in chunks of at most BATCH_WORDS words of 64 particles.
+
+    Parameters
+    ----------
+        n_particles : int
+            How many particles will be used in each run
+        n_runs : int
+            How many times the simulation will run
+        eavesdropping : bool, optional
+            Flag to run the simulations with or without eavesdropping,
+            defaults to True
+        percentage : float, optional
+            Percentage of the shared bits compared, defaults to 0.5
+        rng : RandomSource, Generator or int, optional
+            The source of randomness, or a NumPy generator or a seed
+            to create one
+        sender_z_probability : float, optional
+            The probability that the sender chooses the base Z
+        receiver_z_probability : float, optional
+            The probability that the receiver chooses the base Z, like
+            in 'run_protocol'. Every biased array of bases draws up to
+            BIAS_BITS random words, so biased runs are slower
+
+    Returns
+    -------
+        interferences : ndarray
+            An array of bool with the result of every run, true if there
+            was some interference or the key was too small
+    """
+    if n_particles<1:
+        raise ValueError("Invalid number of particles, use at least 1")
+    #Checks the probabilities before simulating anything
+    rare_base(sender_z_probability, receiver_z_probability)
+    rng = randomness.as_source(rng)
+    chunk_runs = max(1, BATCH_WORDS//-(-n_particles//64))
+    interferences = np.empty(n_runs, dtype=bool)
+    for start in range(0, n_runs, chunk_runs):
+        stop = min(start + chunk_runs, n_runs)
+        interferences[start:stop] = _run_batch_chunk(
+            n_particles, stop - start, eavesdropping, percentage, rng,
+            sender_z_probability, receiver_z_probability)
+    return interferences
+
+def stream_shared(n_particles, chunk_size=1 << 20, eavesdropping=False,
+                  rng=None):
+    """
+    Run the protocol up to the comparison of the bases on successive
+    chunks of particles, so that only one chunk is in memory at a time.
+
+    Parameters
+    ----------
+        n_particles : int
+            How many particles will be used in total
+        chunk_size : int, optional
+            How many particles are simulated together, default 2^20
+        eavesdropping : bool, optional
+            Flag to start the simulation with or without eavesdropping
+        rng : RandomSource, Generator or int, optional
+            The source of randomness, or a NumPy generator or a seed
+            to create one
+
+    Yields
+    ------
+        sender_key : ndarray
+            The values of the sender on the shared bases of the chunk
+        receiver_key : ndarray
+            The values of the receiver on the shared bases of the chunk
+    """
+    if n_particles<1:
+        raise ValueError("Invalid number of particles, use at least 1")
+    if chunk_size<1:
+        raise ValueError("Invalid chunk size, use at least 1")
+    rng = randomness.as_source(rng)
+    for start in range(0, n_particles, chunk_size):
+        size = min(chunk_size, n_particles - start)
+        sender_bases, sender_values = prepare(size, rng)
+        if eavesdropping:
+            sent_bases, sent_values = measure(sender_bases, sender_values,
+                                              rng)
+        else:
+            sent_bases, sent_values = sender_bases, sender_values
+        receiver_bases, receiver_values = measure(sent_bases, sent_values,
+                                                  rng)
+        shared_indexes = sift(sender_bases, receiver_bases)
+        yield sender_values[shared_indexes], receiver_values[shared_indexes]
+
+def stream_keys(n_particles, eavesdropping=False, percentage=0.5,
+                chunk_size=1 << 20, rng=None):
+    """
+    Run the complete simulation in chunks, comparing a sample of the
+    shared bits of every chunk with the rules of 'compare_keys', and
+    yield the key of every chunk, so that only one chunk is in memory at
+    a time. With a single chunk the run is the same as 'run_protocol'.
+
+    Parameters
+    ----------
+        n_particles : int
+            How many particles will be used in total
+        eavesdropping : bool, optional
+            Flag to start the simulation with or without eavesdropping
+        percentage : float, optional
+            Percentage of the shared bits of every chunk compared,
+            defaults to 0.5
+        chunk_size : int, optional
+            How many particles are simulated together, default 2^20
+        rng : RandomSource, Generator or int, optional
+            The source of randomness, or a NumPy generator or a seed
+            to create one
+
+    Yields
+    ------
+        result : ProtocolResult
+            The comparison of the sample of the chunk
+        sender_key : ndarray
+            The values of the sender on the shared bits of the chunk that
+            were not compared
+        receiver_key : ndarray
+            The values of the receiver on the same bits
+    """
+    rng = randomness.as_source(rng)
+    for sender_shared, receiver_shared in stream_shared(
+            n_particles, chunk_size, eavesdropping, rng):
+        result = compare_keys(np.arange(len(sender_shared)), sender_shared,
+                              receiver_shared, rng, percentage)
+        yield (result, sender_shared[result.key_indexes],
+               receiver_shared[result.key_indexes])
+
+def run_stream(n_particles, eavesdropping=False, percentage=0.5,
+               chunk_size=1 << 20, threshold=0., rng=None):
+    """
+    Run the complete simulation in chunks with 'stream_keys', keeping in
+    memory only the counters of the shared bits, of the errors and of
+    the sample. The sample is made of round(percentage*shared) bits of
+    every chunk, so its size can differ from the one of 'compare_keys'
+    by the rounding of the chunks, at most half a bit per chunk.
+
+    Parameters
+    ----------
+        n_particles : int
+            How many particles will be used in total
+        eavesdropping : bool, optional
+            Flag to start the simulation with or without eavesdropping
+        percentage : float, optional
+            Percentage of the shared bits compared, defaults to 0.5
+        chunk_size : int, optional
+            How many particles are simulated together, default 2^20
+        threshold : float, optional
+            Highest error rate in the sample that is accepted, defaults
+            to 0
+        rng : RandomSource, Generator or int, optional
+            The source of randomness, or a NumPy generator or a seed
+            to create one
+
+    Returns
+    -------
+        result : ProtocolResult
+            The summary of the run, without the key
+    """
+    shared_number = errors_number = samples_number = mismatches = 0
+    for result, _, _ in stream_keys(n_particles, eavesdropping, percentage,
+                                    chunk_size, rng):
+        shared_number += result.sifted_length
+        errors_number += result.errors
+        samples_number += result.sample_size
+        mismatches += result.mismatches
+    interference = (samples_number == 0
+                    or mismatches > threshold*samples_number)
+    return ProtocolResult(sifted_length=shared_number, errors=errors_number,
+                          sample_size=samples_number, mismatches=mismatches,
+                          interference=interference)
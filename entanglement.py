@@ -0,0 +1,247 @@
+"""
+This module contains the entanglement-based versions of the protocol,
+E91 and BBM92. A source between the sender and the receiver emits pairs
+of photons in the entangled state (|HH> + |VV>)/sqrt(2), and both
+parties measure their photon with a polarizer turned by an angle chosen
+at random among their own. For the angles a and b the outcomes are
+random, but they are equal with probability
+
+    P(a, b) = (1 + V*cos(2*(a - b)))/2
+
+where V is the visibility of the source, 1 for a perfect one. The
+outcomes of every pair are drawn from this joint distribution, on arrays
+of all the pairs of a chunk at once. The pairs measured with the same
+angle form the key, while the others give the correlations
+E(a, b) = P(same) - P(different), from which the CHSH value
+
+    S = E(a, b) - E(a, b') + E(a', b) + E(a', b')
+
+is estimated over the whole run. Quantum correlations reach
+S = 2*sqrt(2) with the angles of E91, while an eavesdropper who measures
+the photons of the receiver and resends them leaves only classical
+correlations, with S <= 2, so the violation of the inequality shows that
+nobody was listening. BBM92 uses the two bases of BB84 on both sides and
+checks the error rate of the key instead, like 'engine.py'.
+"""
+import math
+from dataclasses import dataclass
+import numpy as np
+import randomness
+
+#Angles of the polarizers of E91: the pairs with the same angle form the
+#key, and the indexes of CHSH_SETTINGS in them give the maximum of S
+E91_SENDER_ANGLES = (0., math.pi/8, math.pi/4)
+E91_RECEIVER_ANGLES = (math.pi/8, math.pi/4, 3*math.pi/8)
+E91_CHSH_SETTINGS = ((0, 2), (0, 2))
+
+#Angles of BBM92, the bases Z and X of BB84 for both parties
+BBM92_ANGLES = (0., math.pi/4)
+
+#Angles used by the eavesdropper to measure the photons of the receiver
+EVE_ANGLES = (0., math.pi/4)
+
+#Highest CHSH value of classical correlations
+CLASSICAL_BOUND = 2.
+
+@dataclass
+class EntanglementResult:
+    """
+    Summary of a run of an entanglement-based protocol.
+
+    Attributes
+    ----------
+        pairs : int
+            Number of pairs of photons emitted
+        sifted_length : int
+            Number of pairs measured with the same angle, the key
+        errors : int
+            Number of bits of the key that don't match
+        counts : ndarray
+            Number of pairs measured with every couple of angles, with
+            shape (len(sender_angles), len(receiver_angles))
+        correlations : ndarray
+            The correlation E of every couple of angles, nan for the
+            couples never measured
+        chsh : float
+            The estimated CHSH value, nan without CHSH settings
+        chsh_error : float
+            The standard deviation of the estimate of the CHSH value
+        interference : bool
+            True if the correlations don't violate the CHSH inequality,
+            or without CHSH settings if the key has too many errors
+    """
+    pairs: int
+    sifted_length: int
+    errors: int
+    counts: np.ndarray
+    correlations: np.ndarray
+    chsh: float
+    chsh_error: float
+    interference: bool
+
+    @property
+    def qber(self):
+        """Error rate of the key, or nan if it's empty"""
+        if self.sifted_length == 0:
+            return math.nan
+        return self.errors/self.sifted_length
+
+def _choose_angles(size, angles, rng):
+    """Indexes of angles chosen at random, with the same probability"""
+    return (rng.random(size)*len(angles)).astype(np.int64)
+
+def measure_pairs(sender_angles, receiver_angles, visibility=1.,
+                  eve_angles=None, rng=None):
+    """
+    Draw the outcomes of the measurements of entangled pairs, all at
+    once from their joint distribution.
+
+    Parameters
+    ----------
+        sender_angles : ndarray
+            The angle of the polarizer of the sender for every pair
+        receiver_angles : ndarray
+            The angle of the polarizer of the receiver for every pair
+        visibility : float, optional
+            The visibility of the source, 1 for a perfect one
+        eve_angles : ndarray, optional
+            The angle with which Eve measures the photon of the receiver
+            before resending it, for every pair, None without Eve
+        rng : RandomSource, Generator or int, optional
+            The source of randomness
+
+    Returns
+    -------
+        sender_values : ndarray
+            The outcomes of the sender, random 0s and 1s
+        receiver_values : ndarray
+            The outcomes of the receiver
+    """
+    rng = randomness.as_source(rng)
+    shape = np.shape(sender_angles)
+    if eve_angles is None:
+        sender_values = rng.bits(shape)
+        same = (1 + visibility*np.cos(2*(sender_angles - receiver_angles)))/2
+        return sender_values, sender_values ^ (rng.random(shape) >= same)
+    #Eve's measurement leaves the sender's photon in the state she found,
+    #and the receiver measures the photon she resent
+    eve_values = rng.bits(shape)
+    sender_same = (1 + visibility*np.cos(2*(sender_angles - eve_angles)))/2
+    receiver_same = np.cos(receiver_angles - eve_angles)**2
+    return (eve_values ^ (rng.random(shape) >= sender_same),
+            eve_values ^ (rng.random(shape) >= receiver_same))
+
+def chsh(correlations, counts, settings):
+    """
+    CHSH value of the correlations and its standard deviation.
+
+    Parameters
+    ----------
+        correlations : ndarray
+            The correlation of every couple of angles
+        counts : ndarray
+            The number of pairs of every couple of angles
+        settings : tuple
+            The indexes (a, a') of the angles of the sender and (b, b')
+            of the receiver
+
+    Returns
+    -------
+        value : float
+            E(a, b) - E(a, b') + E(a', b) + E(a', b'), nan if a couple
+            was never measured
+        error : float
+            The standard deviation of the value
+    """
+    (a, a_prime), (b, b_prime) = settings
+    terms = ((a, b, 1), (a, b_prime, -1), (a_prime, b, 1),
+             (a_prime, b_prime, 1))
+    value = sum(sign*correlations[i, j] for i, j, sign in terms)
+    #Every correlation is the mean of N outcomes of +1 or -1
+    variance = sum((1 - correlations[i, j]**2)/counts[i, j]
+                   if counts[i, j] else math.nan for i, j, _ in terms)
+    return float(value), math.sqrt(variance)
+
+def run_entangled(n_pairs, eavesdropping=False,
+                  sender_angles=E91_SENDER_ANGLES,
+                  receiver_angles=E91_RECEIVER_ANGLES,
+                  chsh_settings=E91_CHSH_SETTINGS, visibility=1.,
+                  threshold=0., chunk_size=1 << 20, rng=None):
+    """
+    Run an entanglement-based protocol, E91 by default, a chunk of pairs
+    at a time so that the memory stays bounded for any number of pairs.
+
+    Parameters
+    ----------
+        n_pairs : int
+            How many pairs of photons will be emitted
+        eavesdropping : bool, optional
+            Flag to run with Eve measuring every photon of the receiver
+            with one of EVE_ANGLES, and resending it
+        sender_angles : tuple, optional
+            The angles among which the sender chooses, E91 by default
+        receiver_angles : tuple, optional
+            The angles among which the receiver chooses
+        chsh_settings : tuple, optional
+            The indexes of the angles for the CHSH value, like in 'chsh';
+            if None, like for BBM92, the eavesdropping is detected by the
+            error rate of the key
+        visibility : float, optional
+            The visibility of the source, 1 for a perfect one
+        threshold : float, optional
+            Without CHSH settings, the highest error rate of the key that
+            is accepted, defaults to 0
+        chunk_size : int, optional
+            How many pairs are simulated together, default 2^20
+        rng : RandomSource, Generator or int, optional
+            The source of randomness, or a NumPy generator or a seed
+            to create one
+
+    Returns
+    -------
+        result : EntanglementResult
+            The key, the correlations and the verdict of the run
+    """
+    if n_pairs<1:
+        raise ValueError("Invalid number of pairs, use at least 1")
+    if chunk_size<1:
+        raise ValueError("Invalid chunk size, use at least 1")
+    rng = randomness.as_source(rng)
+    sender_angles = np.asarray(sender_angles, dtype=float)
+    receiver_angles = np.asarray(receiver_angles, dtype=float)
+    shape = (len(sender_angles), len(receiver_angles))
+    #Pairs of every couple of angles, with different or same outcomes
+    outcomes = np.zeros(shape + (2,), dtype=np.int64)
+    for start in range(0, n_pairs, chunk_size):
+        size = min(chunk_size, n_pairs - start)
+        sender_choices = _choose_angles(size, sender_angles, rng)
+        receiver_choices = _choose_angles(size, receiver_angles, rng)
+        eve_angles = None
+        if eavesdropping:
+            eve_angles = np.asarray(EVE_ANGLES)[_choose_angles(
+                size, EVE_ANGLES, rng)]
+        sender_values, receiver_values = measure_pairs(
+            sender_angles[sender_choices], receiver_angles[receiver_choices],
+            visibility, eve_angles, rng)
+        cells = ((sender_choices*shape[1] + receiver_choices)*2
+                 + (sender_values == receiver_values))
+        outcomes += np.bincount(cells, minlength=outcomes.size).reshape(
+            outcomes.shape)
+    counts = outcomes.sum(axis=2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correlations = (outcomes[..., 1] - outcomes[..., 0])/counts
+    key = np.isclose(sender_angles[:, None], receiver_angles[None, :])
+    sifted_length = int(counts[key].sum())
+    errors = int(outcomes[..., 0][key].sum())
+    if chsh_settings is None:
+        value, error = math.nan, math.nan
+        interference = (sifted_length == 0
+                        or errors > threshold*sifted_length)
+    else:
+        value, error = chsh(correlations, counts, chsh_settings)
+        #A value that can't be estimated is an interference too
+        interference = not value > CLASSICAL_BOUND
+    return EntanglementResult(pairs=n_pairs, sifted_length=sifted_length,
+                              errors=errors, counts=counts,
+                              correlations=correlations, chsh=value,
+                              chsh_error=error, interference=interference)
@@ -0,0 +1,203 @@
+"""
+This module contains the finite-key analysis of the protocol: how many
+secret bits can be extracted from a block of shared bits of finite
+length, when part of it is disclosed to estimate the error rate.
+The estimate from a sample of k bits is only accurate up to a
+statistical deviation, so the error rate used for the privacy
+amplification is the highest one compatible with the sample (or the
+abort threshold), following Tomamichel et al., Nat. Commun. 3, 634
+(2012):
+
+    l = m*(1 - h(Q + mu)) - leak - log2(2/(eps_sec^2*eps_cor))
+    mu = sqrt((m + k)/(m*k)*(k + 1)/k*ln(2/eps_sec))
+
+where m is the number of bits left for the key, h the binary entropy
+and leak the bits disclosed by the error correction. All the functions
+work on NumPy arrays with broadcasting, so 'optimize' evaluates a whole
+grid of block sizes, sample fractions and abort thresholds at once.
+"""
+import math
+from dataclasses import dataclass
+import numpy as np
+import postprocessing
+
+#Default failure probabilities of the secrecy and of the correctness
+SECURITY = 1e-10
+CORRECTNESS = 1e-15
+
+#Ratio between the bits disclosed by the error correction and n*h(Q)
+EC_EFFICIENCY = 1.16
+
+_ERFC = np.frompyfunc(math.erfc, 1, 1)
+
+@dataclass
+class Optimum:
+    """
+    Best parameters found by 'optimize'.
+
+    Attributes
+    ----------
+        block_size : int
+            Number of shared bits of a block
+        sample_fraction : float
+            Fraction of the block compared to estimate the error rate
+        threshold : float
+            Highest error rate of the sample that is accepted
+        key_length : float
+            Number of secret bits of a block that passes the test
+        pass_probability : float
+            Probability that the test passes with the expected error rate
+        key_rate : float
+            Expected secret bits for each particle sent
+        key_rates : ndarray
+            The expected rate of every point of the grid
+    """
+    block_size: int
+    sample_fraction: float
+    threshold: float
+    key_length: float
+    pass_probability: float
+    key_rate: float
+    key_rates: np.ndarray
+
+def deviation(key_bits, sample_size, security=SECURITY):
+    """
+    Statistical deviation 'mu' between the error rate of the sample and
+    the one of the key, at the given security.
+    """
+    m = np.asarray(key_bits, dtype=float)
+    k = np.asarray(sample_size, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mu = np.sqrt((m + k)/(m*k)*(k + 1)/k*math.log(2/security))
+    return np.where((m > 0) & (k > 0), mu, np.inf)
+
+def secret_key_length(block_size, sample_size, error_rate, security=SECURITY,
+                      correctness=CORRECTNESS, ec_efficiency=EC_EFFICIENCY):
+    """
+    Number of secret bits that can be extracted from a block.
+
+    Parameters
+    ----------
+        block_size : int or ndarray
+            The number of shared bits of the block
+        sample_size : int or ndarray
+            The number of them compared
+        error_rate : float or ndarray
+            The error rate used for the bound: the one of the sample, or
+            the abort threshold
+        security : float, optional
+            The probability of failure of the secrecy
+        correctness : float, optional
+            The probability that the keys are different after the error
+            correction
+        ec_efficiency : float, optional
+            The bits disclosed by the error correction over m*h(Q)
+
+    Returns
+    -------
+        key_length : ndarray
+            The number of secret bits, 0 when no key can be extracted
+    """
+    n = np.asarray(block_size, dtype=float)
+    k = np.asarray(sample_size, dtype=float)
+    q = np.asarray(error_rate, dtype=float)
+    m = n - k
+    mu = deviation(m, k, security)
+    length = (m*(1 - postprocessing.binary_entropy(np.minimum(q + mu, 0.5)))
+              - ec_efficiency*m*postprocessing.binary_entropy(q)
+              - math.log2(2/(security**2*correctness)))
+    return np.maximum(np.where(np.isfinite(mu) & (q + mu < 0.5), length, 0.),
+                      0.)
+
+def pass_probability(sample_size, error_rate, threshold):
+    """
+    Probability that the error rate of the sample is at most the
+    threshold, with the normal approximation of the binomial.
+    """
+    k = np.asarray(sample_size, dtype=float)
+    q = np.asarray(error_rate, dtype=float)
+    t = np.asarray(threshold, dtype=float)
+    spread = np.sqrt(np.maximum(k*q*(1 - q), 1e-300))
+    #The continuity correction counts the mismatches up to floor(t*k)
+    z = (np.floor(t*k) + 0.5 - k*q)/spread
+    probability = 1 - 0.5*np.asarray(_ERFC(z/math.sqrt(2)), dtype=float)
+    return np.where(k*q*(1 - q) > 0, probability,
+                    (q <= t).astype(float))
+
+def from_result(result, n_particles, security=SECURITY,
+                correctness=CORRECTNESS, ec_efficiency=EC_EFFICIENCY):
+    """
+    Secret bits that can be extracted from a run of the protocol, using
+    the error rate of its sample.
+
+    Parameters
+    ----------
+        result : ProtocolResult
+            The result of 'simulation.check_keys' or of the engine
+        n_particles : int
+            The number of particles sent
+        security, correctness, ec_efficiency
+            Like in 'secret_key_length'
+
+    Returns
+    -------
+        key_length : float
+            The number of secret bits
+        key_rate : float
+            The secret bits for each particle sent
+    """
+    if result.sample_size == 0:
+        return 0., 0.
+    key_length = float(secret_key_length(result.sifted_length,
+                                         result.sample_size, result.qber,
+                                         security, correctness,
+                                         ec_efficiency))
+    return key_length, key_length/n_particles
+
+def optimize(error_rate, block_sizes, sample_fractions, thresholds,
+             sifting_ratio=0.5, security=SECURITY, correctness=CORRECTNESS,
+             ec_efficiency=EC_EFFICIENCY):
+    """
+    Find the block size, sample fraction and abort threshold with the
+    highest expected secret key rate, evaluating the whole grid at once.
+    The expected rate is the key length of a block that passes the test,
+    times the probability of passing it, over the particles sent.
+
+    Parameters
+    ----------
+        error_rate : float
+            The expected error rate of the channel
+        block_sizes : array_like
+            The numbers of shared bits of a block
+        sample_fractions : array_like
+            The fractions of the block compared
+        thresholds : array_like
+            The highest error rates of the sample that are accepted
+        sifting_ratio : float, optional
+            The fraction of the particles sent that are shared, 0.5
+        security, correctness, ec_efficiency
+            Like in 'secret_key_length'
+
+    Returns
+    -------
+        optimum : Optimum
+            The best parameters, with the rates of the whole grid, with
+            shape (len(block_sizes), len(sample_fractions),
+            len(thresholds))
+    """
+    n = np.asarray(block_sizes, dtype=float)[:, None, None]
+    fractions = np.asarray(sample_fractions, dtype=float)[None, :, None]
+    t = np.asarray(thresholds, dtype=float)[None, None, :]
+    k = np.round(fractions*n)
+    lengths = secret_key_length(n, k, t, security, correctness,
+                                ec_efficiency)
+    passing = pass_probability(k, error_rate, t)
+    key_rates = lengths*passing*sifting_ratio/n
+    best = np.unravel_index(np.argmax(key_rates), key_rates.shape)
+    return Optimum(block_size=int(n[best[0], 0, 0]),
+                   sample_fraction=float(fractions[0, best[1], 0]),
+                   threshold=float(t[0, 0, best[2]]),
+                   key_length=float(lengths[best]),
+                   pass_probability=float(passing[best]),
+                   key_rate=float(key_rates[best]),
+                   key_rates=key_rates)
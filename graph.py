@@ -8,11 +8,39 @@ can be used to make the results more accurate and more complete,
 respectively. It's noted that increasing these will make the scrit very
 slow, so it's suggested to not increse the values too much unless enough
 time is available to be spent waiting.
+The functions ending in '_batch' do the same calculations with the
+array-backed engine, which runs all the trials together without
+printing, and can be used when a high number of runs is needed.
+The function 'simulate_multiple_parallel' also shares the runs among all
+the cores, with reproducible results for a given seed.
+The functions starting with 'analytic_' instead calculate exactly the
+rate that the simulations estimate, without running them.
+The function 'simulate_adaptive' keeps running each number of particles
+only until the confidence interval of its failure rate is narrow enough,
+spending the runs where the rate is uncertain.
+With a 'cache.ResultCache' and a seed, the runs are split in blocks and
+every run has its own random generator, and the outcomes of the runs are
+saved, so that plotting again or adding runs only simulates the new
+runs.
 """
+import math
 import os
 import sys
-import matplotlib.pyplot as plt
+from statistics import NormalDist
+import numpy as np
+import cache as result_cache
+import confidence
+import engine
+import randomness
 import simulation
+import sweep
+
+#Number of runs of 'simulate_fixed' saved together in the cache
+CACHE_BLOCK_RUNS = 100
+
+#Number of runs of the first round of 'simulate_adaptive', and minimum
+#number of runs of the following rounds
+ADAPTIVE_FIRST_RUNS = 32
 
 class HiddenPrints:
     """Class to hide the printing done by the simulation runs"""
@@ -25,7 +53,9 @@ class HiddenPrints:
         sys.stdout.close()
         sys.stdout = self._original_stdout
 
-def simulate_fixed(number_of_runs, particles):
+def simulate_fixed(number_of_runs, particles, profiler=None, cache=None,
+                   seed=None, sender_z_probability=0.5,
+                   receiver_z_probability=0.5):
     """
     Runs the simulation a certain number of times, with a fixed number 
     of particles used, and whith eavesdropping turned on. This is to
@@ -40,6 +70,18 @@ def simulate_fixed(number_of_runs, particles):
             The number of times the simulation will run
         particles : int
             The number of particles used in each run of the simulation
+        profiler : Profiler, optional
+            Adds up the time spent in every stage over all the runs
+        cache : ResultCache, optional
+            The cache of the detections, which needs a seed
+        seed : int, optional
+            The seed of the random generators of the blocks of runs
+        sender_z_probability : float, optional
+            The probability that the sender chooses the base Z
+        receiver_z_probability : float, optional
+            The probability that the receiver chooses the base Z. With
+            biased bases only the rare base is checked, see
+            'simulation.run_protocol'
     Returns
     -------
         failure_rate : float
@@ -49,15 +91,39 @@ def simulate_fixed(number_of_runs, particles):
             dection of an eavesdropper. Failures with very low number of
             particles are caused by the inability to compare the keys.
     """
+    biases = {"sender_z_probability": sender_z_probability,
+              "receiver_z_probability": receiver_z_probability}
+    if cache is not None:
+        if seed is None:
+            raise ValueError("A seed is needed to cache the results")
+        def simulate_runs(block, start, stop):
+            #Every run has its own generator, so the runs of a block can
+            #be added to the ones saved
+            return [simulation.run(n_particles=particles,
+                                   eavesdropping=True, reporter=None,
+                                   rng=randomness.as_source(sweep.block_seed(
+                                       seed, particles, block, run)),
+                                   profiler=profiler, **biases)
+                    for run in range(start, stop)]
+        #Biased runs are different points of the cache
+        simulator = sweep.simulator_name(f"simulation-{simulation.VERSION}",
+                                         **biases)
+        point = result_cache.point_key(simulator, CACHE_BLOCK_RUNS,
+                                       particles, True, 0.5, seed)
+        return cache.count(point, number_of_runs,
+                           simulate_runs)/number_of_runs
     number_of_detections = 0
-    with HiddenPrints(): #Mute the prints of the simulation
-        for _ in range(number_of_runs):
-            if simulation.run(n_particles=particles, eavesdropping=True):
-                number_of_detections += 1
+    for _ in range(number_of_runs):
+        #Without a reporter the simulation doesn't print anything
+        if simulation.run(n_particles=particles, eavesdropping=True,
+                          reporter=None, profiler=profiler, **biases):
+            number_of_detections += 1
     failure_rate=number_of_detections/number_of_runs
     return failure_rate
 
-def simulate_multiple(number_of_runs,number_of_particles):
+def simulate_multiple(number_of_runs,number_of_particles,cache=None,
+                      seed=None,sender_z_probability=0.5,
+                      receiver_z_probability=0.5):
     """
     Run the simulation multiple times, increasing the number of
     particles used in each successive simulation by one each time, up to
@@ -70,6 +136,14 @@ def simulate_multiple(number_of_runs,number_of_particles):
         number_of_particles : list
             The list containing all the numbers of particles used in
             each successive simulation
+        cache : ResultCache, optional
+            The cache of the detections, which needs a seed
+        seed : int, optional
+            The seed of the random generators of the blocks of runs
+        sender_z_probability : float, optional
+            The probability that the sender chooses the base Z
+        receiver_z_probability : float, optional
+            The probability that the receiver chooses the base Z
     Returns
     -------
         failure_rates: list
@@ -79,13 +153,291 @@ def simulate_multiple(number_of_runs,number_of_particles):
     #List to contain all the failing rates calculated by each mutilpe run
     failure_rates = []
     for i,number in enumerate(number_of_particles):
-        failure_rates.append(simulate_fixed(number_of_runs,number))
+        failure_rates.append(simulate_fixed(
+            number_of_runs,number,cache=cache,seed=seed,
+            sender_z_probability=sender_z_probability,
+            receiver_z_probability=receiver_z_probability))
         #Progress counter
         print(f"Executing simulation {i} out of {len(number_of_particles)}",
               end="\r")
     return failure_rates
 
-def plotting(number_of_particles,failure_rates):
+def simulate_fixed_batch(number_of_runs, particles, rng=None,
+                         sender_z_probability=0.5,
+                         receiver_z_probability=0.5):
+    """
+    Same as 'simulate_fixed', but all the runs are done together by the
+    array-backed engine instead of calling 'simulation.run' each time.
+
+    Parameters
+    ----------
+        number_of_runs : int
+            The number of times the simulation will run
+        particles : int
+            The number of particles used in each run of the simulation
+        rng : RandomSource, Generator or int, optional
+            The source of randomness, or a NumPy generator or a seed
+            to create one
+        sender_z_probability : float, optional
+            The probability that the sender chooses the base Z
+        receiver_z_probability : float, optional
+            The probability that the receiver chooses the base Z
+    Returns
+    -------
+        failure_rate : float
+            The rate of eavesdropping/failures detected by the different
+            runs of the simulation over the total number of runs done.
+    """
+    detections = engine.run_batch(
+        particles, number_of_runs, rng=rng,
+        sender_z_probability=sender_z_probability,
+        receiver_z_probability=receiver_z_probability)
+    failure_rate = np.count_nonzero(detections)/number_of_runs
+    return failure_rate
+
+def simulate_multiple_batch(number_of_runs, number_of_particles, rng=None,
+                            sender_z_probability=0.5,
+                            receiver_z_probability=0.5):
+    """
+    Same as 'simulate_multiple', but every number of particles is
+    simulated by 'simulate_fixed_batch', without printing the progress.
+
+    Parameters
+    ----------
+        number_of_runs : int
+            The number of times each instance of simulation will run
+        number_of_particles : list
+            The list containing all the numbers of particles used in
+            each successive simulation
+        rng : RandomSource, Generator or int, optional
+            The source of randomness, or a NumPy generator or a seed
+            to create one
+        sender_z_probability : float, optional
+            The probability that the sender chooses the base Z
+        receiver_z_probability : float, optional
+            The probability that the receiver chooses the base Z
+    Returns
+    -------
+        failure_rates: list
+            A list containing each failure rate measured by each
+            execution of the simulation
+    """
+    rng = randomness.as_source(rng)
+    return [simulate_fixed_batch(number_of_runs, number, rng,
+                                 sender_z_probability, receiver_z_probability)
+            for number in number_of_particles]
+
+def simulate_multiple_parallel(number_of_runs, number_of_particles,
+                               seed=None, workers=None, cache=None,
+                               sender_z_probability=0.5,
+                               receiver_z_probability=0.5):
+    """
+    Same as 'simulate_multiple_batch', but the runs are split in blocks
+    simulated by a pool of processes. Every block has its own random
+    generator derived from the seed, so the same seed gives the same
+    failure rates with any number of processes.
+
+    Parameters
+    ----------
+        number_of_runs : int
+            The number of times each instance of simulation will run
+        number_of_particles : list
+            The list containing all the numbers of particles used in
+            each successive simulation
+        seed : int, optional
+            The master seed of the random generators
+        workers : int, optional
+            Number of processes, defaults to the number of cores
+        cache : ResultCache, optional
+            The cache of the detections of the blocks
+        sender_z_probability : float, optional
+            The probability that the sender chooses the base Z
+        receiver_z_probability : float, optional
+            The probability that the receiver chooses the base Z
+    Returns
+    -------
+        failure_rates: list
+            A list containing each failure rate measured by each
+            execution of the simulation
+    """
+    detections = sweep.count_detections(
+        number_of_runs, number_of_particles, seed=seed, workers=workers,
+        cache=cache, sender_z_probability=sender_z_probability,
+        receiver_z_probability=receiver_z_probability)
+    return (detections/number_of_runs).tolist()
+
+def simulate_adaptive(number_of_particles, width=0.05, confidence_level=0.95,
+                      max_runs=100000, method="wilson", batch=True, rng=None,
+                      sender_z_probability=0.5, receiver_z_probability=0.5):
+    """
+    Estimate the failure rate of every number of particles running the
+    simulation in rounds until the confidence interval of the rate is
+    narrower than 'width'. After every round the runs still needed are
+    estimated from the rate found so far, at most doubling the runs. The
+    rates close to 0 or 1 need few runs, so most of the runs are spent
+    where the rate is uncertain.
+
+    Parameters
+    ----------
+        number_of_particles : list
+            The list containing all the numbers of particles used
+        width : float, optional
+            The width of the interval to reach, default 0.05
+        confidence_level : float, optional
+            The confidence of the intervals, default 0.95
+        max_runs : int, optional
+            The maximum number of runs of each number of particles
+        method : string, optional
+            The interval used, 'wilson' or 'clopper-pearson'
+        batch : bool, optional
+            Flag to run the simulations with the array-backed engine,
+            default True, otherwise 'simulation.run' is used
+        rng : RandomSource, Generator or int, optional
+            The source of randomness, or a NumPy generator or a seed
+            to create one
+        sender_z_probability : float, optional
+            The probability that the sender chooses the base Z
+        receiver_z_probability : float, optional
+            The probability that the receiver chooses the base Z
+    Returns
+    -------
+        failure_rates : list
+            The failure rate measured for each number of particles
+        intervals : list
+            The lower and upper ends of the interval of each rate
+        runs : list
+            The number of runs done for each number of particles
+    """
+    rng = randomness.as_source(rng)
+    biases = {"sender_z_probability": sender_z_probability,
+              "receiver_z_probability": receiver_z_probability}
+    z_score = NormalDist().inv_cdf(0.5 + confidence_level/2)
+    failure_rates, intervals, runs = [], [], []
+    for particles in number_of_particles:
+        detections = 0
+        done = 0
+        round_runs = ADAPTIVE_FIRST_RUNS
+        while True:
+            round_runs = min(round_runs, max_runs - done)
+            if batch:
+                detections += int(np.count_nonzero(
+                    engine.run_batch(particles, round_runs, rng=rng,
+                                     **biases)))
+            else:
+                detections += sum(simulation.run(particles,
+                                                 eavesdropping=True,
+                                                 reporter=None, rng=rng,
+                                                 **biases)
+                                  for _ in range(round_runs))
+            done += round_runs
+            lower, upper = confidence.interval(detections, done,
+                                               confidence_level, method)
+            if upper - lower <= width or done >= max_runs:
+                break
+            #Runs needed by the normal approximation, at most doubling
+            rate = (detections + 1)/(done + 2)
+            needed = math.ceil(4*z_score**2*rate*(1 - rate)/width**2)
+            round_runs = min(max(needed - done, ADAPTIVE_FIRST_RUNS), done)
+        failure_rates.append(detections/done)
+        intervals.append((lower, upper))
+        runs.append(done)
+    return failure_rates, intervals, runs
+
+def analytic_failure_rate(particles, eavesdropping=True, percentage=0.5,
+                          sender_z_probability=0.5,
+                          receiver_z_probability=0.5):
+    """
+    Calculate exactly the failure rate that 'simulate_fixed' estimates.
+    The number of shared bits follows a binomial distribution with
+    probability 1/2, and the sample compared by 'simulation.compare_keys'
+    has round(percentage*shared) bits, a failure when it's empty. With
+    eavesdropping each shared bit is wrong with probability 1/4, so a
+    sample of k bits goes undetected with probability (3/4)^k.
+    With biased bases the sample is taken from the shared bits of the
+    rare base, whose number is binomial with the probability that both
+    choose it, and Eve, who chooses her bases with equal probability,
+    still causes an error on a quarter of them.
+
+    Parameters
+    ----------
+        particles : int
+            The number of particles used in the simulation
+        eavesdropping : bool, optional
+            Flag to calculate the rate with or without eavesdropping,
+            defaults to True
+        percentage : float, optional
+            Percentage of the shared bits compared, defaults to 0.5
+        sender_z_probability : float, optional
+            The probability that the sender chooses the base Z
+        receiver_z_probability : float, optional
+            The probability that the receiver chooses the base Z
+    Returns
+    -------
+        failure_rate : float
+            The probability that a run of the simulation detects a
+            problem in the key, calculated in O(particles) time
+    """
+    if particles<1:
+        raise ValueError("Invalid number of particles, use at least 1")
+    #Probability that a particle ends in the bits that can be sampled
+    sampled_probability = 0.5
+    base = simulation.rare_base(sender_z_probability, receiver_z_probability)
+    if base == "Z":
+        sampled_probability = sender_z_probability*receiver_z_probability
+    elif base == "X":
+        sampled_probability = ((1 - sender_z_probability)
+                               *(1 - receiver_z_probability))
+    shared = np.arange(particles + 1)
+    #Logarithm of the binomial coefficients, to avoid overflows
+    log_binomial = np.concatenate(([0.], np.cumsum(
+        np.log(np.arange(particles, 0, -1)) - np.log(shared[1:]))))
+    shared_probability = np.exp(log_binomial
+                                + shared*np.log(sampled_probability)
+                                + (particles - shared)
+                                *np.log(1 - sampled_probability))
+    #np.round rounds half to even like the round used in compare_keys
+    samples_number = np.round(percentage*shared)
+    error_rate = 0.25 if eavesdropping else 0.
+    undetected = np.where(samples_number == 0, 0.,
+                          (1 - error_rate)**samples_number)
+    #Normalizing removes the rounding errors accumulated in the logarithms
+    failure_rate = float(np.sum(shared_probability*(1 - undetected))
+                         / np.sum(shared_probability))
+    return failure_rate
+
+def analytic_multiple(number_of_particles, eavesdropping=True,
+                      percentage=0.5, sender_z_probability=0.5,
+                      receiver_z_probability=0.5):
+    """
+    Calculate the exact failure rate for each number of particles, as
+    'simulate_multiple' would estimate it.
+
+    Parameters
+    ----------
+        number_of_particles : list
+            The list containing all the numbers of particles
+        eavesdropping : bool, optional
+            Flag to calculate the rates with or without eavesdropping,
+            defaults to True
+        percentage : float, optional
+            Percentage of the shared bits compared, defaults to 0.5
+        sender_z_probability : float, optional
+            The probability that the sender chooses the base Z
+        receiver_z_probability : float, optional
+            The probability that the receiver chooses the base Z
+    Returns
+    -------
+        failure_rates: list
+            A list containing the failure rate for each number of
+            particles
+    """
+    return [analytic_failure_rate(number, eavesdropping, percentage,
+                                  sender_z_probability,
+                                  receiver_z_probability)
+            for number in number_of_particles]
+
+def plotting(number_of_particles,failure_rates,expected_rates=None,
+             intervals=None,output=None):
     """
     Function that plots the chosen number of paricles on the x axis and
     the detection rate of problems on the y axis.
@@ -97,17 +449,37 @@ def plotting(number_of_particles,failure_rates):
         failure_rates : list
             The failure rate calculated in each run of the simulation,
             becomes the y axis
+        expected_rates : list, optional
+            The exact failure rates, drawn as a line over the points
+        intervals : list, optional
+            The confidence intervals of the failure rates, drawn as a
+            band around the points
+        output : string, optional
+            The file where the graph is saved, if None it's shown
     Returns
     -------
         None
     """
+    #Matplotlib is slow to import, so it's imported only to plot
+    import matplotlib.pyplot as plt
     plt.figure(figsize=(12,9))
+    if intervals is not None:
+        lowers, uppers = zip(*intervals)
+        plt.fill_between(number_of_particles, lowers, uppers, alpha=0.3)
     plt.scatter(number_of_particles, failure_rates, s=40)
+    if expected_rates is not None:
+        plt.plot(number_of_particles, expected_rates, color="red")
     plt.xlabel("Number of particles used", fontsize=20)
     plt.ylabel("Problem in the key detection rate ", fontsize=20)
-    plt.show()
+    if output is None:
+        plt.show()
+    else:
+        plt.savefig(output)
+        plt.close()
 
-def simulate_and_graph(runs=5,particle_max=100):
+def simulate_and_graph(runs=5,particle_max=100,batch=False,analytic=False,
+                       cache=None,seed=None,width=None,output=None,
+                       sender_z_probability=0.5,receiver_z_probability=0.5):
     """
     Run the simulation how many times as wanted, and then graph it
 
@@ -119,20 +491,60 @@ def simulate_and_graph(runs=5,particle_max=100):
             Each successive run will increase the number of particles
             sent by 1, starting from 1 and ending with this value,
             default 100
+        batch : bool, optional
+            Flag to run the simulations with the array-backed engine,
+            default False
+        analytic : bool, optional
+            Flag to also draw the exact failure rate, default False
+        cache : ResultCache, optional
+            The cache of the detections, which needs a seed
+        seed : int, optional
+            The seed of the random generators of the blocks of runs
+        width : float, optional
+            If given, every number of particles is run until the
+            confidence interval of its rate is narrower than this, with
+            at most 'runs' runs, see 'simulate_adaptive'
+        output : string, optional
+            The file where the graph is saved, if None it's shown
+        sender_z_probability : float, optional
+            The probability that the sender chooses the base Z
+        receiver_z_probability : float, optional
+            The probability that the receiver chooses the base Z
     Returns
     -------
         None
     """
+    biases = {"sender_z_probability": sender_z_probability,
+              "receiver_z_probability": receiver_z_probability}
     #List to contain all the failing rates calculated by each mutilpe run
     failure_rates = []
     #List to store the number of particles used in each run of simulation
     number_of_particles = list(range(1,particle_max))
-    failure_rates = simulate_multiple(runs,number_of_particles)
-    plotting(number_of_particles,failure_rates)
+    intervals = None
+    if width is not None:
+        failure_rates, intervals, _ = simulate_adaptive(
+            number_of_particles, width, max_runs=runs, batch=batch, rng=seed,
+            **biases)
+    elif batch and cache is not None:
+        failure_rates = simulate_multiple_parallel(runs,number_of_particles,
+                                                   seed,cache=cache,**biases)
+    elif batch:
+        failure_rates = simulate_multiple_batch(runs,number_of_particles,
+                                                seed,**biases)
+    else:
+        failure_rates = simulate_multiple(runs,number_of_particles,cache,seed,
+                                          **biases)
+    expected_rates = None
+    if analytic:
+        expected_rates = analytic_multiple(number_of_particles,**biases)
+    plotting(number_of_particles,failure_rates,expected_rates,intervals,
+             output)
 
-def main():
-    """Run the simulations and the graphing"""
-    simulate_and_graph()
+def main(argv=None):
+    """Run the simulations and the graphing, see 'cli.py'"""
+    #Imported here because cli imports this module when plotting
+    import cli
+    return cli.main(["graph", *(sys.argv[1:] if argv is None else argv)])
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
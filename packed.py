@@ -0,0 +1,371 @@
+"""
+This module contains a compact version of the array-backed engine, in
+which bases, values and keys are stored with one bit per particle, 8
+particles per byte like np.packbits does. The buffers are padded to a
+multiple of 8 bytes, so that the measurements and the comparisons are
+done with bitwise operations on uint64 words, 64 particles at a time,
+and the errors are counted as the number of bits set in the XOR of two
+buffers. Bits after the last particle are always kept to 0.
+"""
+from dataclasses import dataclass
+import numpy as np
+import randomness
+from engine import ProtocolResult, popcount
+
+#Number of bytes unpacked at a time when the shared key is extracted
+_CHUNK_BYTES = 1 << 16
+
+#Number of bits of the key sampled at a time by 'sample_mismatches'
+_SAMPLE_BITS = 1 << 16
+
+@dataclass
+class PackedState:
+    """
+    Bases and values of a series of particles, one bit each.
+
+    Attributes
+    ----------
+        bases : ndarray
+            Packed bases, with bits 0 for X and 1 for Z
+        values : ndarray
+            Packed values of the states
+        length : int
+            Number of particles
+    """
+    bases: np.ndarray
+    values: np.ndarray
+    length: int
+
+def packed_size(length):
+    """Number of bytes of a buffer for 'length' bits, padded to words"""
+    return -(-length//64)*8
+
+def pack(bits):
+    """
+    Pack an array of 0s and 1s in a buffer padded to a multiple of 8
+    bytes.
+
+    Parameters
+    ----------
+        bits : array_like
+            The bits to pack
+
+    Returns
+    -------
+        packed : ndarray
+            The packed bits, as uint8
+    """
+    bits = np.asarray(bits, dtype=np.uint8)
+    packed = np.zeros(packed_size(len(bits)), dtype=np.uint8)
+    packed_bits = np.packbits(bits)
+    packed[:len(packed_bits)] = packed_bits
+    return packed
+
+def unpack(packed, length):
+    """
+    Unpack the first 'length' bits of a buffer.
+
+    Parameters
+    ----------
+        packed : ndarray
+            The packed bits
+        length : int
+            The number of bits to unpack
+
+    Returns
+    -------
+        bits : ndarray
+            An array of uint8 of 0s and 1s
+    """
+    return np.unpackbits(packed, count=length)
+
+def _clear_padding(packed, length):
+    """Set to 0 the bits after the first 'length' ones, in place"""
+    full_bytes, extra_bits = divmod(length, 8)
+    if extra_bits:
+        packed[full_bytes] &= np.uint8((0xFF << (8 - extra_bits)) & 0xFF)
+        full_bytes += 1
+    packed[full_bytes:] = 0
+    return packed
+
+def _words(packed):
+    """View a padded buffer as an array of uint64 words"""
+    return packed.view(np.uint64)
+
+def random_bits(length, rng):
+    """
+    Draw 'length' random bits in bulk, from the bytes of the source.
+
+    Parameters
+    ----------
+        length : int
+            The number of random bits
+        rng : RandomSource
+            The source of randomness
+
+    Returns
+    -------
+        packed : ndarray
+            The packed random bits
+    """
+    packed = np.frombuffer(rng.bytes(packed_size(length)),
+                           dtype=np.uint8).copy()
+    return _clear_padding(packed, length)
+
+def count_errors(packed_1, packed_2, mask=None):
+    """
+    Count the bits that differ between two buffers, only where the mask
+    is set if one is given.
+
+    Parameters
+    ----------
+        packed_1 : ndarray
+            One of the two buffers to compare
+        packed_2 : ndarray
+            One of the two buffers to compare
+        mask : ndarray, optional
+            The packed positions to compare
+
+    Returns
+    -------
+        errors : int
+            The number of different bits
+    """
+    differences = _words(packed_1) ^ _words(packed_2)
+    if mask is not None:
+        differences &= _words(mask)
+    return int(popcount(differences))
+
+def qber(packed_1, packed_2, mask=None, length=None):
+    """
+    Error rate between two buffers, only where the mask is set if one is
+    given, or nan when there are no bits to compare.
+
+    Parameters
+    ----------
+        packed_1 : ndarray
+            One of the two buffers to compare
+        packed_2 : ndarray
+            One of the two buffers to compare
+        mask : ndarray, optional
+            The packed positions to compare
+        length : int, optional
+            The number of bits of the buffers, needed without a mask
+            because the padding must not be counted
+
+    Returns
+    -------
+        float
+            The fraction of the compared bits that differ
+    """
+    if mask is None:
+        if length is None:
+            raise ValueError("The length of the buffers is needed without "
+                             "a mask")
+        compared = length
+    else:
+        compared = int(popcount(_words(mask)))
+    if compared == 0:
+        return np.nan
+    return count_errors(packed_1, packed_2, mask)/compared
+
+def get_bits(packed, indexes):
+    """
+    Read the bits in the given positions, without unpacking the buffer.
+
+    Parameters
+    ----------
+        packed : ndarray
+            The packed bits
+        indexes : ndarray
+            The positions of the bits to read
+
+    Returns
+    -------
+        bits : ndarray
+            An array of uint8 of 0s and 1s
+    """
+    indexes = np.asarray(indexes, dtype=np.int64)
+    return (packed[indexes >> 3] >> (7 - (indexes & 7)).astype(np.uint8)) & 1
+
+def prepare(length, rng):
+    """
+    Emulates the preparation of the states done by the sender, with
+    random bases and random values.
+
+    Parameters
+    ----------
+        length : int
+            Specifies the number of particles that will be prepared
+        rng : RandomSource
+            The source of randomness
+
+    Returns
+    -------
+        state : PackedState
+            The prepared state
+    """
+    return PackedState(random_bits(length, rng), random_bits(length, rng),
+                       length)
+
+def measure(state, rng):
+    """
+    Emulates the measurement of a received state with random bases. The
+    value is kept where the bases match, otherwise it's random.
+
+    Parameters
+    ----------
+        state : PackedState
+            The state that gets received
+        rng : RandomSource
+            The source of randomness
+
+    Returns
+    -------
+        measured_state : PackedState
+            The result of the measurement
+    """
+    bases = random_bits(state.length, rng)
+    random_values = random_bits(state.length, rng)
+    same_base = ~(_words(bases) ^ _words(state.bases))
+    values = ((same_base & _words(state.values))
+              | (~same_base & _words(random_values)))
+    return PackedState(bases, values.view(np.uint8), state.length)
+
+def sift(sender, receiver):
+    """
+    Find where the bases of two states match.
+
+    Parameters
+    ----------
+        sender : PackedState
+            One of the two states to compare
+        receiver : PackedState
+            One of the two states to compare
+
+    Returns
+    -------
+        shared : ndarray
+            The packed mask of the shared bases
+    """
+    shared = ~(_words(sender.bases) ^ _words(receiver.bases))
+    return _clear_padding(shared.view(np.uint8), sender.length)
+
+def shared_key(values, shared):
+    """
+    Extract the values on the shared bases, forming the packed key. The
+    buffers are unpacked a chunk at a time to keep the memory bounded.
+
+    Parameters
+    ----------
+        values : ndarray
+            The packed values of one of the two parties
+        shared : ndarray
+            The packed mask of the shared bases
+
+    Returns
+    -------
+        key : ndarray
+            The packed key
+        key_length : int
+            The number of bits of the key
+    """
+    key = np.zeros(packed_size(int(popcount(_words(shared)))), dtype=np.uint8)
+    key_length = 0
+    #Bits that didn't fill a whole byte are carried to the next chunk
+    carry = np.empty(0, dtype=np.uint8)
+    for start in range(0, len(values), _CHUNK_BYTES):
+        stop = start + _CHUNK_BYTES
+        chunk_mask = np.unpackbits(shared[start:stop]).astype(bool)
+        bits = np.concatenate((carry,
+                               np.unpackbits(values[start:stop])[chunk_mask]))
+        full = len(bits) - len(bits) % 8
+        key[key_length//8:(key_length + full)//8] = np.packbits(bits[:full])
+        key_length += full
+        carry = bits[full:]
+    if len(carry):
+        key[key_length//8] = np.packbits(carry)[0]
+        key_length += len(carry)
+    return key, key_length
+
+def sample_mismatches(sender_key, receiver_key, key_length, samples_number,
+                      rng):
+    """
+    Compare a sample without replacement of the bits of two packed keys,
+    a chunk of _SAMPLE_BITS bits at a time so that the indexes of the
+    sample never take more memory than a chunk. The number of bits
+    chosen in every chunk is drawn from the hypergeometric distribution
+    of the bits left, and then the positions in it.
+
+    Parameters
+    ----------
+        sender_key : ndarray
+            The packed key of the sender
+        receiver_key : ndarray
+            The packed key of the receiver
+        key_length : int
+            The number of bits of the keys
+        samples_number : int
+            The number of bits compared
+        rng : RandomSource
+            The source of randomness
+
+    Returns
+    -------
+        mismatches : int
+            The number of compared bits that don't match
+    """
+    mismatches = 0
+    remaining_samples = samples_number
+    for start in range(0, key_length, _SAMPLE_BITS):
+        if remaining_samples == 0:
+            break
+        size = min(_SAMPLE_BITS, key_length - start)
+        chosen = int(rng.hypergeometric(size, key_length - start - size,
+                                        remaining_samples))
+        remaining_samples -= chosen
+        positions = start + rng.choice(size, chosen)
+        mismatches += int(np.count_nonzero(
+            get_bits(sender_key, positions)
+            != get_bits(receiver_key, positions)))
+    return mismatches
+
+def run(n_particles=1000, eavesdropping=False, percentage=0.5, rng=None):
+    """
+    Run the complete simulation on packed bits, without printing. The
+    compared sample is read directly from the packed keys, a chunk at a
+    time with 'sample_mismatches'.
+
+    Parameters
+    ----------
+        n_particles : int, optional
+            How many particles will be used
+        eavesdropping : bool, optional
+            Flag to start the simulation with or without eavesdropping
+        percentage : float, optional
+            Percentage of the shared bits compared, defaults to 0.5
+        rng : RandomSource, Generator or int, optional
+            The source of randomness, or a NumPy generator or a seed
+            to create one
+
+    Returns
+    -------
+        result : ProtocolResult
+            The summary of the run
+    """
+    if n_particles<1:
+        raise ValueError("Invalid number of particles, use at least 1")
+    rng = randomness.as_source(rng)
+    sender = prepare(n_particles, rng)
+    sent = measure(sender, rng) if eavesdropping else sender
+    receiver = measure(sent, rng)
+    shared = sift(sender, receiver)
+    sender_key, key_length = shared_key(sender.values, shared)
+    receiver_key, _ = shared_key(receiver.values, shared)
+    samples_number = round(percentage*key_length)
+    mismatches = sample_mismatches(sender_key, receiver_key, key_length,
+                                   samples_number, rng)
+    return ProtocolResult(sifted_length=key_length,
+                          errors=count_errors(sender_key, receiver_key),
+                          sample_size=samples_number, mismatches=mismatches,
+                          interference=samples_number == 0 or mismatches > 0)
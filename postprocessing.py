@@ -0,0 +1,491 @@
+"""
+This module contains the classical post-processing that turns the shared
+key into a secret key: the errors are corrected with the Cascade
+protocol and then the key is shortened by privacy amplification, hashing
+it with a random Toeplitz matrix. Every bit disclosed during the error
+correction is counted as known by Eve, and the length of the final key
+is the length of the corrected key minus these leaked bits, minus the
+information that Eve could get from the errors themselves.
+Before the privacy amplification the two keys are compared through a
+short hash, and the key is discarded if they still differ.
+Cascade works on the differences between the keys packed in words of
+64 bits, an array for each pass: the parities of the blocks and of the
+halves of the bisection are read from the parities of the words, and
+the shuffles are affine maps of the positions, which are inverted
+without an array of indexes. The errors of all the blocks with an odd
+parity are looked for at the same time. The Toeplitz matrix is
+multiplied with a single FFT convolution, or word by word for short
+outputs like the hashes of the verification. A key of 10^6 bits with
+3% of errors is distilled in about 0.3 s. With 10^7 bits Cascade takes
+less than a second, but the three FFTs of the privacy amplification
+take about 3 s, still much less than a product of the whole matrix on
+words; 'benchmark.py' times the stages.
+"""
+import math
+from dataclasses import dataclass
+import numpy as np
+import engine
+import packed
+import randomness
+
+#Number of bits of the hashes of the two keys compared after Cascade,
+#which miss a key not corrected with probability 2^-VERIFICATION_BITS
+VERIFICATION_BITS = 64
+
+#Highest bit of a word, the first of the bits packed in it
+_HIGH_BIT = np.uint64(1 << 63)
+
+#Longest output of 'toeplitz_hash' computed word by word, for which it
+#is faster than the FFT
+_WORD_HASH_BITS = 1024
+
+#Length of the rows of positions of a shuffle of Cascade computed at once
+_ORDER_ROW = 1 << 12
+
+@dataclass
+class PostProcessingResult:
+    """
+    Summary of the post-processing of a key.
+
+    Attributes
+    ----------
+        key : ndarray
+            The final secret key, packed
+        final_length : int
+            Number of bits of the final key
+        leaked_bits : int
+            Number of bits disclosed by the error correction and by its
+            verification
+        residual_errors : int
+            Number of errors left after the error correction
+        verified : bool
+            Whether the hashes of the two keys were equal after the
+            error correction, otherwise the key is discarded
+        secret_key_rate : float
+            Bits of final key for each particle sent
+    """
+    key: np.ndarray
+    final_length: int
+    leaked_bits: int
+    residual_errors: int
+    verified: bool
+    secret_key_rate: float
+
+def binary_entropy(probability):
+    """
+    Binary entropy in bits of a probability, or of an array of them, 0
+    out of (0, 1)
+    """
+    p = np.clip(np.asarray(probability, dtype=float), 0., 1.)
+    inside = (p > 0) & (p < 1)
+    safe = np.where(inside, p, 0.5)
+    entropy = -safe*np.log2(safe) - (1 - safe)*np.log2(1 - safe)
+    #A single probability gives a single number instead of a 0-d array
+    return np.where(inside, entropy, 0.)[()]
+
+def _words(bits):
+    """
+    Pack an array of 0s and 1s in uint64 words, the first bit as the
+    highest bit of the first word, followed by a word of 0s, so that the
+    bits before any position up to the last one are read in two words
+    """
+    packed_words = packed.pack(bits).view(">u8")
+    return np.concatenate((packed_words,
+                           np.zeros(1, dtype=">u8"))).astype(np.uint64)
+
+def _unpack_words(words, length):
+    """Return the first 'length' bits of words packed by '_words'"""
+    return np.unpackbits(words.astype(">u8").view(np.uint8), count=length)
+
+def _parities(words):
+    """Parity of the number of bits set in each word, as 0s and 1s"""
+    return (engine.popcount(words[..., None], axis=-1) & 1).astype(np.uint8)
+
+def _shuffle(length, rng):
+    """
+    Draw the multiplier, coprime with the length, and the offset of a
+    random affine shuffle of 'length' positions
+    """
+    generator = rng.generator()
+    multiplier = 0
+    while math.gcd(multiplier, length) != 1:
+        multiplier = int(generator.integers(length))
+    return multiplier, int(generator.integers(length))
+
+def _order(length, multiplier, offset):
+    """
+    Positions in the key of all the bits of an affine shuffle, computed
+    as the sums of a column of the first positions of every row and of
+    a row of multiples of the multiplier, so that instead of a modulo for
+    every position the sums only need to be reduced once
+    """
+    dtype = np.int32 if length < 1 << 30 else np.int64
+    rows = -(-length//_ORDER_ROW)
+    firsts = ((np.arange(rows, dtype=np.int64)
+               *(multiplier*_ORDER_ROW % length) + offset) % length)
+    steps = np.arange(_ORDER_ROW, dtype=np.int64)*multiplier % length
+    order = np.add.outer(firsts.astype(dtype),
+                         steps.astype(dtype)).ravel()[:length]
+    np.subtract(order, length, out=order, where=order >= length)
+    return order
+
+@dataclass
+class _CascadePass:
+    """
+    The differences between the two keys in the order of a pass of
+    Cascade, packed in words. The bit i of the pass is the bit
+    (multiplier*i + offset) % length of the key, an affine shuffle that
+    is inverted with the inverse of the multiplier instead of an array
+    of indexes. The parity of any range of bits is read from the parities
+    of the words before it, computed again after every correction.
+    """
+    words: np.ndarray
+    length: int
+    block_size: int
+    multiplier: int = 1
+    offset: int = 0
+    _prefix: np.ndarray = None
+
+    def original(self, positions):
+        """Positions in the key of the given positions of the pass"""
+        return (positions*self.multiplier + self.offset) % self.length
+
+    def permuted(self, positions):
+        """Positions in the pass of the given positions of the key"""
+        inverse = pow(self.multiplier, -1, self.length)
+        return ((positions - self.offset)*inverse) % self.length
+
+    def flip(self, positions):
+        """Flip the bits at the given positions of the key, all different"""
+        permuted = self.permuted(positions)
+        np.bitwise_xor.at(self.words, permuted >> 6,
+                          _HIGH_BIT >> (permuted & 63).astype(np.uint64))
+        self._prefix = None
+
+    def before(self, positions):
+        """Parity of the bits of the pass before each of 'positions'"""
+        if self._prefix is None:
+            self._prefix = np.zeros(len(self.words), dtype=np.uint8)
+            np.bitwise_xor.accumulate(_parities(self.words[:-1]),
+                                      out=self._prefix[1:])
+        index = positions >> 6
+        #Shifting twice drops all the bits of the word when 'positions'
+        #starts it, which a shift by 64 would not do
+        heads = ((self.words[index]
+                  >> (np.uint64(63) - (positions & 63).astype(np.uint64)))
+                 >> np.uint64(1))
+        return self._prefix[index] ^ _parities(heads)
+
+    def bounds(self, blocks):
+        """First position and position after the last of the blocks"""
+        starts = blocks*self.block_size
+        return starts, np.minimum(starts + self.block_size, self.length)
+
+    def odd(self, blocks):
+        """Return the blocks among 'blocks' with an odd parity"""
+        starts, stops = self.bounds(blocks)
+        return blocks[self.before(starts) != self.before(stops)]
+
+    def bisect(self, blocks):
+        """
+        Find an error in each of the given blocks, all with an odd
+        number of errors, halving all the blocks at once. Returns the
+        positions of the errors in the key and the number of parities
+        disclosed.
+        """
+        lows, highs = self.bounds(blocks)
+        low_parities = self.before(lows)
+        leaked = 0
+        while True:
+            active = highs - lows > 1
+            if not active.any():
+                break
+            #The parity of the first half of every range is disclosed
+            leaked += int(np.count_nonzero(active))
+            middles = (lows + highs)//2
+            middle_parities = self.before(middles)
+            left_odd = active & (middle_parities != low_parities)
+            right_odd = active & ~left_odd
+            highs = np.where(left_odd, middles, highs)
+            lows = np.where(right_odd, middles, lows)
+            low_parities = np.where(right_odd, middle_parities,
+                                    low_parities)
+        return self.original(lows), leaked
+
+def cascade(sender_key, receiver_key, error_rate, passes=4, rng=None):
+    """
+    Correct the errors of the receiver's key with the Cascade protocol.
+    In every pass the key is shuffled and split in blocks, twice as long
+    as in the previous pass, and the parities of the blocks are
+    compared. In the blocks with a different parity an error is found by
+    bisection, and each correction is checked against the blocks of the
+    other passes that contain it, which can now have an odd parity.
+    The differences between the keys are packed in words for every pass,
+    and the parities are counted with popcount.
+
+    Parameters
+    ----------
+        sender_key : ndarray
+            The bits of the sender's key, as 0s and 1s
+        receiver_key : ndarray
+            The bits of the receiver's key, as 0s and 1s
+        error_rate : float
+            The estimated error rate, which sets the size of the blocks
+            of the first pass to 0.73/error_rate
+        passes : int, optional
+            The number of passes, default 4
+        rng : RandomSource, Generator or int, optional
+            The source of randomness for the shuffles
+
+    Returns
+    -------
+        corrected_key : ndarray
+            The receiver's key after the correction
+        leaked_bits : int
+            The number of parities disclosed
+    """
+    rng = randomness.as_source(rng)
+    length = len(sender_key)
+    sender_key = np.asarray(sender_key, dtype=np.uint8)
+    receiver_key = np.array(receiver_key, dtype=np.uint8)
+    if length == 0:
+        return receiver_key, 0
+    first_size = max(4, int(0.73/max(error_rate, 1e-9)))
+    leaked = 0
+    cascade_passes = [_CascadePass(_words(sender_key ^ receiver_key),
+                                   length, min(first_size, length))]
+    for current in range(passes):
+        if current > 0:
+            multiplier, offset = _shuffle(length, rng)
+            order = _order(length, multiplier, offset)
+            differences = _unpack_words(cascade_passes[0].words, length)
+            cascade_passes.append(_CascadePass(
+                _words(differences[order]), length,
+                min(first_size << current, length), multiplier, offset))
+        #The parities of all the blocks of the pass are disclosed
+        blocks = np.arange(-(-length//cascade_passes[current].block_size))
+        leaked += len(blocks)
+        #Every pass has its own list of corrections still to be checked
+        pending = [np.empty(0, dtype=np.int64) for _ in cascade_passes]
+        checking = (cascade_passes[current],
+                    cascade_passes[current].odd(blocks))
+        while checking is not None:
+            cascade_pass, odd = checking
+            positions, bits = cascade_pass.bisect(odd)
+            leaked += bits
+            for other in cascade_passes:
+                other.flip(positions)
+            pending = [np.concatenate((waiting, positions))
+                       for waiting in pending]
+            #A correction can make odd the blocks that contain it in the
+            #other passes, which are corrected one pass at a time
+            checking = None
+            for pass_number, waiting in enumerate(pending):
+                if len(waiting) == 0:
+                    continue
+                cascade_pass = cascade_passes[pass_number]
+                candidates = np.zeros(-(-length//cascade_pass.block_size),
+                                      dtype=bool)
+                candidates[cascade_pass.permuted(waiting)
+                           // cascade_pass.block_size] = True
+                pending[pass_number] = waiting[:0]
+                odd = cascade_pass.odd(np.flatnonzero(candidates))
+                if len(odd):
+                    checking = (cascade_pass, odd)
+                    break
+    #What is left of the differences are the errors not corrected
+    remaining = _unpack_words(cascade_passes[0].words, length)
+    return sender_key ^ remaining, leaked
+
+def _fft_size(minimum):
+    """Smallest 2^a*3^b*5^c not lower than 'minimum', fast for the FFT"""
+    best = 1 << max(minimum - 1, 0).bit_length()
+    power_5 = 1
+    while power_5 < best:
+        power_35 = power_5
+        while power_35 < best:
+            size = power_35 << max(-(-minimum//power_35) - 1,
+                                   0).bit_length()
+            best = min(best, size)
+            power_35 *= 3
+        power_5 *= 5
+    return best
+
+def _word_toeplitz(key, output_length, seed_bits):
+    """
+    Multiply the key by the Toeplitz matrix word by word. The row i of
+    the matrix is the window of len(key) bits of the reversed seed that
+    starts at the bit output_length-1-i, so the rows are read from the
+    64 shifts of the packed seed at offsets of whole words, and every bit
+    of the result is the parity of the AND of a row with the key.
+    """
+    key_words = _words(key)[:-1]
+    seed_words = _words(seed_bits[::-1])
+    hashed = np.zeros(output_length, dtype=np.uint8)
+    for shift in range(min(64, output_length)):
+        shifted = ((seed_words[:-1] << np.uint64(shift))
+                   | ((seed_words[1:] >> np.uint64(63 - shift))
+                      >> np.uint64(1)))
+        for start in range(shift, output_length, 64):
+            row = shifted[start >> 6:(start >> 6) + len(key_words)]
+            hashed[output_length - 1 - start] = (
+                engine.popcount(row & key_words) & 1)
+    return hashed
+
+def toeplitz_hash(key, output_length, seed_bits):
+    """
+    Multiply the key by a Toeplitz matrix, modulo 2. The matrix has
+    'output_length' rows and is defined by the len(key)+output_length-1
+    bits of its first column and first row, so the product is a
+    convolution, done with the FFT. Short outputs, like the hashes that
+    verify the error correction, are computed on words of 64 bits
+    instead.
+
+    Parameters
+    ----------
+        key : ndarray
+            The bits of the key, as 0s and 1s
+        output_length : int
+            The number of bits of the result
+        seed_bits : ndarray
+            The len(key)+output_length-1 bits that define the matrix
+
+    Returns
+    -------
+        hashed_key : ndarray
+            The bits of the result, as 0s and 1s
+    """
+    length = len(key)
+    if output_length <= 0 or length == 0:
+        return np.zeros(0, dtype=np.uint8)
+    if len(seed_bits) != length + output_length - 1:
+        raise ValueError("The seed must have len(key)+output_length-1 bits")
+    if output_length <= _WORD_HASH_BITS:
+        return _word_toeplitz(key, output_length, seed_bits)
+    #The wrap around of a circular convolution of this size only changes
+    #the first length-1 terms, which are not part of the result
+    size = _fft_size(length + output_length - 1)
+    convolution = np.fft.irfft(np.fft.rfft(seed_bits.astype(np.float64), size)
+                               *np.fft.rfft(key.astype(np.float64), size),
+                               size)[length - 1:length - 1 + output_length]
+    counts = np.rint(convolution)
+    #The counts are integers, a large rounding error means a wrong result
+    if np.max(np.abs(convolution - counts), initial=0) > 0.25:
+        raise ArithmeticError("The FFT was not precise enough")
+    return (counts.astype(np.int64) % 2).astype(np.uint8)
+
+def distill(sender_key, receiver_key, error_rate, n_particles=None,
+            security=1e-10, passes=4, rng=None):
+    """
+    Correct the errors of the shared key, verify the correction and
+    then shorten the key with privacy amplification. The final key has
+    n*(1 - h(error_rate)) - leaked_bits - 2*log2(1/security) bits, where
+    n is the length of the key and h is the binary entropy, and it's
+    empty when the hashes of the two keys differ after the correction.
+
+    Parameters
+    ----------
+        sender_key : ndarray
+            The bits of the sender's key, as 0s and 1s
+        receiver_key : ndarray
+            The bits of the receiver's key, as 0s and 1s
+        error_rate : float
+            The error rate estimated by comparing the keys
+        n_particles : int, optional
+            The number of particles sent to obtain the key, used for the
+            secret key rate, by default the length of the key
+        security : float, optional
+            The probability of failure of the privacy amplification,
+            default 1e-10
+        passes : int, optional
+            The number of passes of Cascade, default 4
+        rng : RandomSource, Generator or int, optional
+            The source of randomness of Cascade and of the Toeplitz
+            matrix
+
+    Returns
+    -------
+        result : PostProcessingResult
+            The final key and the numbers of the post-processing
+    """
+    rng = randomness.as_source(rng)
+    length = len(sender_key)
+    if n_particles is None:
+        n_particles = max(length, 1)
+    sender_key = np.asarray(sender_key, dtype=np.uint8)
+    corrected_key, leaked = cascade(sender_key, receiver_key, error_rate,
+                                    passes, rng)
+    residual_errors = int(np.count_nonzero(corrected_key != sender_key))
+    #The sender discloses a short hash of her key, which the receiver
+    #compares with the same hash of the corrected key
+    check_seed = rng.bits(length + VERIFICATION_BITS - 1)
+    verified = np.array_equal(
+        toeplitz_hash(sender_key, VERIFICATION_BITS, check_seed),
+        toeplitz_hash(corrected_key, VERIFICATION_BITS, check_seed))
+    leaked += VERIFICATION_BITS
+    final_length = int(length*(1 - binary_entropy(error_rate)) - leaked
+                       - 2*math.log2(1/security))
+    final_length = max(final_length, 0) if verified else 0
+    seed_bits = rng.bits(length + final_length - 1) if final_length else None
+    final_key = toeplitz_hash(sender_key, final_length, seed_bits)
+    return PostProcessingResult(key=packed.pack(final_key),
+                                final_length=final_length,
+                                leaked_bits=leaked,
+                                residual_errors=residual_errors,
+                                verified=verified,
+                                secret_key_rate=final_length/n_particles)
+
+def run(n_particles=100000, eavesdropping=False, percentage=0.5,
+        channel=None, security=1e-10, rng=None):
+    """
+    Run the complete protocol with the arrays of the engine, estimate
+    the error rate on a sample of the shared key and distill a secret
+    key from the rest.
+
+    Parameters
+    ----------
+        n_particles : int, optional
+            How many particles will be used
+        eavesdropping : bool, optional
+            Flag to start the simulation with or without eavesdropping
+        percentage : float, optional
+            Percentage of the shared bits compared, defaults to 0.5
+        channel : Channel, optional
+            The channel between sender and receiver, perfect if None
+        security : float, optional
+            The probability of failure of the privacy amplification
+        rng : RandomSource, Generator or int, optional
+            The source of randomness, or a NumPy generator or a seed
+            to create one
+
+    Returns
+    -------
+        result : PostProcessingResult
+            The final key and the numbers of the post-processing
+    """
+    if n_particles<1:
+        raise ValueError("Invalid number of particles, use at least 1")
+    rng = randomness.as_source(rng)
+    sender_bases, sender_values = engine.prepare(n_particles, rng)
+    sent_bases, sent_values = sender_bases, sender_values
+    if eavesdropping:
+        sent_bases, sent_values = engine.measure(sender_bases, sender_values,
+                                                 rng)
+    detected = np.ones(n_particles, dtype=bool)
+    if channel is not None:
+        sent_values, detected = channel.transmit(sent_bases, sent_values, rng)
+    receiver_bases, receiver_values = engine.measure(sent_bases, sent_values,
+                                                     rng)
+    shared_indexes = engine.sift(sender_bases, receiver_bases)
+    shared_indexes = shared_indexes[detected[shared_indexes]]
+    #The compared sample is disclosed, the rest of the key is distilled
+    samples_number = round(percentage*len(shared_indexes))
+    in_sample = np.zeros(len(shared_indexes), dtype=bool)
+    in_sample[rng.choice(len(shared_indexes), samples_number)] = True
+    sample = shared_indexes[in_sample]
+    error_rate = (np.count_nonzero(sender_values[sample]
+                                   != receiver_values[sample])
+                  / max(samples_number, 1))
+    key_indexes = shared_indexes[~in_sample]
+    return distill(sender_values[key_indexes], receiver_values[key_indexes],
+                   error_rate, n_particles, security, rng=rng)
@@ -0,0 +1,189 @@
+"""
+This module contains the instrumentation of the stages of the protocol:
+the preparation, the measurements of the eavesdropper and of the
+receiver, the comparison of the bases and the comparison of the keys.
+A 'Profiler' passed to 'simulation.run' as 'profiler' records for every
+stage the wall time, the number of particles processed and, if asked,
+the memory allocated, adding them up over all the runs that use it.
+The time spent printing is also recorded, as the 'printing' stage, and
+functions can be registered as hooks to receive every measure. When a
+stage runs inside another one, like the printing inside the steps of
+the protocol, its time is subtracted from the outer stage, so every
+second is counted in a single stage and the shares add up to 100%.
+Without a profiler the stages are entered with a context manager that
+does nothing, so the instrumentation costs close to nothing.
+"""
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+
+#Names of the stages of the protocol
+PREPARATION = "preparation"
+EAVESDROPPER = "eavesdropper measurement"
+RECEIVER = "receiver measurement"
+SIFTING = "compare_bases"
+SAMPLING = "compare_keys"
+PRINTING = "printing"
+
+#Context manager used for the stages when there is no profiler
+_DISABLED = nullcontext()
+
+@dataclass
+class StageProfile:
+    """
+    Measures of a stage, added up over all its calls.
+
+    Attributes
+    ----------
+        calls : int
+            Number of times the stage was run
+        seconds : float
+            Total wall time of the stage
+        elements : int
+            Total number of particles processed
+        allocated : int
+            Highest number of bytes allocated by a call, 0 if the memory
+            is not traced
+    """
+    calls: int = 0
+    seconds: float = 0.
+    elements: int = 0
+    allocated: int = 0
+
+class Profiler:
+    """
+    Collects the measures of the stages of many runs of the protocol.
+
+    Parameters
+    ----------
+        trace_memory : bool, optional
+            Flag to also measure the memory allocated by every stage with
+            tracemalloc, which makes the runs much slower. Default False.
+    """
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.hooks = []
+        #Seconds spent in the nested stages of every stage being run
+        self._children = []
+
+    def add_hook(self, hook):
+        """
+        Register a function called at the end of every stage, as
+        hook(name, seconds, elements, allocated).
+        """
+        self.hooks.append(hook)
+
+    def record(self, name, seconds, elements=0, allocated=0):
+        """Add a measure of the stage 'name' and pass it to the hooks"""
+        profile = self.stages.setdefault(name, StageProfile())
+        profile.calls += 1
+        profile.seconds += seconds
+        profile.elements += elements
+        profile.allocated = max(profile.allocated, allocated)
+        for hook in self.hooks:
+            hook(name, seconds, elements, allocated)
+
+    @contextmanager
+    def stage(self, name, elements=0):
+        """
+        Context manager that measures the code run inside it as a call
+        of the stage 'name', that processes 'elements' particles. The
+        time of the stages nested inside it is not counted. The peak of
+        the memory is only reset by the outermost stage, so a nested
+        stage records the memory it leaves allocated instead of its
+        peak.
+        """
+        outermost = not self._children
+        started_tracing = False
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            if outermost:
+                tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+        self._children.append(0.)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            seconds = elapsed - self._children.pop()
+            if self._children:
+                self._children[-1] += elapsed
+            allocated = 0
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                allocated = max((peak if outermost else current)
+                                - memory_before, 0)
+                if started_tracing:
+                    tracemalloc.stop()
+            self.record(name, seconds, elements, allocated)
+
+    def wrap_reporter(self, reporter):
+        """Return a reporter whose printing is measured as a stage"""
+        return _ProfiledReporter(reporter, self)
+
+    def merge(self, other):
+        """Add the measures of another profiler to this one"""
+        for name, profile in other.stages.items():
+            total = self.stages.setdefault(name, StageProfile())
+            total.calls += profile.calls
+            total.seconds += profile.seconds
+            total.elements += profile.elements
+            total.allocated = max(total.allocated, profile.allocated)
+
+    def report(self, file=sys.stdout):
+        """
+        Print a table with the measures of every stage: the calls, the
+        total time, the share of the time of all the stages, the
+        particles processed per second and the peak memory.
+        """
+        total_seconds = sum(profile.seconds
+                            for profile in self.stages.values())
+        print(f"{'stage':<26}{'calls':>8}{'seconds':>11}{'share':>8}"
+              f"{'particles/s':>14}{'peak MiB':>10}", file=file)
+        for name, profile in self.stages.items():
+            share = profile.seconds/total_seconds if total_seconds else 0.
+            rate = profile.elements/profile.seconds if profile.seconds else 0.
+            print(f"{name:<26}{profile.calls:>8}{profile.seconds:>11.4f}"
+                  f"{share:>8.1%}{rate:>14.3g}"
+                  f"{profile.allocated/2**20:>10.2f}", file=file)
+
+class _ProfiledReporter:
+    """Reporter that measures the methods of another one as printing"""
+    def __init__(self, reporter, profiler):
+        self._reporter = reporter
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        method = getattr(self._reporter, name)
+        def profiled(*args, **kwargs):
+            with self._profiler.stage(PRINTING):
+                return method(*args, **kwargs)
+        return profiled
+
+def stage(profiler, name, elements=0):
+    """
+    Enter the stage 'name' of 'profiler', or do nothing if it's None.
+
+    Parameters
+    ----------
+        profiler : Profiler or None
+            The profiler that records the stage
+        name : string
+            The name of the stage
+        elements : int, optional
+            The number of particles processed by the stage
+
+    Returns
+    -------
+        context manager
+            The context in which the stage is run
+    """
+    if profiler is None:
+        return _DISABLED
+    return profiler.stage(name, elements)
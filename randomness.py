@@ -0,0 +1,164 @@
+"""
+This module contains the sources of randomness used by the simulation.
+Every source draws its numbers in bulk from a stream of random bytes:
+bits are the unpacked bytes, uniform numbers are made from 53 bits of 8
+bytes and samples without replacement take the lowest of random
+priorities. 'GeneratorSource' takes the bytes from a NumPy Generator
+(PCG64, Philox, SFC64...), 'BufferSource' replays the bytes saved in a
+file, for example the dump of a hardware random number generator, and
+'LegacySource' keeps using the global generators of numpy.random and
+random, like the original version of 'simulation.py'.
+"""
+import random
+from abc import ABC, abstractmethod
+import numpy as np
+from numpy.random import randint
+
+class RandomSource(ABC):
+    """
+    Base class of the sources of randomness. The subclasses only need to
+    provide 'bytes', and can replace the other methods with faster ones.
+    """
+    @abstractmethod
+    def bytes(self, length):
+        """Return 'length' random bytes"""
+
+    def bits(self, size):
+        """
+        Draw random bits.
+
+        Parameters
+        ----------
+            size : int or tuple
+                The number of bits, or the shape of the array
+
+        Returns
+        -------
+            bits : ndarray
+                An array of uint8 of random 0s and 1s
+        """
+        count = int(np.prod(size))
+        random_bytes = np.frombuffer(self.bytes(-(-count//8)), dtype=np.uint8)
+        return np.unpackbits(random_bytes, count=count).reshape(size)
+
+    def words(self, size):
+        """Draw an array of uint64 with 64 random bits each"""
+        count = int(np.prod(size))
+        return np.frombuffer(self.bytes(8*count),
+                             dtype=np.uint64).reshape(size)
+
+    def random(self, size=None):
+        """Draw uniform numbers in [0, 1), with 53 random bits each"""
+        words = self.words(1 if size is None else size) >> np.uint64(11)
+        uniform = words*2.**-53
+        return float(uniform[0]) if size is None else uniform
+
+    def choice(self, population_size, samples_number):
+        """
+        Draw a sample without replacement of the integers from 0 to
+        population_size, as the ones with the lowest random priorities.
+
+        Returns
+        -------
+            indexes : ndarray
+                The sampled integers, in random order
+        """
+        priorities = self.random(population_size)
+        if samples_number < population_size:
+            lowest = np.argpartition(priorities,
+                                     samples_number)[:samples_number]
+        else:
+            lowest = np.arange(population_size)
+        return lowest[np.argsort(priorities[lowest])]
+
+    def sample(self, population, samples_number):
+        """Draw a sample without replacement of a list, as a list"""
+        indexes = self.choice(len(population), samples_number)
+        return [population[i] for i in indexes]
+
+    def generator(self):
+        """
+        Create a NumPy Generator seeded with bytes of this source, to
+        draw from distributions that can't be made from bits.
+        """
+        return np.random.default_rng(np.frombuffer(self.bytes(32),
+                                                   dtype=np.uint32))
+
+    def hypergeometric(self, good, bad, samples_number):
+        """Draw from the hypergeometric distribution, like NumPy does"""
+        return self.generator().hypergeometric(good, bad, samples_number)
+
+class GeneratorSource(RandomSource):
+    """Source that takes its random numbers from a NumPy Generator"""
+    def __init__(self, generator=None):
+        self.numpy_generator = np.random.default_rng(generator)
+
+    def bytes(self, length):
+        return self.numpy_generator.bytes(length)
+
+    def random(self, size=None):
+        return self.numpy_generator.random(size)
+
+    def choice(self, population_size, samples_number):
+        return self.numpy_generator.choice(population_size, samples_number,
+                                           replace=False)
+
+    def generator(self):
+        return self.numpy_generator
+
+    def hypergeometric(self, good, bad, samples_number):
+        return self.numpy_generator.hypergeometric(good, bad, samples_number)
+
+class BufferSource(RandomSource):
+    """
+    Source that replays the random bytes of a file, from the beginning
+    or from 'offset'. The file is memory-mapped, so it can be larger than
+    the available memory, and a ValueError is raised when it's used up.
+    """
+    def __init__(self, path, offset=0):
+        self.buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        self.position = offset
+
+    def bytes(self, length):
+        if self.position + length > len(self.buffer):
+            raise ValueError("The random buffer is exhausted")
+        random_bytes = self.buffer[self.position:self.position + length]
+        self.position += length
+        return random_bytes.tobytes()
+
+class LegacySource(RandomSource):
+    """
+    Source that uses the global generators of numpy.random and random,
+    so that numpy.random.seed keeps giving the same simulations.
+    """
+    def bytes(self, length):
+        return randint(0, 256, length, dtype=np.uint8).tobytes()
+
+    def bits(self, size):
+        return randint(0, 2, size)
+
+    def sample(self, population, samples_number):
+        return random.sample(population, samples_number)
+
+#Source used by simulation.py when no other is given
+LEGACY = LegacySource()
+
+def as_source(rng=None):
+    """
+    Turn what is accepted as 'rng' by the simulation into a source.
+
+    Parameters
+    ----------
+        rng : RandomSource, Generator, SeedSequence or int, optional
+            A source is returned as it is, the others are used to create
+            a NumPy Generator. If None, a Generator with a random seed
+            is created.
+
+    Returns
+    -------
+        source : RandomSource
+            The source of randomness
+    """
+    if isinstance(rng, RandomSource):
+        return rng
+    return GeneratorSource(rng)
@@ -0,0 +1,412 @@
+"""
+This module contains an asynchronous service that simulates many links
+between a sender and a receiver at the same time, with the arrays of
+the engine. The particles of every link are split in chunks, and the
+chunks go through a pipeline of stages connected by bounded queues:
+
+    generate -> transmit -> sift -> estimate
+
+The heavy stages run in a pool of processes, so while a chunk is being
+sifted the next one is being transmitted and another one generated,
+for any number of links. When a queue is full the stage before it waits,
+so the chunks in memory are always a bounded number, whatever the load.
+Every chunk and stage has its own random generator derived from the seed
+of the link, so the results don't depend on the order of the chunks.
+The service can be used from asyncio with 'LinkService.simulate', or
+over HTTP with 'LinkService.serve':
+
+    POST /links/<link>   with a JSON body like {"n_particles": 100000}
+    GET /metrics         throughput and latency of every link
+"""
+import asyncio
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+import numpy as np
+import engine
+import randomness
+from engine import ProtocolResult
+
+#Stages of the pipeline, also used to derive the random generators
+STAGES = ("generate", "transmit", "sift", "estimate")
+
+#Parameters of 'LinkService.simulate' accepted in the body of a POST, with
+#their types; the channel can't be sent over HTTP
+HTTP_PARAMETERS = {"n_particles": (int,), "eavesdropping": (bool,),
+                   "percentage": (int, float), "seed": (int,)}
+
+def _stage_source(seed, chunk, stage):
+    """Source of randomness of a stage of a chunk of a link"""
+    return randomness.as_source(np.random.SeedSequence(
+        seed, spawn_key=(chunk, STAGES.index(stage))))
+
+def _generate(seed, chunk, length):
+    """Prepare the states of a chunk"""
+    return engine.prepare(length, _stage_source(seed, chunk, "generate"))
+
+def _transmit(seed, chunk, bases, values, eavesdropping, channel):
+    """Send the states of a chunk and measure them"""
+    rng = _stage_source(seed, chunk, "transmit")
+    if eavesdropping:
+        bases, values = engine.measure(bases, values, rng)
+    detected = None
+    if channel is not None:
+        values, detected = channel.transmit(bases, values, rng)
+    receiver_bases, receiver_values = engine.measure(bases, values, rng)
+    return receiver_bases, receiver_values, detected
+
+def _sift(sender_bases, sender_values, receiver_bases, receiver_values,
+          detected):
+    """Count the shared bits of a chunk and the errors among them"""
+    shared = sender_bases == receiver_bases
+    if detected is not None:
+        shared &= detected
+    return (int(np.count_nonzero(shared)),
+            int(np.count_nonzero(shared & (sender_values
+                                           != receiver_values))))
+
+@dataclass
+class LinkMetrics:
+    """
+    Measures of the simulations of a link.
+
+    Attributes
+    ----------
+        requests : int
+            Number of simulations completed
+        particles : int
+            Number of particles simulated
+        busy_seconds : float
+            Time during which at least a simulation was running, up to
+            the end of the last one, so simulations at the same time are
+            counted once
+        total_latency : float
+            Sum of the times between the request and the result of the
+            simulations
+        last_latency : float
+            Time between the request and the result of the last one
+        active : int
+            Number of simulations running
+    """
+    requests: int = 0
+    particles: int = 0
+    busy_seconds: float = 0.
+    total_latency: float = 0.
+    last_latency: float = 0.
+    active: int = 0
+    #Start of the busy time not counted yet, not a field of the metrics
+    _busy_since = 0.
+
+    @property
+    def throughput(self):
+        """Particles simulated per second of simulation"""
+        return self.particles/self.busy_seconds if self.busy_seconds else 0.
+
+    @property
+    def mean_latency(self):
+        """Mean time between the request and the result"""
+        return self.total_latency/self.requests if self.requests else 0.
+
+    def begin(self, now):
+        """Record that a simulation started at the time 'now'"""
+        if self.active == 0:
+            self._busy_since = now
+        self.active += 1
+
+    def end(self, now):
+        """Record that a simulation ended at the time 'now'"""
+        self.busy_seconds += now - self._busy_since
+        self._busy_since = now
+        self.active -= 1
+
+class _Job:
+    """A simulation requested, with the counters of its chunks"""
+    def __init__(self, link, n_particles, eavesdropping, percentage, seed,
+                 channel, chunk_size):
+        self.link = link
+        self.n_particles = n_particles
+        self.eavesdropping = eavesdropping
+        self.percentage = percentage
+        self.seed = seed
+        self.channel = channel
+        self.chunks = -(-n_particles//chunk_size)
+        self.done = 0
+        self.sifted = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.future = asyncio.get_running_loop().create_future()
+
+class LinkService:
+    """
+    Simulates links concurrently, with a pipeline of stages.
+
+    Parameters
+    ----------
+        chunk_size : int, optional
+            Number of particles that go through the pipeline together
+        queue_size : int, optional
+            Maximum number of chunks waiting before every stage
+        stage_workers : int, optional
+            Number of chunks that every stage handles at the same time
+        executor : Executor, optional
+            Where the stages are run, by default a pool of processes
+            created when the service starts, with one per core
+    """
+    def __init__(self, chunk_size=1 << 16, queue_size=4, stage_workers=2,
+                 executor=None):
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size
+        self.stage_workers = stage_workers
+        self.executor = executor
+        self._own_executor = executor is None
+        self.links = {}
+        self._queues = []
+        self._tasks = []
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def start(self):
+        """Start the workers of the stages of the pipeline"""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor()
+        self._queues = [asyncio.Queue(self.queue_size) for _ in STAGES]
+        workers = (self._generate_worker, self._transmit_worker,
+                   self._sift_worker, self._estimate_worker)
+        self._tasks = [asyncio.create_task(worker(), name=stage)
+                       for stage, worker in zip(STAGES, workers)
+                       for _ in range(self.stage_workers)]
+
+    async def close(self):
+        """Stop the workers and the pool of processes"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._own_executor and self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    async def _run(self, function, *args):
+        """Run a stage in the executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, *args)
+
+    async def _generate_worker(self):
+        inbox, outbox = self._queues[0], self._queues[1]
+        while True:
+            job, chunk, length = await inbox.get()
+            try:
+                bases, values = await self._run(_generate, job.seed, chunk,
+                                                length)
+            except Exception as error:
+                self._fail(job, error)
+            else:
+                await outbox.put((job, chunk, bases, values))
+            inbox.task_done()
+
+    async def _transmit_worker(self):
+        inbox, outbox = self._queues[1], self._queues[2]
+        while True:
+            job, chunk, bases, values = await inbox.get()
+            try:
+                received = await self._run(_transmit, job.seed, chunk, bases,
+                                           values, job.eavesdropping,
+                                           job.channel)
+            except Exception as error:
+                self._fail(job, error)
+            else:
+                await outbox.put((job, bases, values, *received))
+            inbox.task_done()
+
+    async def _sift_worker(self):
+        inbox, outbox = self._queues[2], self._queues[3]
+        while True:
+            job, *arrays = await inbox.get()
+            try:
+                counts = await self._run(_sift, *arrays)
+            except Exception as error:
+                self._fail(job, error)
+            else:
+                await outbox.put((job, *counts))
+            inbox.task_done()
+
+    async def _estimate_worker(self):
+        inbox = self._queues[3]
+        while True:
+            job, sifted, errors = await inbox.get()
+            job.sifted += sifted
+            job.errors += errors
+            job.done += 1
+            if job.done == job.chunks and not job.future.done():
+                job.future.set_result(self._estimate(job))
+            inbox.task_done()
+
+    def _fail(self, job, error):
+        """Make the simulation of a job fail"""
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def _estimate(self, job):
+        """Compare a sample of the shared key and update the metrics"""
+        rng = _stage_source(job.seed, job.chunks, "estimate")
+        samples_number = round(job.percentage*job.sifted)
+        #The number of errors in the sample, drawn without replacement
+        mismatches = 0
+        if samples_number:
+            mismatches = int(rng.hypergeometric(job.errors,
+                                                job.sifted - job.errors,
+                                                samples_number))
+        latency = time.perf_counter() - job.started
+        metrics = self.links.setdefault(job.link, LinkMetrics())
+        metrics.requests += 1
+        metrics.particles += job.n_particles
+        metrics.total_latency += latency
+        metrics.last_latency = latency
+        return ProtocolResult(sifted_length=job.sifted, errors=job.errors,
+                              sample_size=samples_number,
+                              mismatches=mismatches,
+                              interference=(samples_number == 0
+                                            or mismatches > 0))
+
+    async def simulate(self, link, n_particles, eavesdropping=False,
+                       percentage=0.5, seed=None, channel=None):
+        """
+        Simulate a run of the protocol on a link, waiting when the
+        pipeline is full.
+
+        Parameters
+        ----------
+            link : string
+                The name of the link, used for its metrics
+            n_particles : int
+                How many particles will be used
+            eavesdropping : bool, optional
+                Flag to start the simulation with or without eavesdropping
+            percentage : float, optional
+                Percentage of the shared bits compared, defaults to 0.5
+            seed : int, optional
+                The seed of the run, by default a random one
+            channel : Channel, optional
+                The channel of the link, perfect if None
+
+        Returns
+        -------
+            result : ProtocolResult
+                The numbers of the comparison of the keys
+        """
+        if n_particles<1:
+            raise ValueError("Invalid number of particles, use at least 1")
+        if not self._tasks:
+            raise RuntimeError("The service is not started")
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        job = _Job(link, n_particles, eavesdropping, percentage, seed,
+                   channel, self.chunk_size)
+        metrics = self.links.setdefault(link, LinkMetrics())
+        metrics.begin(job.started)
+        try:
+            for chunk in range(job.chunks):
+                if job.future.done():
+                    break
+                length = min(self.chunk_size,
+                             n_particles - chunk*self.chunk_size)
+                await self._queues[0].put((job, chunk, length))
+            return await job.future
+        finally:
+            metrics.end(time.perf_counter())
+
+    def metrics(self):
+        """
+        Return the metrics of every link, as a dictionary that can be
+        converted to JSON.
+        """
+        return {link: {**asdict(metrics), "throughput": metrics.throughput,
+                       "mean_latency": metrics.mean_latency}
+                for link, metrics in self.links.items()}
+
+    async def serve(self, host="127.0.0.1", port=8084):
+        """
+        Serve the simulations over HTTP, until the server is closed.
+
+        Returns
+        -------
+            server : asyncio.Server
+                The server, already accepting connections
+        """
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def _handle(self, reader, writer):
+        """Answer a single HTTP request, always closing the connection"""
+        try:
+            try:
+                request_line = (await reader.readline()).decode().split()
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode().strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(
+                    int(headers.get("content-length", 0)))
+                status, answer = await self._answer(request_line, body)
+            except (ValueError, TypeError, KeyError,
+                    asyncio.IncompleteReadError) as error:
+                status, answer = "400 Bad Request", {"error": str(error)}
+            except Exception as error:
+                status = "500 Internal Server Error"
+                answer = {"error": f"{type(error).__name__}: {error}"}
+            payload = json.dumps(answer).encode()
+            writer.write(f"HTTP/1.1 {status}\r\n"
+                         f"Content-Type: application/json\r\n"
+                         f"Content-Length: {len(payload)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + payload)
+            await writer.drain()
+        except ConnectionError:
+            #The client went away, there is nobody to answer
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _answer(self, request_line, body):
+        """Find the status and the JSON answer of a request"""
+        if len(request_line) != 3 or not request_line[2].startswith("HTTP/"):
+            raise ValueError("Invalid request line, use 'METHOD PATH "
+                             "HTTP/1.1'")
+        method, path = request_line[0], request_line[1]
+        if method == "GET" and path == "/metrics":
+            return "200 OK", self.metrics()
+        if method == "POST" and path.startswith("/links/"):
+            parameters = _parameters(body)
+            result = await self.simulate(path[len("/links/"):], **parameters)
+            return "200 OK", {**asdict(result), "qber": result.qber}
+        return "404 Not Found", {"error": f"No resource {method} {path}"}
+
+def _parameters(body):
+    """
+    Read the parameters of a simulation from the JSON body of a POST,
+    raising a ValueError for unknown keys or values of the wrong type.
+    """
+    parameters = json.loads(body or b"{}")
+    if not isinstance(parameters, dict):
+        raise ValueError("The body must be a JSON object")
+    for name, value in parameters.items():
+        if name not in HTTP_PARAMETERS:
+            raise ValueError(f"Unknown parameter {name}, use "
+                             f"{', '.join(HTTP_PARAMETERS)}")
+        types = HTTP_PARAMETERS[name]
+        #In Python a bool is also an int
+        if (not isinstance(value, types)
+                or isinstance(value, bool) != (types == (bool,))):
+            raise ValueError(f"Invalid value of {name}: {value!r}")
+    return parameters
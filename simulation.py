@@ -1,10 +1,26 @@
 """
 This module contains all the functions to simulate the BB84 protocol.
 """
-import random
 import math
-from numpy.random import randint
-import pandas as pd
+import sys
+import numpy as np
+import engine
+import profiling
+import randomness
+from engine import ProtocolResult
+
+#Version of the results of the simulation, to increase when the same
+#random numbers start giving different results, so that the results
+#saved in a cache are not used anymore
+VERSION = 1
+
+def _pandas():
+    """
+    Import pandas only when the first DataFrame is created, so that the
+    modules that don't need it start faster
+    """
+    import pandas
+    return pandas
 
 #To highlight matches in pairs of bases, different colors are useful
 Colors ={
@@ -15,8 +31,107 @@ Colors ={
     'END': '\033[0m', #Turns coloring of text off, resetting to default
 }
 
+class TerminalReporter:
+    """
+    Class that explains each step of the protocol by printing to the
+    terminal. The functions of the protocol call its methods when they
+    receive it as 'reporter', while with reporter=None they print
+    nothing and the results are never formatted.
+    """
+    def prepared(self, name, state):
+        """Show the state prepared by 'name'"""
+        print(name,"chose a random sequence of orthogonal bases and prepared "
+              "the states with these values")
+        #Transpose shows the result horizontally, making it more readable
+        print(state.transpose())
+
+    def received(self, name, state):
+        """Show the result of the measurement done by 'name'"""
+        print(name,"too chose a random sequence of orthogonal bases and "
+              "obtained these results in his measurements")
+        print(state.transpose())
+
+    def bases_compared(self, result_1, result_2, shared_indexes):
+        """Highlight the matching bases and show the shared key"""
+        base_1=result_1.base
+        base_2=result_2.base
+        print("The measurements done on the same bases are highlighted in "
+              "green")
+        for bases in (base_1, base_2):
+            for i,letter in enumerate(bases):
+                if base_1[i]==base_2[i]:
+                    print(f"{Colors['GREEN']}"+letter+f"{Colors['END']}",
+                          end="")
+                else:
+                    print(f"{Colors['RED']}"+letter+f"{Colors['END']}",
+                          end="")
+            print("")
+        #Create a DataFrame to show the results on the shared bases
+        shared_bases=_pandas().DataFrame(
+            result_1.loc[shared_indexes].values, columns=['bases', 'key'])
+        print("Now A and B should have a shared key based on the shared "
+              "bases")
+        print(f"The key is {len(shared_indexes)} bits long")
+        print(shared_bases.set_index('bases').transpose())
+
+    def too_few_bits(self):
+        """Explain that the key was too small to be compared"""
+        print("There were not enought bits to make a key")
+
+    def sample_chosen(self, percentage, samples_number, shared_number,
+                      sample_base=None):
+        """Explain how many bits of the key will be compared"""
+        print(f"The sender and the receiver decided to take {percentage*100}% "
+              f"of the bits of their key to check for eaversdroppers.\nThe "
+              f"sample is done randomly and contains {samples_number} out of "
+              f"{shared_number} bits of the complete key.")
+        if sample_base is not None:
+            print(f"Only the bits measured in the rare base {sample_base} "
+                  f"are compared, the others are kept for the key.")
+
+    def keys_compared(self, matching_percentage, interference):
+        """Show the result of the comparison of the keys"""
+        print(f"The matching percentage between the two results is "
+              f"{matching_percentage*100}""%")
+        if not interference:
+            print(f"{Colors['BLUE']}There were no eavesdroppers nor quantum "
+                  f"mistakes!{Colors['END']}")
+        else:
+            print(f"{Colors['YELLOW']}There were too many mistakes, somebody "
+                  f"eavesdropped!{Colors['END']}")
+
+#Default reporter of all the functions, that explains every step
+TERMINAL = TerminalReporter()
+
+def _source(rng):
+    """Source of randomness for 'rng', the global generators if None"""
+    if rng is None:
+        return randomness.LEGACY
+    return randomness.as_source(rng)
+
+def rare_base(sender_z_probability=0.5, receiver_z_probability=0.5):
+    """
+    Find the base in which the sender and the receiver agree less often,
+    which is the one used to check the key when the bases are biased.
+
+    Parameters
+    ----------
+    sender_z_probability : float, optional
+        The probability that the sender chooses the base Z
+    receiver_z_probability : float, optional
+        The probability that the receiver chooses the base Z
+
+    Returns
+    -------
+    base: string
+        "X" or "Z", or None when both choose with equal probabilities
+        and the whole key is checked like in the original protocol
+    """
+    base = engine.rare_base(sender_z_probability, receiver_z_probability)
+    return None if base is None else "XZ"[base]
+
 #Doing a measurement with this protocol the bases are chosen randomly
-def randomly_choose_bases(bases_lenght):
+def randomly_choose_bases(bases_lenght, rng=None, z_probability=0.5):
     """
     Create a sequence of random choices of orthogonal bases (X or Z) for
     the quantum measurement.
@@ -25,22 +140,28 @@ def randomly_choose_bases(bases_lenght):
     ----------
     bases_lenght : integer
         Specifies the number of bases that will be chosen
+    rng : RandomSource, Generator or int, optional
+        The source of randomness, if None the global generator of
+        numpy.random is used
+    z_probability : float, optional
+        The probability of choosing Z, 0.5 by default. With a biased
+        choice most bases match, and the key is longer
 
     Returns
     -------
     result_string: list
         A series with lenght l of random Xs and Zs 
     """
-    result_string = []
-    for _ in range(bases_lenght):
-        if randint(0,2)==0:
-            result_string.append("X")
-        else:
-            result_string.append("Z")
+    if z_probability == 0.5:
+        #All the random bits are drawn at once, 0 is X and 1 is Z
+        bits = _source(rng).bits(bases_lenght)
+    else:
+        bits = _source(rng).random(bases_lenght) < z_probability
+    result_string = np.where(bits==0, "X", "Z").tolist()
     return result_string
 
 #This this is the measurement done by the sender, who prepares the state
-def random_preparation(state_lenght):
+def random_preparation(state_lenght, rng=None):
     """
     Emulates the results of a series of measurements done with random 
     bases on particles in a superposition of spin up and down.
@@ -49,17 +170,21 @@ def random_preparation(state_lenght):
     ----------
     state_lenght : integer
         Specifies the number of particles that are measured
+    rng : RandomSource, Generator or int, optional
+        The source of randomness, if None the global generator of
+        numpy.random is used
 
     Returns
     -------
     result_list: list
         A series of random 1s and 0s
     """
-    result_list=randint(0,2,state_lenght)
+    result_list=_source(rng).bits(state_lenght)
     return result_list
 
 #Combine random base choices and random measurements
-def prepare_particles(n_particles, name):
+def prepare_particles(n_particles, name, reporter=TERMINAL, rng=None,
+                      z_probability=0.5):
     """
     Runs the operations of the first person who prepares the states,
     explaining and printing to terminal the result.
@@ -70,6 +195,13 @@ def prepare_particles(n_particles, name):
         Specifies the number of particles that will be prepared
     name : string, optional
         Name used in printing to describes who chose the bases
+    reporter : TerminalReporter, optional
+        Explains the result, if None nothing is printed
+    rng : RandomSource, optional
+        The source of randomness, if None the global generator of
+        numpy.random is used
+    z_probability : float, optional
+        The probability of choosing the base Z, 0.5 by default
 
     Returns
     -------
@@ -77,20 +209,19 @@ def prepare_particles(n_particles, name):
         The result of the preparation of the entangled state
     """
     #Person chooses random bases for preparation
-    bases = randomly_choose_bases(n_particles)
+    bases = randomly_choose_bases(n_particles, rng, z_probability)
     #Person measures qubits
-    values = random_preparation(n_particles)
+    values = random_preparation(n_particles, rng)
     #Bases chosen and values measured are paired in a dataframe
-    prepared_state = pd.DataFrame({'base': bases, 'value': values},
-                                  columns=['base', 'value'])
-    print(name,"chose a random sequence of orthogonal bases and prepared the "
-          "states with these values")
-    #Transpose shows the result horizontally, making it more readable
-    print(prepared_state.transpose())
+    prepared_state = _pandas().DataFrame({'base': bases, 'value': values},
+                                         columns=['base', 'value'])
+    if reporter is not None:
+        reporter.prepared(name, prepared_state)
     return prepared_state
 
 #Measurement done by either the receiver or the eavesdropper
-def receive_particles(received_states, name):
+def receive_particles(received_states, name, reporter=TERMINAL, rng=None,
+                      z_probability=0.5):
     """
     Runs the operations of a person who receives an already prepared 
     state and in doing so, modifies the state. Also explains the result
@@ -102,6 +233,13 @@ def receive_particles(received_states, name):
         The complete state that gets received and measured
     name : string
         Name used in printing to describe who received the state
+    reporter : TerminalReporter, optional
+        Explains the result, if None nothing is printed
+    rng : RandomSource, optional
+        The source of randomness, if None the global generator of
+        numpy.random is used
+    z_probability : float, optional
+        The probability of choosing the base Z, 0.5 by default
 
     Returns
     -------
@@ -110,24 +248,21 @@ def receive_particles(received_states, name):
     """
     n = len(received_states.index) #Number of particles received
     #Person chooses random bases for measurement
-    bases = randomly_choose_bases(n)
-    values = []
-    for i in range(n):
-        #When the base chosen by the receiver matches the one chosen by
-        #the sender, the result should be the same because entangled
-        if bases[i]==received_states.base[i]:
-            values.append(received_states.value[i])
-        #If the base chosen is different, the result will be random
-        else: values.append(randint(0,2))
-    result = pd.DataFrame({'base': bases, 'value': values},
-                          columns=['base', 'value'])
-    print(name,"too chose a random sequence of orthogonal bases and obtained "
-          "these results in his measurements")
-    print(result.transpose())
+    bases = randomly_choose_bases(n, rng, z_probability)
+    #When the base chosen by the receiver matches the one chosen by the
+    #sender, the result should be the same because entangled
+    values = received_states.value.to_numpy().copy()
+    #If the base chosen is different, the result will be random
+    different = np.array(bases) != received_states.base.to_numpy()
+    values[different] = _source(rng).bits(np.count_nonzero(different))
+    result = _pandas().DataFrame({'base': bases, 'value': values},
+                                 columns=['base', 'value'])
+    if reporter is not None:
+        reporter.received(name, result)
     return result
 
 #The base comparison between sender and receiver is done publicly
-def compare_bases(result_1,result_2):
+def compare_bases(result_1,result_2,reporter=TERMINAL):
     """
     Compares two sets of bases and visually highlights the values that
     are equal. Then show these shared bases that have the same results,
@@ -139,6 +274,8 @@ def compare_bases(result_1,result_2):
         One of the two results to compare with each other
     result_2 : DataFrame
         One of the two results to compare with each other
+    reporter : TerminalReporter, optional
+        Explains the result, if None nothing is printed
     
     Returns
     -------
@@ -147,46 +284,45 @@ def compare_bases(result_1,result_2):
         sender and the  receiver chose to use the same base for the
         measurement.
     """
-    base_1=result_1.base
-    base_2=result_2.base
-    #Shared results, equal if there are no errors or eavesdroppers
-    shared_data = []
-    #Contains the indexes of shared results, to check for errors later
-    shared_data_indexes = []
-    print("The measurements done on the same bases are highlighted in green")
-    for i,letter in enumerate(base_1):
-        if base_1[i]==base_2[i]:
-            #When there is a match it gets added it to the shared lists
-            #The results should match too, so result_1.iloc[i] or
-            #result_2.iloc[i] should match too. The actual matching is
-            #checked later, shared_data is just for visualization.
-            shared_data.append(result_1.iloc[i].tolist())
-            shared_data_indexes.append(result_1.index[i])
-            print(f"{Colors['GREEN']}"+letter+f"{Colors['END']}",end="")
-        else:
-            print(f"{Colors['RED']}"+letter+f"{Colors['END']}",end="")
-    print("")
-    for i,letter in enumerate(base_2):
-        if base_1[i]==base_2[i]:
-            print(f"{Colors['GREEN']}"+letter+f"{Colors['END']}",end="")
-        else:
-            print(f"{Colors['RED']}"+letter+f"{Colors['END']}",end="")
-    print("")
-    #Create a DataFrame to show the results on the shared bases
-    shared_bases=pd.DataFrame(shared_data, columns=['bases', 'key'])
-    print("Now A and B should have a shared key based on the shared bases")
-    print(f"The key is {len(shared_data_indexes)} bits long")
-    print(shared_bases.set_index('bases').transpose())
+    #Contains the indexes of shared results, to check for errors later.
+    #The results should match too, but the actual matching is checked
+    #later
+    matches = np.flatnonzero(result_1.base.to_numpy()
+                             == result_2.base.to_numpy())
+    shared_data_indexes = result_1.index[matches].tolist()
+    if reporter is not None:
+        reporter.bases_compared(result_1, result_2, shared_data_indexes)
     return shared_data_indexes
 
+def _scan_matches(chosen_bits, sender_values, receiver_values):
+    """Count the matches in the sorted chosen bits, scanning all values"""
+    #This will incrase by one every time a match is found
+    matches = 0
+    #Index used to loop over the list of indexes
+    a = 0
+    for i,_ in enumerate(sender_values):
+        if i==chosen_bits[a]:
+            #Check the next index on the next iteration
+            a += 1
+            #To avoid out of bounds in the list chosen_bits
+            if a == len(chosen_bits):
+                #Check it there is a match one last time
+                if sender_values[i] == receiver_values[i]:
+                    matches += 1
+                break
+            #Check the match
+            if sender_values[i] == receiver_values[i]:
+                matches += 1
+    return matches
+
 #The final step of the protocol, comparing publicly half the bits
-def compare_keys(shared_indexes, sender, receiver, percentage=0.5):
+def check_keys(shared_indexes, sender, receiver, percentage=0.5,
+               reporter=TERMINAL, rng=None, threshold=0., indexed=False,
+               sample_base=None):
     """
     Compare the values of the measurements done in the specified
-    indexes. The numbers of values that get compared can be modiefied,
-    based on a percentage. Also prints the details of the comparison and
-    gives a comment to explain if the creation of the key was successful
-    or not.
+    indexes, like 'compare_keys', but return all the numbers of the
+    comparison instead of only the verdict.
 
     Parameters
     ----------
@@ -198,62 +334,221 @@ def compare_keys(shared_indexes, sender, receiver, percentage=0.5):
             The complete result of the receiver to compare
         percentage : int, optional
             Percentage of bits that will be compared, defaults to 0.5
+        reporter : TerminalReporter, optional
+            Explains the comparison, if None nothing is printed
+        rng : RandomSource, optional
+            The source of randomness, if None the global generator of
+            random is used
+        threshold : float, optional
+            Highest error rate in the sample that is accepted, defaults
+            to 0 so that any mismatch is an interference
+        indexed : bool, optional
+            If True the sample is drawn as an array of indexes and only
+            those values are read, instead of scanning all the values,
+            which is much faster for long keys. Defaults to False.
+        sample_base : string, optional
+            If given, only the shared bits measured in this base are
+            sampled, 'percentage' of them, and the others all form the
+            key. Used with the rare base when the bases are biased, see
+            'rare_base'
 
     Returns
     -------
-        bool
-            True is there was interefece and the key don't match, False
-            if there was no interference (100% matching rate).
-            Also returns True is the keys was too small and it made
-            comparing impossible.
+        result : ProtocolResult
+            The lenght of the key, the size of the sample, the number of
+            mismatches, the verdict of the comparison and the indexes of
+            the bits that were not compared, which form the key
     """
     sender_values = sender.value
     receiver_values = receiver.value
+    if indexed:
+        shared_indexes = np.asarray(shared_indexes, dtype=np.int64)
+    #Errors in the whole key, which Alice and Bob can't see
+    sender_array = sender_values.to_numpy()
+    receiver_array = receiver_values.to_numpy()
+    errors = int(np.count_nonzero(sender_array[shared_indexes]
+                                  != receiver_array[shared_indexes]))
+    #Positions in the shared indexes of the bits that can be sampled
+    candidates = range(len(shared_indexes))
+    if sample_base is not None:
+        shared_bases = sender.base.to_numpy()[
+            np.asarray(shared_indexes, dtype=np.int64)]
+        candidates = np.flatnonzero(shared_bases == sample_base)
     #The shared indexes get randomly selected to be shared
-    samples_number = round(percentage*len(shared_indexes))
+    samples_number = round(percentage*len(candidates))
     #If the key was too small with no bits in sample, return true
     if samples_number == 0:
-        print("There were not enought bits to make a key")
-        return True
-    chosen_bits = random.sample(shared_indexes,samples_number)
-    chosen_bits.sort()
-    print(f"The sender and the receiver decided to take {percentage*100}% of "
-          f"the bits of their key to check for eaversdroppers.\nThe sample is "
-          f"done randomly and contains {samples_number} out of "
-          f"{len(shared_indexes)} bits of the complete key.")
+        if reporter is not None:
+            reporter.too_few_bits()
+        return ProtocolResult(sifted_length=len(shared_indexes),
+                              errors=errors, sample_size=0, mismatches=0,
+                              interference=True,
+                              key_indexes=np.asarray(shared_indexes))
+    if indexed:
+        #Only the positions in the sample are read, with fancy indexing
+        sample_positions = np.asarray(candidates, dtype=np.int64)[
+            _source(rng).choice(len(candidates), samples_number)]
+        chosen_bits = shared_indexes[sample_positions]
+    else:
+        population = shared_indexes
+        if sample_base is not None:
+            population = [shared_indexes[i] for i in candidates]
+        chosen_bits = _source(rng).sample(population,samples_number)
+        chosen_bits.sort()
+    if reporter is not None:
+        reporter.sample_chosen(percentage, samples_number,
+                               len(shared_indexes), sample_base)
     #Maximum possible number of matches of the selected bits
     max_matches=len(chosen_bits)
-    #This will incrase by one every time a match is found
-    matches = 0
-    #Index used to loop over the list of indexes
-    a = 0
-    for i,_ in enumerate(sender_values):
-        if i==chosen_bits[a]:
-            #Check the next index on the next iteration
-            a += 1
-            #To avoid out of bounds in the list chosen_bits
-            if a == len(chosen_bits):
-                #Check it there is a match one last time
-                if sender_values[i] == receiver_values[i]:
-                    matches += 1
-                break
-            #Check the match
-            if sender_values[i] == receiver_values[i]:
-                matches += 1
+    if indexed:
+        matches = max_matches - int(np.count_nonzero(
+            sender_array[chosen_bits] != receiver_array[chosen_bits]))
+        #The bits that were not disclosed form the key
+        in_key = np.ones(len(shared_indexes), dtype=bool)
+        in_key[sample_positions] = False
+        key_indexes = shared_indexes[in_key]
+    else:
+        matches = _scan_matches(chosen_bits, sender_values, receiver_values)
+        disclosed = set(chosen_bits)
+        key_indexes = np.array([i for i in shared_indexes
+                                if i not in disclosed], dtype=np.int64)
     matching_percentage = matches/max_matches
-    print(f"The matching percentage between the two results is "
-          f"{matching_percentage*100}""%")
     #Once the comparing is done, we see if we are satisfied with the key
-    if math.isclose(matching_percentage,1):
-        print(f"{Colors['BLUE']}There were no eavesdroppers nor quantum "
-              f"mistakes!{Colors['END']}")
-        return False #No eavesdroppers
-    print(f"{Colors['YELLOW']}There were too many mistakes, somebody "
-          f"eavesdropped!{Colors['END']}")
-    return True #Eavesdroppers
+    interference = (not math.isclose(matching_percentage,1)
+                    and 1 - matching_percentage > threshold)
+    if reporter is not None:
+        reporter.keys_compared(matching_percentage, interference)
+    return ProtocolResult(sifted_length=len(shared_indexes), errors=errors,
+                          sample_size=samples_number,
+                          mismatches=max_matches - matches,
+                          interference=interference, key_indexes=key_indexes)
+
+def compare_keys(shared_indexes, sender, receiver, percentage=0.5,
+                 reporter=TERMINAL, rng=None, threshold=0., indexed=False,
+                 sample_base=None):
+    """
+    Compare the values of the measurements done in the specified
+    indexes. The numbers of values that get compared can be modiefied,
+    based on a percentage. Also prints the details of the comparison and
+    gives a comment to explain if the creation of the key was successful
+    or not.
+
+    Parameters
+    ----------
+        shared_indexes : list
+            A list of integers indicating what measurements to compare
+        sender : DataFrame
+            The complete result of the sender to compare
+        receiver : DataFrame
+            The complete result of the receiver to compare
+        percentage : int, optional
+            Percentage of bits that will be compared, defaults to 0.5
+        reporter : TerminalReporter, optional
+            Explains the comparison, if None nothing is printed
+        rng : RandomSource, optional
+            The source of randomness, if None the global generator of
+            random is used
+        threshold : float, optional
+            Highest error rate in the sample that is accepted, defaults
+            to 0 so that any mismatch is an interference
+        indexed : bool, optional
+            Flag to read only the sampled bits, see 'check_keys'
+        sample_base : string, optional
+            The only base of the bits sampled, see 'check_keys'
+
+    Returns
+    -------
+        bool
+            True is there was interefece and the key don't match, False
+            if there was no interference (100% matching rate).
+            Also returns True is the keys was too small and it made
+            comparing impossible.
+    """
+    return check_keys(shared_indexes, sender, receiver, percentage,
+                      reporter, rng, threshold, indexed,
+                      sample_base).interference
+
+def run_protocol(n_particles=1000, sender="Alice", receiver="Bob",
+                 eavesdropper="Eve", eavesdropping=False, reporter=TERMINAL,
+                 rng=None, indexed=False, profiler=None,
+                 sender_z_probability=0.5, receiver_z_probability=0.5,
+                 percentage=0.5):
+    """
+    Run the complete simulation and return the numbers of the final
+    comparison of the keys.
+
+    Parameters
+    ----------
+        n_particles : int, optional
+            How many particles will be used
+        sender : string, optional
+            The name used in printing for the sender, default Alice
+        receiver : string, optional
+            The name used in printing for the receiver, default Bob
+        eavesdropper : string, optional
+            The name used in printing for the eavesdropper, default Eve
+        eavesdropping : bool, optional
+            Flag to start the simulation with or without eavesdropping
+        reporter : TerminalReporter, optional
+            Explains every step, if None nothing is printed
+        rng : RandomSource, Generator or int, optional
+            The source of randomness used by all the steps, if None the
+            global generators of numpy.random and random are used
+        indexed : bool, optional
+            Flag to compare the keys reading only the sampled bits, see
+            'check_keys'
+        profiler : Profiler, optional
+            Records the time spent in every stage, see 'profiling.py'
+        sender_z_probability : float, optional
+            The probability that the sender chooses the base Z
+        receiver_z_probability : float, optional
+            The probability that the receiver chooses the base Z. When
+            the bases are biased only the shared bits of the rare base
+            are compared, and the others form the key
+        percentage : float, optional
+            Percentage of the shared bits compared, defaults to 0.5
+
+    Returns
+    -------
+        result : ProtocolResult
+            The lenght of the key, the size of the sample, the number of
+            mismatches, the error rate and the verdict
+    """
+    if n_particles<1:
+        raise ValueError("Invalid number of particles, use at least 1")
+    sample_base = rare_base(sender_z_probability, receiver_z_probability)
+    #The same source is shared by all the steps
+    rng = _source(rng)
+    if profiler is not None and reporter is not None:
+        reporter = profiler.wrap_reporter(reporter)
+    with profiling.stage(profiler, profiling.PREPARATION, n_particles):
+        sender_result=prepare_particles(n_particles,sender,reporter,rng,
+                                        sender_z_probability)
+    with profiling.stage(profiler, profiling.EAVESDROPPER, n_particles):
+        eavsdropper_result=receive_particles(sender_result, eavesdropper,
+                                             reporter, rng)
+    with profiling.stage(profiler, profiling.RECEIVER, n_particles):
+        if eavesdropping is False:
+            receiver_result=receive_particles(sender_result, receiver,
+                                              reporter, rng,
+                                              receiver_z_probability)
+        elif eavesdropping is True:
+            receiver_result=receive_particles(eavsdropper_result, receiver,
+                                              reporter, rng,
+                                              receiver_z_probability)
+    #After the measurements are done, Alice and Bob share their bases
+    with profiling.stage(profiler, profiling.SIFTING, n_particles):
+        shared_bases = compare_bases(sender_result,receiver_result,reporter)
+    #Then they also compare a certain number of random bits of the key
+    with profiling.stage(profiler, profiling.SAMPLING, len(shared_bases)):
+        return check_keys(shared_bases, sender_result, receiver_result,
+                          percentage, reporter=reporter, rng=rng,
+                          indexed=indexed, sample_base=sample_base)
 
 def run(n_particles=1000, sender="Alice", receiver="Bob", eavesdropper="Eve",
-        eavesdropping=False):
+        eavesdropping=False, reporter=TERMINAL, rng=None, profiler=None,
+        sender_z_probability=0.5, receiver_z_probability=0.5,
+        percentage=0.5):
     """
     Run the complete simulation.
     
@@ -269,32 +564,40 @@ def run(n_particles=1000, sender="Alice", receiver="Bob", eavesdropper="Eve",
             The name used in printing for the eavesdropper, default Eve
         eavesdropping : bool, optional
             Flag to start the simulation with or without eavesdropping
+        reporter : TerminalReporter, optional
+            Explains every step, if None nothing is printed
+        rng : RandomSource, Generator or int, optional
+            The source of randomness used by all the steps, if None the
+            global generators of numpy.random and random are used
+        profiler : Profiler, optional
+            Records the time spent in every stage, see 'profiling.py'
+        sender_z_probability : float, optional
+            The probability that the sender chooses the base Z
+        receiver_z_probability : float, optional
+            The probability that the receiver chooses the base Z, see
+            'run_protocol'
+        percentage : float, optional
+            Percentage of the shared bits compared, defaults to 0.5
 
     Returns
     -------
         intereference : bool
             Is true if there was some interference, otherwise it's false
     """
-    if n_particles<1:
-        raise ValueError("Invalid number of particles, use at least 1")
-    sender_result=prepare_particles(n_particles,sender)
-    eavsdropper_result=receive_particles(sender_result, eavesdropper)
-    if eavesdropping is False:
-        receiver_result=receive_particles(sender_result, receiver)
-    elif eavesdropping is True:
-        receiver_result=receive_particles(eavsdropper_result, receiver)
-    #After the measurements are done, Alice and Bob share their bases
-    shared_bases = compare_bases(sender_result,receiver_result)
-    #Then they also compare a certain number of random bits of the key
-    intereference = compare_keys(shared_bases, sender_result, receiver_result)
+    result = run_protocol(n_particles, sender, receiver, eavesdropper,
+                          eavesdropping, reporter, rng, profiler=profiler,
+                          sender_z_probability=sender_z_probability,
+                          receiver_z_probability=receiver_z_probability,
+                          percentage=percentage)
     #Return true if there was interference, otherwise return false
-    return intereference
+    return result.interference
 
-def main():
-    """Run the simulation"""
-    #Change a pandas setting to show a long dataframe without newlines
-    pd.set_option('display.expand_frame_repr', False)
-    run()
+def main(argv=None):
+    """Run the simulation explaining every step, see 'cli.py'"""
+    #Imported here because cli imports this module when explaining
+    import cli
+    return cli.main(["run", "--explain",
+                     *(sys.argv[1:] if argv is None else argv)])
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+This module contains the functions to run many simulations of the BB84
+protocol, for many numbers of particles, on all the cores available.
+The runs are split in blocks of at most BLOCK_RUNS runs of the same
+number of particles, and the runs of a block in groups of GROUP_RUNS.
+Each group has its own random generator, created from a NumPy
+SeedSequence that depends only on the master seed, on the number of
+particles and on the positions of the block and of the group. In this
+way the same master seed always gives the same results, whatever the
+number of processes used to run the blocks, and the first runs of a
+block are the same whatever the number of runs simulated, so that only
+the groups of the runs counted are simulated. With a
+'cache.ResultCache' the runs already simulated with the same seed are
+taken from the cache, and only the others are simulated.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cache as result_cache
+import engine
+
+#Maximum number of runs simulated together by a single task
+BLOCK_RUNS = 4096
+
+#Number of runs of a block that share the same random generator
+GROUP_RUNS = 64
+
+def block_seed(seed, particles, block, group):
+    """
+    Create the seed of the random generator used for a group of runs of
+    a block.
+
+    Parameters
+    ----------
+        seed : int
+            The master seed of the whole sweep
+        particles : int
+            The number of particles used in the runs of the block
+        block : int
+            The position of the block among the ones with the same
+            number of particles
+        group : int
+            The position of the group of runs in the block, or of the
+            run when every run has its own generator
+    Returns
+    -------
+        SeedSequence
+            A seed independent from the one of every other group
+    """
+    return np.random.SeedSequence(seed, spawn_key=(particles, block, group))
+
+def simulator_name(simulator, sender_z_probability=0.5,
+                   receiver_z_probability=0.5):
+    """
+    Name of a simulator in the cache, which includes the probabilities
+    of the base Z when they are biased, so that biased runs are cached
+    as different points.
+
+    Parameters
+    ----------
+        simulator : string
+            The name of the simulator, with its version
+        sender_z_probability : float, optional
+            The probability that the sender chooses the base Z
+        receiver_z_probability : float, optional
+            The probability that the receiver chooses the base Z
+    Returns
+    -------
+        string
+            The name used in the keys of the cache
+    """
+    if engine.rare_base(sender_z_probability,
+                        receiver_z_probability) is None:
+        return simulator
+    return f"{simulator}-z{sender_z_probability}-{receiver_z_probability}"
+
+def _point_key(particles, eavesdropping, percentage, seed, biases):
+    """Key of the blocks of a number of particles in the cache"""
+    return result_cache.point_key(
+        simulator_name(f"engine-{engine.VERSION}", *biases), BLOCK_RUNS,
+        particles, eavesdropping, percentage, seed)
+
+def _simulate_block(task):
+    """
+    Outcomes of the runs of a block from 'start' to 'stop', described by
+    'task', simulating the whole groups that contain them
+    """
+    (particles, block, start, stop, eavesdropping, percentage, seed,
+     biases) = task
+    first = start//GROUP_RUNS
+    outcomes = np.concatenate([
+        engine.run_batch(particles, GROUP_RUNS, eavesdropping, percentage,
+                         np.random.default_rng(block_seed(seed, particles,
+                                                          block, group)),
+                         *biases)
+        for group in range(first, -(-stop//GROUP_RUNS))])
+    return outcomes[start - first*GROUP_RUNS:stop - first*GROUP_RUNS]
+
+def count_detections(number_of_runs, number_of_particles, eavesdropping=True,
+                     percentage=0.5, seed=None, workers=None, cache=None,
+                     sender_z_probability=0.5, receiver_z_probability=0.5):
+    """
+    Run the simulation 'number_of_runs' times for each number of
+    particles, sharing the blocks of runs among a pool of processes.
+
+    Parameters
+    ----------
+        number_of_runs : int
+            The number of times each instance of simulation will run
+        number_of_particles : list
+            The list containing all the numbers of particles used
+        eavesdropping : bool, optional
+            Flag to run the simulations with or without eavesdropping,
+            defaults to True
+        percentage : float, optional
+            Percentage of the shared bits compared, defaults to 0.5
+        seed : int, optional
+            The master seed, if None a random one is used
+        workers : int, optional
+            Number of processes, defaults to the number of cores. With 1
+            the blocks are simulated in the calling process.
+        cache : ResultCache, optional
+            The cache of the detections of the blocks, only the blocks
+            that are not in it are simulated
+        sender_z_probability : float, optional
+            The probability that the sender chooses the base Z
+        receiver_z_probability : float, optional
+            The probability that the receiver chooses the base Z, see
+            'engine.run_batch'
+    Returns
+    -------
+        detections : ndarray
+            The number of runs with a detection for each number of
+            particles
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    biases = (sender_z_probability, receiver_z_probability)
+    detections = np.zeros(len(number_of_particles), dtype=np.int64)
+    tasks = []
+    points = []
+    saved = []
+    for point, particles in enumerate(number_of_particles):
+        key = _point_key(particles, eavesdropping, percentage, seed, biases)
+        for block, start in enumerate(range(0, number_of_runs, BLOCK_RUNS)):
+            runs = min(BLOCK_RUNS, number_of_runs - start)
+            outcomes = np.zeros(0, dtype=bool)
+            if cache is not None:
+                outcomes = cache.outcomes(key, block)
+                if len(outcomes) >= runs:
+                    detections[point] += np.count_nonzero(outcomes[:runs])
+                    continue
+            #Only the runs that are not in the cache are simulated
+            tasks.append((particles, block, len(outcomes), runs,
+                          eavesdropping, percentage, seed, biases))
+            points.append(point)
+            saved.append(outcomes)
+    if workers == 1:
+        results = list(map(_simulate_block, tasks))
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(_simulate_block, tasks, chunksize=4))
+    found = []
+    for (particles, block, *_), outcomes, new in zip(tasks, saved, results):
+        outcomes = np.concatenate((outcomes, new))
+        if cache is not None:
+            cache.put(_point_key(particles, eavesdropping, percentage, seed,
+                                 biases), block, outcomes)
+        found.append(np.count_nonzero(outcomes))
+    #Results are summed in the order of the tasks, not of their completion
+    np.add.at(detections, points, found)
+    return detections
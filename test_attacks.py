@@ -0,0 +1,74 @@
+"""
+Module that contains tests for the strategies of the eavesdropper.
+"""
+import math
+import pytest
+import attacks
+from postprocessing import binary_entropy
+
+@pytest.mark.parametrize(
+    "attack,strength,qber,information",
+    [("intercept-resend",0.,0.,0.),
+     ("intercept-resend",0.5,0.125,0.25),
+     ("intercept-resend",1.,0.25,0.5),
+     ("breidbart",1.,0.25,1 - binary_entropy(attacks.BREIDBART_ERROR))]
+)
+def test_qber_and_information(attack,strength,qber,information):
+    """
+    Test that the attacks cause the expected QBER and give Eve the
+    expected information
+
+    Given an attack and the fraction of particles attacked
+    When a million particles are sent
+    Then the QBER and Eve's information match the theory
+    """
+    result = attacks.run_attack(attack, 10**6, strength, rng=3)
+    assert math.isclose(result.qber, qber, abs_tol=0.004)
+    assert math.isclose(result.eve_information, information, abs_tol=0.004)
+
+def test_photon_number_splitting_decoys():
+    """
+    Test that splitting the photons causes no errors but is revealed by
+    the decoy states
+
+    Given weak pulses with a decoy intensity
+    When they are sent with and without the attack
+    Then there are no errors, and the estimated yield of single photons
+    drops from the transmittance to about 0
+    """
+    honest = attacks.run_attack("photon-number-splitting", 10**6, 0., rng=3,
+                                transmittance=0.1, decoys=(0.1,))
+    attacked = attacks.run_attack("photon-number-splitting", 10**6, 1.,
+                                  rng=3, transmittance=0.1, decoys=(0.1,))
+    assert honest.errors == attacked.errors == 0
+    assert honest.eve_information == 0
+    assert attacked.eve_information == 1
+    #Eve keeps the rate of the signal pulses unchanged
+    assert math.isclose(attacked.yields[0], honest.yields[0], rel_tol=0.05)
+    assert math.isclose(honest.single_photon_yield, 0.1, abs_tol=0.01)
+    assert attacked.single_photon_yield < 0.02
+
+def test_attack_grid():
+    """
+    Test the grid of strengths and key lengths
+
+    Given a few strengths and key lengths
+    When the grid is simulated
+    Then the QBER grows with the strength and is 0 without the attack
+    """
+    qber, information = attacks.attack_grid("intercept-resend", [0., 1.],
+                                            [1000, 10000], rng=3)
+    assert qber.shape == information.shape == (2, 2)
+    assert (qber[0] == 0).all()
+    assert (qber[1] > 0.15).all()
+
+def test_unknown_attack():
+    """
+    Test that an attack that doesn't exist is refused
+
+    Given a name that is not in ATTACKS
+    When the attack is run
+    Then a ValueError is raised
+    """
+    with pytest.raises(ValueError):
+        attacks.run_attack("teleport", 100)
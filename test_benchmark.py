@@ -0,0 +1,57 @@
+"""
+Module that contains tests for the benchmark of the simulation.
+"""
+import pytest
+import benchmark
+
+@pytest.mark.parametrize("paths", [(["run"]),(["compare_keys","engine.run"])])
+def test_run_benchmarks(paths):
+    """
+    Test that every path is measured for every size up to its maximum.
+
+    Given a list of paths and of sizes, one above the maximum of 'run'
+    When the benchmark is run
+    Then the results have positive times, throughputs and memory
+    """
+    results = benchmark.run_benchmarks([100, 10**6], paths, repeats=1,
+                                       output=None)
+    measured = [(result["path"], result["size"]) for result in results]
+    expected = [(path, size) for path in paths for size in [100, 10**6]
+                if size <= benchmark.PATHS[path][1]]
+    assert measured == expected
+    for result in results:
+        assert result["seconds"] > 0
+        assert result["qubits_per_second"] > 0
+        assert result["peak_memory"] >= 0
+
+def test_unknown_path():
+    """
+    Test that a path that doesn't exist is refused.
+
+    Given the name of a path that is not in PATHS
+    When the benchmark is run
+    Then a ValueError is raised
+    """
+    with pytest.raises(ValueError):
+        benchmark.run_benchmarks([100], ["sleep"], output=None)
+
+@pytest.mark.parametrize("seconds,slower", [(1.1,False),(1.5,True)])
+def test_compare_results(seconds,slower,tmp_path):
+    """
+    Test that a path slower than the baseline by more than the tolerance
+    is a regression, also after saving and loading the baseline.
+
+    Given a baseline and a new time for the same path
+    When the results are compared with a tolerance of 25%
+    Then a regression is found only if the new time is too high
+    """
+    baseline_file = tmp_path/"baseline.json"
+    benchmark.save_results([{"path": "run", "size": 100, "seconds": 1.}],
+                           baseline_file)
+    baseline = benchmark.load_results(baseline_file)
+    results = [{"path": "run", "size": 100, "seconds": seconds},
+               {"path": "run", "size": 1000, "seconds": 100.}]
+    regressions = benchmark.compare_results(results, baseline, 0.25)
+    assert bool(regressions) == slower
+    if slower:
+        assert regressions[0]["ratio"] == pytest.approx(seconds)
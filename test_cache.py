@@ -0,0 +1,130 @@
+"""
+Module that contains tests for the cache of the results of the sweeps.
+"""
+import numpy as np
+import pytest
+import cache
+import graph
+import sweep
+
+def test_incremental_runs(tmp_path):
+    """
+    Test that adding runs to a point only simulates the new runs, also
+    when the runs added are in a block already saved.
+
+    Given a cache saved in a file and a seed
+    When more runs of the same point are asked, also after reopening it
+    Then only the missing runs are simulated, and the detections are
+    counted from the outcomes of the runs saved
+    """
+    path = tmp_path/"cache.sqlite"
+    point = cache.point_key("test", 10, 5, True, 0.5, 1)
+    simulated = []
+    def simulate_runs(block, start, stop):
+        simulated.append((block, start, stop))
+        #The first 'block' runs of every block are detections
+        return [run < block for run in range(start, stop)]
+    with cache.ResultCache(path) as results:
+        assert results.count(point, 25, simulate_runs) == 0 + 1 + 2
+        assert simulated == [(0, 0, 10), (1, 0, 10), (2, 0, 5)]
+    with cache.ResultCache(path) as results:
+        assert results.count(point, 21, simulate_runs) == 0 + 1 + 1
+        assert results.count(point, 35, simulate_runs) == 0 + 1 + 2 + 3
+        assert simulated[3:] == [(2, 5, 10), (3, 0, 5)]
+        assert len(results) == 4
+
+def test_least_recently_used():
+    """
+    Test that a full cache removes the blocks used least recently.
+
+    Given a cache that keeps 2 blocks
+    When a third block is saved after using the first one again
+    Then the second block is the one removed
+    """
+    point = cache.point_key("test", 3, 5, True, 0.5, 1)
+    with cache.ResultCache(":memory:", max_blocks=2) as results:
+        results.put(point, 0, [True, False, False])
+        results.put(point, 1, [True, True, False])
+        assert results.get(point, 0, 3) == 1
+        results.put(point, 2, [True, True, True])
+        assert len(results) == 2
+        assert results.get(point, 1, 3) is None
+        assert results.get(point, 0, 3) == 1
+        assert results.get(point, 2, 2) == 2
+
+def test_too_many_runs():
+    """
+    Test that a block can't have more runs than block_runs
+    """
+    point = cache.point_key("test", 3, 5, True, 0.5, 1)
+    with cache.ResultCache(":memory:") as results:
+        with pytest.raises(ValueError):
+            results.put(point, 0, [True]*4)
+
+def test_sweep_cache():
+    """
+    Test that the sweep gives the same detections with the cache, and
+    that the second time nothing is simulated.
+
+    Given a seed and a sweep of a few numbers of particles
+    When the sweep is run twice with a cache
+    Then the detections are the same as without the cache
+    """
+    particles = [1, 5, 20]
+    runs = sweep.BLOCK_RUNS + 10
+    expected = sweep.count_detections(runs, particles, seed=3, workers=1)
+    with cache.ResultCache(":memory:") as results:
+        first = sweep.count_detections(runs, particles, seed=3, workers=1,
+                                       cache=results)
+        assert len(results) == 6
+        second = sweep.count_detections(runs, particles, seed=3, workers=1,
+                                        cache=results)
+    assert np.array_equal(first, expected)
+    assert np.array_equal(second, expected)
+
+def test_simulate_fixed_cache():
+    """
+    Test that the cached runs of 'simulate_fixed' are reproducible and
+    need a seed.
+
+    Given a cache and a seed
+    When the same runs are done with and without the saved blocks
+    Then the failure rates are the same, and without a seed it fails
+    """
+    with cache.ResultCache(":memory:") as results:
+        first = graph.simulate_fixed(150, 10, cache=results, seed=4)
+        assert len(results) == 2
+        second = graph.simulate_fixed(150, 10, cache=results, seed=4)
+        with pytest.raises(ValueError):
+            graph.simulate_fixed(150, 10, cache=results)
+    with cache.ResultCache(":memory:") as results:
+        third = graph.simulate_fixed(150, 10, cache=results, seed=4)
+    assert first == second == third
+    assert 0 < first < 1
+
+def test_simulate_fixed_more_runs(monkeypatch):
+    """
+    Test that more runs of 'simulate_fixed' only simulate the new runs
+
+    Given a cache with 5 runs of a point, and then with 150
+    When 160 runs of the same point are asked
+    Then only the runs missing are simulated, and the saved runs are
+    counted in the same way
+    """
+    runs = []
+    run = graph.simulation.run
+    def counted_run(*args, **kwargs):
+        runs.append(1)
+        return run(*args, **kwargs)
+    monkeypatch.setattr(graph.simulation, "run", counted_run)
+    with cache.ResultCache(":memory:") as results:
+        graph.simulate_fixed(5, 10, cache=results, seed=4)
+        assert len(runs) == 5
+        first = graph.simulate_fixed(150, 10, cache=results, seed=4)
+        assert len(runs) == 150
+        more = graph.simulate_fixed(160, 10, cache=results, seed=4)
+        assert len(runs) == 160
+        assert len(results) == 2
+    with cache.ResultCache(":memory:") as results:
+        assert graph.simulate_fixed(150, 10, cache=results, seed=4) == first
+    assert 0 <= round(more*160) - round(first*150) <= 10
@@ -0,0 +1,52 @@
+"""
+Module that contains tests for the model of a realistic channel.
+"""
+import math
+import numpy as np
+import pytest
+import engine
+import channel
+
+def test_transmittance():
+    """
+    Test the probability of detection of a particle
+
+    Given a fibre of 50 km with 0.2 dB/km and a detector of 50%
+    When the transmittance is calculated
+    Then it's 10% of 50%
+    """
+    link = channel.Channel(length_km=50, detector_efficiency=0.5)
+    assert math.isclose(link.transmittance, 0.05)
+
+@pytest.mark.parametrize("threshold,detection", [(0.,True),(0.11,False)])
+def test_threshold(threshold,detection):
+    """
+    Test that the threshold decides if a noisy channel is accepted
+
+    Given a channel with 3% of flips and losses
+    When the protocol runs without Eve
+    Then the key is rejected only with a threshold lower than the noise
+    """
+    link = channel.Channel(length_km=10, flip_probability=0.03)
+    result = engine.run_protocol(100000, channel=link, threshold=threshold,
+                                 rng=3)
+    assert result.interference == detection
+    #About 63% of the particles arrive and half of those are shared
+    assert abs(result.sifted_length/100000 - link.transmittance/2) < 0.01
+    assert abs(result.errors/result.sifted_length - 0.03) < 0.005
+
+def test_link_grid():
+    """
+    Test the simulation of a grid of links
+
+    Given a few lengths of the fibre and flip probabilities
+    When the grid of links is simulated
+    Then longer fibres give shorter keys and the error rates are right
+    """
+    lengths = [0, 25, 50]
+    flips = [0., 0.05]
+    sifted, errors = channel.link_grid(lengths, flips, 200000, rng=3)
+    assert sifted.shape == errors.shape == (3, 2)
+    assert np.all(np.diff(sifted, axis=0) < 0)
+    assert np.all(errors[:, 0] == 0)
+    assert np.all(np.abs(errors[:, 1]/sifted[:, 1] - 0.05) < 0.01)
@@ -0,0 +1,118 @@
+"""
+Module that contains tests for the command line interface.
+"""
+import json
+import subprocess
+import sys
+import pytest
+import cli
+
+@pytest.mark.parametrize("eavesdropping,detection_rate", [([],0.),
+                                                         (["--eavesdropping"],
+                                                          1.)])
+def test_run_json(eavesdropping,detection_rate,capsys):
+    """
+    Test the results of the runs written as JSON
+
+    Given a number of particles and of runs, with or without Eve
+    When the runs are simulated from the command line
+    Then the JSON has a result for every run and the right detection rate
+    """
+    assert cli.main(["run", "--particles", "1000", "--runs", "3",
+                     "--seed", "1", "--format", "json", *eavesdropping]) == 0
+    output = json.loads(capsys.readouterr().out)
+    assert len(output["runs"]) == 3
+    assert output["detection_rate"] == detection_rate
+
+@pytest.mark.parametrize("output_format", [("csv"),("text")])
+def test_same_seed(output_format,capsys):
+    """
+    Test that the same seed gives the same output
+
+    Given a seed
+    When the runs are simulated twice, in CSV or as a table
+    Then the outputs are identical and have a line for every run
+    """
+    arguments = ["run", "--particles", "100", "--runs", "4", "--seed", "7",
+                 "--format", output_format]
+    cli.main(arguments)
+    first = capsys.readouterr().out
+    cli.main(arguments)
+    assert capsys.readouterr().out == first
+    assert len(first.splitlines()) == 5 + (output_format == "text")
+
+def test_explain(capsys):
+    """
+    Test that the explained run prints the steps with the DataFrames
+
+    Given a small number of particles
+    When the run is explained
+    Then the steps are printed before the results
+    """
+    cli.main(["run", "--particles", "20", "--seed", "1", "--explain"])
+    output = capsys.readouterr().out
+    assert "Alice chose a random sequence" in output
+    assert "Detection rate" in output
+
+def test_explain_percentage(capsys):
+    """
+    Test that the explained run compares the percentage asked
+
+    Given a number of particles and a percentage of 0.2
+    When the run is explained
+    Then the sample is a fifth of the shared bits
+    """
+    cli.main(["run", "--particles", "200", "--seed", "1", "--explain",
+              "--percentage", "0.2", "--format", "json"])
+    output = capsys.readouterr().out
+    assert "take 20.0%" in output
+    result = json.loads(output[output.index('{\n  "runs"'):])["runs"][0]
+    assert result["sample_size"] == round(0.2*result["sifted_length"])
+
+def test_invalid_particles():
+    """
+    Test that a number of particles lower than 1 is refused
+
+    Given 0 particles
+    When the command line is parsed
+    Then the program exits with an error
+    """
+    with pytest.raises(SystemExit):
+        cli.main(["run", "--particles", "0"])
+
+def test_biased_bases(capsys):
+    """
+    Test the runs with biased bases
+
+    Given bases chosen Z with probability 0.9 by both parties
+    When the runs are simulated from the command line
+    Then most of the particles are shared and the sample is small
+    """
+    cli.main(["run", "--particles", "1000", "--seed", "1", "--format",
+              "json", "--sender-z", "0.9", "--receiver-z", "0.9"])
+    result = json.loads(capsys.readouterr().out)["runs"][0]
+    assert result["sifted_length"] > 700
+    assert result["sample_size"] < 50
+
+@pytest.mark.parametrize("probability", [("0"),("1.5")])
+def test_invalid_bias(probability):
+    """
+    Test that a probability of the base Z out of (0, 1) is refused
+    """
+    with pytest.raises(SystemExit):
+        cli.main(["run", "--sender-z", probability])
+
+def test_light_imports():
+    """
+    Test that the engine and the command line start without pandas and
+    matplotlib
+
+    Given a new interpreter
+    When the engine and the command line are imported
+    Then pandas and matplotlib are not
+    """
+    code = ("import sys, cli, engine, graph, simulation; "
+            "print('pandas' in sys.modules, 'matplotlib' in sys.modules)")
+    output = subprocess.run([sys.executable, "-c", code], check=True,
+                            capture_output=True, text=True).stdout
+    assert output.split() == ["False", "False"]
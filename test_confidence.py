@@ -0,0 +1,52 @@
+"""
+Module that contains tests for the confidence intervals.
+"""
+import math
+import pytest
+import confidence
+
+@pytest.mark.parametrize(
+    "successes,trials,method,lower,upper",
+    [(5,10,"wilson",0.236593,0.763407),
+     (5,10,"clopper-pearson",0.187086,0.812914),
+     (0,10,"clopper-pearson",0.,1 - 0.025**0.1),
+     (10,10,"clopper-pearson",0.025**0.1,1.)]
+)
+def test_known_intervals(successes,trials,method,lower,upper):
+    """
+    Test the intervals on cases with known values
+
+    Given a number of successes and of trials
+    When the 95% interval is calculated
+    Then its ends match the known ones
+    """
+    found = confidence.interval(successes, trials, 0.95, method)
+    assert math.isclose(found[0], lower, abs_tol=1e-6)
+    assert math.isclose(found[1], upper, abs_tol=1e-6)
+
+@pytest.mark.parametrize("successes,trials", [(5,100),(37,100),(900,1000)])
+def test_clopper_pearson_wider(successes,trials):
+    """
+    Test that the exact interval contains the Wilson one
+
+    Given a number of successes and of trials
+    When both intervals are calculated
+    Then the Clopper-Pearson interval is the widest
+    """
+    wilson = confidence.wilson_interval(successes, trials)
+    exact = confidence.clopper_pearson_interval(successes, trials)
+    assert exact[0] <= wilson[0] + 1e-9
+    assert exact[1] >= wilson[1] - 1e-9
+
+def test_invalid_arguments():
+    """
+    Test that invalid confidences and methods are refused
+
+    Given a confidence outside (0, 1) or an unknown method
+    When the interval is calculated
+    Then a ValueError is raised
+    """
+    with pytest.raises(ValueError):
+        confidence.interval(1, 2, 1.5)
+    with pytest.raises(ValueError):
+        confidence.interval(1, 2, method="bayes")
@@ -0,0 +1,191 @@
+"""
+Module that contains tests for the array-backed engine of the simulation.
+"""
+import numpy as np
+import pytest
+import engine
+import randomness
+
+@pytest.mark.parametrize("n_particles", [(1),(100)])
+def test_prepare(n_particles):
+    """
+    Test that the preparation returns valid bases and values
+
+    Given a reasonable number of particles
+    When the states are prepared
+    Then bases and values have the proper lenght and contain only 0 or 1
+    """
+    rng = randomness.as_source(3)
+    bases, values = engine.prepare(n_particles, rng)
+    assert len(bases) == len(values) == n_particles
+    assert set(np.unique(bases)) <= {0, 1}
+    assert set(np.unique(values)) <= {0, 1}
+
+def test_measure_same_bases_keeps_values():
+    """
+    Test that a measurement keeps the values where the bases match
+
+    Given a prepared state
+    When it's measured with random bases
+    Then the values are the same wherever the bases are the same
+    """
+    rng = randomness.as_source(3)
+    bases, values = engine.prepare(1000, rng)
+    measured_bases, measured_values = engine.measure(bases, values, rng)
+    shared = engine.sift(bases, measured_bases)
+    assert np.array_equal(values[shared], measured_values[shared])
+
+@pytest.mark.parametrize(
+    "n_particles,eavesdropping,detection",
+    [(1,False,True),(100,False,False),(100,True,True)]
+)
+def test_run(n_particles,eavesdropping,detection):
+    """
+    Test that the engine gives the same verdict of 'simulation.run'
+
+    Given a number of particles, with or without Eve
+    When the engine runs the complete protocol
+    Then there is a detection only with Eve or with too few particles
+    """
+    interference = engine.run(n_particles, eavesdropping=eavesdropping,
+                              rng=3)
+    assert interference == detection
+
+def test_run_invalid_particles():
+    """
+    Test that the engine refuses to run without particles
+    """
+    with pytest.raises(ValueError):
+        engine.run(0)
+
+@pytest.mark.parametrize(
+    "n_particles,eavesdropping,detection",
+    [(1,True,True),(100,False,False),(200,True,True)]
+)
+def test_run_batch(n_particles,eavesdropping,detection):
+    """
+    Test that the batch of runs gives the expected verdicts
+
+    Given a number of particles and of runs, with or without Eve
+    When all the runs are simulated together
+    Then there is one verdict per run, all equal to the expected one
+    """
+    interferences = engine.run_batch(n_particles, 500,
+                                     eavesdropping=eavesdropping, rng=3)
+    assert interferences.shape == (500,)
+    assert np.all(interferences == detection)
+
+@pytest.mark.parametrize("chunk_size", [(7),(1000),(5000)])
+def test_run_stream(chunk_size):
+    """
+    Test that the run in chunks keeps consistent counters
+
+    Given a number of particles split in chunks, with Eve
+    When the simulation runs on the stream of chunks
+    Then the counters are consistent and the interference is detected
+    """
+    result = engine.run_stream(2000, eavesdropping=True,
+                               chunk_size=chunk_size, rng=3)
+    assert 0 < result.sifted_length < 2000
+    #Every chunk rounds its own sample
+    assert (abs(result.sample_size - 0.5*result.sifted_length)
+            <= 0.5*-(-2000//chunk_size))
+    assert result.mismatches <= min(result.errors, result.sample_size)
+    assert result.interference
+
+def test_stream_single_chunk():
+    """
+    Test that the stream with a single chunk is the run on arrays
+
+    Given a number of particles in a single chunk, with Eve
+    When the simulation runs on the stream and on the arrays
+    Then the results are the same
+    """
+    assert (engine.run_stream(3000, True, chunk_size=3000, rng=5)
+            == engine.run_protocol(3000, True, rng=5))
+
+@pytest.mark.parametrize("eavesdropping", [(False),(True)])
+def test_stream_keys(eavesdropping):
+    """
+    Test the keys yielded a chunk at a time
+
+    Given a number of particles split in chunks, with or without Eve
+    When the keys of the chunks are streamed
+    Then every key has the shared bits that were not compared, and the
+    keys match without Eve
+    """
+    for result, sender_key, receiver_key in engine.stream_keys(
+            5000, eavesdropping, chunk_size=1000, rng=3):
+        assert len(sender_key) == len(receiver_key)
+        assert len(sender_key) == result.sifted_length - result.sample_size
+        errors = np.count_nonzero(sender_key != receiver_key)
+        assert errors == result.errors - result.mismatches
+        assert eavesdropping or errors == 0
+
+def test_run_stream_no_eve():
+    """
+    Test that without Eve the run in chunks finds no errors
+    """
+    result = engine.run_stream(5000, chunk_size=100, rng=3)
+    assert result.errors == result.mismatches == 0
+    assert result.qber == 0
+    assert not result.interference
+
+@pytest.mark.parametrize("probability", [(0.1),(0.5),(0.9)])
+def test_biased_words(probability):
+    """
+    Test that the bits of the biased words are 1 as often as asked
+
+    Given a probability
+    When many biased words are drawn
+    Then the fraction of bits set is close to the probability
+    """
+    words = engine._biased_words((1000, 16), probability,
+                                 randomness.as_source(3))
+    fraction = np.unpackbits(words.view(np.uint8)).mean()
+    assert abs(fraction - probability) < 0.01
+
+def test_biased_run_protocol():
+    """
+    Test that with biased bases only the rare base is compared
+
+    Given bases chosen Z with probability 0.9 by both parties
+    When the protocol runs without Eve
+    Then most bits are shared, and the sample is half of the shared bits
+    of the base X
+    """
+    rng = randomness.as_source(3)
+    result = engine.run_protocol(20000, rng=rng, sender_z_probability=0.9,
+                                 receiver_z_probability=0.9)
+    assert result.sifted_length > 0.8*20000
+    #Same seed, so the same bases of the sender and of the receiver
+    rng = randomness.as_source(3)
+    sender_bases, _ = engine.prepare(20000, rng, 0.9)
+    receiver_bases, _ = engine.measure(sender_bases, sender_bases, rng, 0.9)
+    shared_x = np.count_nonzero((sender_bases == engine.X_BASE)
+                                & (receiver_bases == engine.X_BASE))
+    assert result.sample_size == round(0.5*shared_x)
+    assert not result.interference
+
+def test_biased_run_batch():
+    """
+    Test that the batch of runs refuses probabilities out of (0, 1)
+    """
+    with pytest.raises(ValueError):
+        engine.run_batch(10, 10, sender_z_probability=1.)
+
+@pytest.mark.parametrize("fallback", [(False),(True)])
+def test_popcount(fallback,monkeypatch):
+    """
+    Test that the bits set are counted along the words
+
+    Given random words, with or without np.bitwise_count
+    When the bits set are counted in every row and in all the words
+    Then the counts are the ones of the unpacked bits
+    """
+    if fallback:
+        monkeypatch.delattr(np, "bitwise_count", raising=False)
+    words = randomness.as_source(3).words((5, 7))
+    bits = np.unpackbits(words.view(np.uint8), axis=1)
+    assert np.array_equal(engine.popcount(words, axis=1), bits.sum(axis=1))
+    assert engine.popcount(words) == bits.sum()
@@ -0,0 +1,105 @@
+"""
+Module that contains tests for the entanglement-based protocols.
+"""
+import math
+import numpy as np
+import pytest
+import entanglement
+
+@pytest.mark.parametrize("sender_angle,receiver_angle", [(0.,0.),
+                                                         (0.,math.pi/8),
+                                                         (0.,math.pi/4),
+                                                         (math.pi/8,
+                                                          3*math.pi/8)])
+def test_joint_distribution(sender_angle,receiver_angle):
+    """
+    Test that the outcomes follow the joint distribution of the pairs
+
+    Given a couple of angles of the polarizers
+    When a million pairs are measured
+    Then the outcomes of the sender are uniform, and they are equal to
+    the ones of the receiver with probability cos^2(a - b)
+    """
+    size = 10**6
+    sender_values, receiver_values = entanglement.measure_pairs(
+        np.full(size, sender_angle), np.full(size, receiver_angle), rng=3)
+    assert math.isclose(np.mean(sender_values), 0.5, abs_tol=0.003)
+    assert math.isclose(np.mean(sender_values == receiver_values),
+                        math.cos(sender_angle - receiver_angle)**2,
+                        abs_tol=0.003)
+
+@pytest.mark.parametrize("eavesdropping,chsh,qber,interference",
+                         [(False,2*math.sqrt(2),0.,False),
+                          (True,math.sqrt(2),0.25,True)])
+def test_e91(eavesdropping,chsh,qber,interference):
+    """
+    Test the CHSH value and the key of E91
+
+    Given the angles of E91, with or without Eve
+    When a million pairs are emitted
+    Then the CHSH value is 2*sqrt(2) without Eve and sqrt(2) with her,
+    2/9 of the pairs form the key, and Eve causes a QBER of 25%
+    """
+    result = entanglement.run_entangled(10**6, eavesdropping,
+                                        chunk_size=1 << 18, rng=5)
+    assert math.isclose(result.chsh, chsh, abs_tol=5*result.chsh_error)
+    assert result.chsh_error < 0.01
+    assert math.isclose(result.sifted_length/result.pairs, 2/9,
+                        abs_tol=0.002)
+    assert math.isclose(result.qber, qber, abs_tol=0.005)
+    assert result.interference == interference
+    assert result.counts.sum() == 10**6
+
+def test_visibility():
+    """
+    Test that a noisy source lowers the CHSH value
+
+    Given a source with visibility 0.6
+    When the pairs are measured with the angles of E91
+    Then the CHSH value is 0.6*2*sqrt(2), below the classical bound
+    """
+    result = entanglement.run_entangled(10**6, visibility=0.6, rng=5)
+    assert math.isclose(result.chsh, 0.6*2*math.sqrt(2), abs_tol=0.02)
+    assert result.interference
+
+@pytest.mark.parametrize("eavesdropping,qber", [(False,0.),(True,0.25)])
+def test_bbm92(eavesdropping,qber):
+    """
+    Test BBM92, which checks the error rate of the key
+
+    Given the bases of BB84 for both parties and no CHSH settings
+    When the pairs are emitted with or without Eve
+    Then half of the pairs form the key and Eve is found by the errors
+    """
+    result = entanglement.run_entangled(
+        10**5, eavesdropping, entanglement.BBM92_ANGLES,
+        entanglement.BBM92_ANGLES, chsh_settings=None, rng=5)
+    assert math.isclose(result.sifted_length/result.pairs, 0.5,
+                        abs_tol=0.01)
+    assert math.isclose(result.qber, qber, abs_tol=0.01)
+    assert result.interference == eavesdropping
+    assert math.isnan(result.chsh)
+
+def test_same_seed():
+    """
+    Test that the same seed gives the same run
+
+    Given a seed
+    When two runs are made with it
+    Then the counts of the outcomes are the same
+    """
+    first = entanglement.run_entangled(1000, rng=7)
+    second = entanglement.run_entangled(1000, rng=7)
+    assert np.array_equal(first.counts, second.counts)
+    assert first.errors == second.errors
+
+def test_invalid_pairs():
+    """
+    Test that a number of pairs lower than 1 is refused
+
+    Given 0 pairs
+    When the protocol is run
+    Then a ValueError is raised
+    """
+    with pytest.raises(ValueError):
+        entanglement.run_entangled(0)
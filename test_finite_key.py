@@ -0,0 +1,86 @@
+"""
+Module that contains tests for the finite-key analysis.
+"""
+import math
+import numpy as np
+import pytest
+import engine
+import finite_key
+import postprocessing
+
+@pytest.mark.parametrize("error_rate", [(0.),(0.02),(0.05)])
+def test_key_length_grows_to_asymptotic(error_rate):
+    """
+    Test that the secret key of a longer block is a larger fraction of
+    it, approaching the asymptotic 1 - h(Q) - f*h(Q)
+
+    Given an error rate
+    When the key length is calculated for longer and longer blocks
+    Then the fraction grows and stays below the asymptotic limit
+    """
+    sizes = np.array([10**4, 10**5, 10**6, 10**8])
+    fractions = finite_key.secret_key_length(sizes, 0.1*sizes,
+                                             error_rate)/(0.9*sizes)
+    entropy = float(postprocessing.binary_entropy(error_rate))
+    limit = 1 - entropy - finite_key.EC_EFFICIENCY*entropy
+    assert (np.diff(fractions) > 0).all()
+    assert fractions[-1] < limit
+    assert fractions[-1] > limit - 0.02
+
+@pytest.mark.parametrize("sample_size", [(0),(1000)])
+def test_no_key(sample_size):
+    """
+    Test that no key is extracted without a sample or with too many
+    errors
+
+    Given a block with no sample, or with an error rate above 11%
+    When the key length is calculated
+    Then it's 0
+    """
+    assert finite_key.secret_key_length(10000, sample_size, 0.12) == 0
+
+def test_pass_probability():
+    """
+    Test the probability of passing the test
+
+    Given a sample and an expected error rate
+    When the threshold is the error rate plus or minus 3 deviations
+    Then the probabilities are close to 1 and 0
+    """
+    spread = 3*math.sqrt(0.05*0.95/10000)
+    assert finite_key.pass_probability(10000, 0.05, 0.05 + spread) > 0.99
+    assert finite_key.pass_probability(10000, 0.05, 0.05 - spread) < 0.01
+    assert finite_key.pass_probability(10000, 0., 0.) == 1
+
+def test_optimize():
+    """
+    Test that the optimizer finds the best point of the grid
+
+    Given a grid of block sizes, sample fractions and thresholds
+    When the best expected rate is searched
+    Then it matches the highest rate of the grid, the largest block is
+    the best and the threshold is above the expected error rate
+    """
+    optimum = finite_key.optimize(0.02, [10**4, 10**5, 10**6],
+                                  np.linspace(0.02, 0.5, 25),
+                                  np.linspace(0.02, 0.06, 9))
+    assert optimum.key_rates.shape == (3, 25, 9)
+    assert optimum.key_rate == optimum.key_rates.max()
+    assert optimum.block_size == 10**6
+    assert optimum.threshold > 0.02
+    assert 0 < optimum.key_rate < 0.5
+
+def test_from_result():
+    """
+    Test the key extracted from a run of the engine
+
+    Given runs without and with Eve
+    When the secret key is calculated from their samples
+    Then there is a key only without Eve
+    """
+    length, rate = finite_key.from_result(engine.run_protocol(100000, rng=3),
+                                          100000)
+    assert length > 0
+    assert rate == length/100000
+    assert finite_key.from_result(engine.run_protocol(100000, True, rng=3),
+                                  100000) == (0., 0.)
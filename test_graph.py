@@ -0,0 +1,79 @@
+"""
+Module that contains tests for the functions in graph.
+"""
+import math
+import random
+import numpy as np
+import pytest
+import graph
+
+@pytest.mark.parametrize(
+    "particles,eavesdropping,failure_rate",
+    [(1,True,1.),(2,True,0.8125),(2,False,0.75),(100,False,0.)]
+)
+def test_analytic_failure_rate(particles,eavesdropping,failure_rate):
+    """
+    Test the exact failure rate on cases that can be calculated by hand
+
+    Given a small number of particles
+    When the exact failure rate is calculated
+    Then it matches the one calculated by hand
+    """
+    assert math.isclose(graph.analytic_failure_rate(particles,eavesdropping),
+                        failure_rate, abs_tol=1e-12)
+
+@pytest.mark.parametrize("particles", [(3),(10),(40)])
+def test_analytic_matches_batch(particles):
+    """
+    Test that the simulated failure rate agrees with the exact one
+
+    Given a number of particles
+    When the failure rate is estimated by many simulations
+    Then it's within 5 standard deviations of the exact rate
+    """
+    runs = 20000
+    expected = graph.analytic_failure_rate(particles)
+    estimated = graph.simulate_fixed_batch(runs, particles, rng=3)
+    tolerance = 5*math.sqrt(expected*(1 - expected)/runs) + 1e-9
+    assert abs(estimated - expected) <= tolerance
+
+@pytest.mark.parametrize("method", [("wilson"),("clopper-pearson")])
+def test_simulate_adaptive(method):
+    """
+    Test that the adaptive runs reach the width asked, spending more
+    runs where the failure rate is uncertain
+
+    Given numbers of particles with a rate of 1, uncertain and close to 0
+    When the failure rates are estimated adaptively
+    Then every interval is narrow enough and contains the exact rate
+    """
+    particles = [1, 12, 60]
+    rates, intervals, runs = graph.simulate_adaptive(particles, width=0.05,
+                                                     method=method, rng=3)
+    for number, (lower, upper) in zip(particles, intervals):
+        assert upper - lower <= 0.05
+        assert lower <= graph.analytic_failure_rate(number) <= upper
+    assert rates[0] == 1.
+    assert runs[1] > 5*runs[0]
+    assert runs[1] > 5*runs[2]
+
+@pytest.mark.parametrize("particles", [(10),(60)])
+def test_biased_analytic_matches_simulation(particles):
+    """
+    Test the exact failure rate with biased bases
+
+    Given a number of particles and bases chosen Z with probability 0.8
+    When the failure rate is estimated by the simulation
+    Then it's within 5 standard deviations of the exact rate
+    """
+    runs = 400
+    random.seed(3)
+    np.random.seed(3)
+    expected = graph.analytic_failure_rate(particles,
+                                           sender_z_probability=0.8,
+                                           receiver_z_probability=0.8)
+    estimated = graph.simulate_fixed(runs, particles,
+                                     sender_z_probability=0.8,
+                                     receiver_z_probability=0.8)
+    tolerance = 5*math.sqrt(expected*(1 - expected)/runs)
+    assert abs(estimated - expected) <= tolerance
@@ -0,0 +1,110 @@
+"""
+Module that contains tests for the packed version of the engine.
+"""
+import numpy as np
+import pytest
+import packed
+import randomness
+
+@pytest.mark.parametrize("length", [(1),(8),(63),(64),(1000)])
+def test_pack_unpack(length):
+    """
+    Test that packing and unpacking gives back the same bits
+
+    Given a random sequence of bits
+    When it's packed and unpacked
+    Then the bits are the same and the buffer is padded to words
+    """
+    bits = np.random.default_rng(3).integers(0, 2, length, dtype=np.uint8)
+    packed_bits = packed.pack(bits)
+    assert len(packed_bits) % 8 == 0
+    assert np.array_equal(packed.unpack(packed_bits, length), bits)
+    assert packed.popcount(packed_bits) == bits.sum()
+    indexes = np.arange(length)
+    assert np.array_equal(packed.get_bits(packed_bits, indexes), bits)
+
+def test_count_errors():
+    """
+    Test that the errors counted on packed words match the unpacked ones
+
+    Given two random sequences of bits and a mask
+    When the differences are counted on the packed buffers
+    Then they are the same as the differences of the unpacked bits
+    """
+    bits_1, bits_2, mask = randomness.as_source(3).bits((3, 777))
+    errors = packed.count_errors(packed.pack(bits_1), packed.pack(bits_2),
+                                 packed.pack(mask))
+    assert errors == np.count_nonzero((bits_1 != bits_2) & (mask == 1))
+
+def test_qber():
+    """
+    Test that the error rate counts only the bits of the key
+
+    Given two keys of 10 bits with 5 differences
+    When the error rate is calculated, with the length or with a mask
+    Then it's 0.5, and without both a ValueError is raised
+    """
+    bits_1 = np.array([0, 1, 0, 1, 0, 1, 0, 1, 0, 1], dtype=np.uint8)
+    bits_2 = bits_1 ^ np.array([1, 1, 1, 1, 1, 0, 0, 0, 0, 0],
+                               dtype=np.uint8)
+    key_1, key_2 = packed.pack(bits_1), packed.pack(bits_2)
+    assert packed.qber(key_1, key_2, length=10) == 0.5
+    mask = packed.pack(np.array([1]*4 + [0]*6, dtype=np.uint8))
+    assert packed.qber(key_1, key_2, mask) == 1.
+    assert np.isnan(packed.qber(key_1, key_2, length=0))
+    with pytest.raises(ValueError):
+        packed.qber(key_1, key_2)
+
+def test_shared_key():
+    """
+    Test that the key keeps only the values on the shared bases
+
+    Given a state and a measurement of it
+    When the key is extracted from the shared bases
+    Then it's made of the values where the bases match
+    """
+    rng = randomness.as_source(3)
+    sender = packed.prepare(1001, rng)
+    receiver = packed.measure(sender, rng)
+    shared = packed.sift(sender, receiver)
+    key, key_length = packed.shared_key(sender.values, shared)
+    mask = packed.unpack(shared, 1001).astype(bool)
+    expected = packed.unpack(sender.values, 1001)[mask]
+    assert key_length == len(expected)
+    assert np.array_equal(packed.unpack(key, key_length), expected)
+
+@pytest.mark.parametrize(
+    "n_particles,eavesdropping,detection",
+    [(1,False,True),(100,False,False),(100,True,True)]
+)
+def test_run(n_particles,eavesdropping,detection):
+    """
+    Test that the packed engine gives the expected verdicts
+    """
+    result = packed.run(n_particles, eavesdropping=eavesdropping, rng=3)
+    assert result.interference == detection
+    assert (result.errors == 0) != eavesdropping
+
+@pytest.mark.parametrize("key_length,samples_number,mismatches",
+                         [(10,0,0),(10,10,5),(200000,200000,100000),
+                          (200000,1,None)])
+def test_sample_mismatches(key_length,samples_number,mismatches):
+    """
+    Test the sample compared a chunk at a time
+
+    Given two keys that differ in their first half, longer than a chunk
+    or not
+    When a sample of them is compared
+    Then the whole key gives the mismatches of the first half, and a
+    single bit is a mismatch or not
+    """
+    bits = np.zeros(key_length, dtype=np.uint8)
+    errors = bits.copy()
+    errors[:key_length//2] = 1
+    rng = randomness.as_source(3)
+    found = packed.sample_mismatches(packed.pack(bits), packed.pack(errors),
+                                     key_length, samples_number, rng)
+    if mismatches is None:
+        assert found in (0, 1)
+    else:
+        assert found == mismatches
@@ -0,0 +1,80 @@
+"""
+Module that contains tests for the error correction and the privacy
+amplification.
+"""
+import numpy as np
+import pytest
+import postprocessing
+
+@pytest.mark.parametrize("length,error_rate", [(1,0.5),(130,0.1),(1000,0.02),
+                                               (100000,0.05)])
+def test_cascade(length,error_rate):
+    """
+    Test that Cascade corrects all the errors
+
+    Given two keys that differ in a fraction of their bits
+    When the errors are corrected with Cascade
+    Then the keys are equal, disclosing more than the minimum possible
+    """
+    rng = np.random.default_rng(3)
+    sender_key = rng.integers(0, 2, length, dtype=np.uint8)
+    errors = (rng.random(length) < error_rate).astype(np.uint8)
+    corrected, leaked = postprocessing.cascade(sender_key, sender_key ^ errors,
+                                               error_rate, rng=3)
+    assert np.array_equal(corrected, sender_key)
+    assert leaked > length*postprocessing.binary_entropy(error_rate)
+
+@pytest.mark.parametrize("length,output_length", [(1,1),(50,20),(300,299),
+                                                  (500,7),(7,500),(64,65),
+                                                  (2000,1100),(30,1500)])
+def test_toeplitz_hash(length,output_length):
+    """
+    Test that the words and the FFT give the same product of the
+    Toeplitz matrix
+
+    Given a key and the bits defining a Toeplitz matrix
+    When the key is hashed
+    Then the result is the product modulo 2 of the full matrix
+    """
+    rng = np.random.default_rng(3)
+    key = rng.integers(0, 2, length, dtype=np.uint8)
+    seed_bits = rng.integers(0, 2, length + output_length - 1, dtype=np.uint8)
+    rows = np.arange(output_length)[:, None]
+    columns = np.arange(length)[None, :]
+    matrix = seed_bits[rows - columns + length - 1].astype(np.int64)
+    expected = (matrix @ key) % 2
+    hashed = postprocessing.toeplitz_hash(key, output_length, seed_bits)
+    assert np.array_equal(hashed, expected)
+
+@pytest.mark.parametrize("passes", [(0),(4)])
+def test_verification(passes):
+    """
+    Test that a key not corrected is discarded
+
+    Given two keys that differ in a fraction of their bits
+    When they are distilled without or with the passes of Cascade
+    Then the key is discarded only if the errors are not corrected
+    """
+    rng = np.random.default_rng(3)
+    sender_key = rng.integers(0, 2, 10000, dtype=np.uint8)
+    errors = (rng.random(10000) < 0.02).astype(np.uint8)
+    result = postprocessing.distill(sender_key, sender_key ^ errors, 0.02,
+                                    passes=passes, rng=3)
+    assert result.verified == (result.residual_errors == 0)
+    assert result.verified == (passes > 0)
+    assert (result.final_length > 0) == result.verified
+    assert result.leaked_bits >= postprocessing.VERIFICATION_BITS
+
+@pytest.mark.parametrize("eavesdropping", [(False),(True)])
+def test_run(eavesdropping):
+    """
+    Test the whole post-processing of a simulated key
+
+    Given a simulation with or without Eve
+    When the shared key is corrected and amplified
+    Then without Eve there is a secret key, with Eve there is none
+    """
+    result = postprocessing.run(20000, eavesdropping=eavesdropping, rng=3)
+    assert result.residual_errors == 0
+    assert (result.final_length > 0) != eavesdropping
+    assert len(result.key)*8 >= result.final_length
@@ -0,0 +1,84 @@
+"""
+Module that contains tests for the instrumentation of the stages.
+"""
+import io
+import time
+import pytest
+import graph
+import profiling
+import simulation
+
+STAGES = [profiling.PREPARATION, profiling.EAVESDROPPER, profiling.RECEIVER,
+          profiling.SIFTING, profiling.SAMPLING]
+
+@pytest.mark.parametrize("runs,particles", [(1,10),(20,100)])
+def test_simulate_fixed_profile(runs,particles):
+    """
+    Test that the profile of many runs counts every stage once per run.
+
+    Given a number of runs and of particles
+    When the runs are done with a profiler
+    Then every stage was called once per run, for all the particles
+    """
+    profiler = profiling.Profiler()
+    graph.simulate_fixed(runs, particles, profiler)
+    assert list(profiler.stages) == STAGES
+    for name in STAGES[:-1]:
+        assert profiler.stages[name].calls == runs
+        assert profiler.stages[name].elements == runs*particles
+        assert profiler.stages[name].seconds > 0
+
+def test_hooks_and_memory():
+    """
+    Test that the hooks receive every measure and that the printing and
+    the memory are measured when asked.
+
+    Given a profiler that traces the memory, with a hook
+    When a run prints its steps
+    Then the hook is called for every stage and the printing is recorded
+    """
+    profiler = profiling.Profiler(trace_memory=True)
+    measures = []
+    profiler.add_hook(lambda name, *numbers: measures.append(name))
+    simulation.run(100, reporter=simulation.TERMINAL, rng=3,
+                   profiler=profiler)
+    assert set(STAGES) <= set(measures)
+    assert profiler.stages[profiling.PRINTING].calls > 0
+    assert profiler.stages[profiling.PREPARATION].allocated > 0
+    output = io.StringIO()
+    profiler.report(output)
+    assert profiling.SIFTING in output.getvalue()
+
+def test_disabled_stage():
+    """
+    Test that without a profiler the stage is a context that does nothing.
+
+    Given no profiler
+    When a stage is entered
+    Then the code runs and nothing is recorded
+    """
+    with profiling.stage(None, profiling.PREPARATION, 10) as context:
+        assert context is None
+
+def test_nested_stages():
+    """
+    Test that a nested stage is not counted twice and doesn't reset the
+    peak of the outer one.
+
+    Given a stage that allocates and frees a large array, and then runs
+    a nested stage
+    When the stages are measured
+    Then the time of the nested stage is not in the outer one, and the
+    peak of the outer stage includes the array
+    """
+    profiler = profiling.Profiler(trace_memory=True)
+    with profiler.stage(profiling.PREPARATION):
+        array = bytearray(10**7)
+        del array
+        with profiler.stage(profiling.PRINTING):
+            time.sleep(0.05)
+    outer = profiler.stages[profiling.PREPARATION]
+    inner = profiler.stages[profiling.PRINTING]
+    assert inner.seconds >= 0.05
+    assert outer.seconds < 0.05
+    assert outer.allocated >= 10**7
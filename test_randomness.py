@@ -0,0 +1,73 @@
+"""
+Module that contains tests for the sources of randomness.
+"""
+import numpy as np
+import pytest
+import randomness
+import simulation
+
+def test_bits():
+    """
+    Test that the bits drawn in bulk are valid
+
+    Given a source seeded with a NumPy generator
+    When bits are drawn in bulk
+    Then they have the requested shape and are only 0s and 1s
+    """
+    bits = randomness.as_source(3).bits((10, 7))
+    assert bits.shape == (10, 7)
+    assert set(np.unique(bits)) <= {0, 1}
+
+@pytest.mark.parametrize(
+    "population_size,samples_number", [(10,0),(10,4),(10,10)]
+)
+def test_choice_buffer(tmp_path,population_size,samples_number):
+    """
+    Test that the sample of a buffer source is without replacement
+
+    Given a file of random bytes
+    When a sample is drawn from the bytes of the file
+    Then it contains distinct integers in the population
+    """
+    path = tmp_path/"random.bin"
+    path.write_bytes(np.random.default_rng(3).bytes(1000))
+    indexes = randomness.BufferSource(path).choice(population_size,
+                                                   samples_number)
+    assert len(set(indexes.tolist())) == samples_number
+    assert all(0 <= i < population_size for i in indexes)
+
+def test_buffer_replay(tmp_path):
+    """
+    Test that a buffer of random bytes replays the same simulation
+
+    Given a file of random bytes
+    When the simulation runs twice reading the file from the start
+    Then the results are the same, and an exhausted file raises an error
+    """
+    path = tmp_path/"random.bin"
+    path.write_bytes(np.random.default_rng(3).bytes(1 << 16))
+    results = [simulation.run_protocol(200, eavesdropping=True, reporter=None,
+                                       rng=randomness.BufferSource(path))
+               for _ in range(2)]
+    assert results[0] == results[1]
+    with pytest.raises(ValueError):
+        randomness.BufferSource(path).bytes(1 << 17)
+
+def test_same_seed():
+    """
+    Test that a seed controls the whole simulation
+    """
+    first = simulation.run_protocol(100, eavesdropping=True, reporter=None,
+                                    rng=7)
+    second = simulation.run_protocol(100, eavesdropping=True, reporter=None,
+                                     rng=7)
+    assert first == second
+
+def test_incomplete_source():
+    """
+    Test that a source without 'bytes' can't be created
+    """
+    class Incomplete(randomness.RandomSource):
+        pass
+    with pytest.raises(TypeError):
+        Incomplete()
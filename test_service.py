@@ -0,0 +1,138 @@
+"""
+Module that contains tests for the asynchronous service of links.
+"""
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import service
+
+async def _simulate_links(stage_workers, executor):
+    """Simulate four links at once, two of them with Eve"""
+    async with service.LinkService(chunk_size=1024, queue_size=2,
+                                   stage_workers=stage_workers,
+                                   executor=executor) as links:
+        results = await asyncio.gather(*[
+            links.simulate(f"link{i}", 10000, eavesdropping=i >= 2, seed=i)
+            for i in range(4)])
+        return results, links.metrics()
+
+@pytest.mark.parametrize("stage_workers", [(1),(3)])
+def test_links_concurrently(stage_workers):
+    """
+    Test that concurrent links give the same results whatever the order
+    of their chunks, and that their metrics are recorded
+
+    Given four links simulated at once, two with Eve
+    When the pipeline has one or more workers for each stage
+    Then the results are the ones of a serial pipeline and Eve is found
+    """
+    with ThreadPoolExecutor(2) as executor:
+        results, metrics = asyncio.run(_simulate_links(stage_workers,
+                                                       executor))
+        serial, _ = asyncio.run(_simulate_links(1, executor))
+    assert results == serial
+    assert [result.interference for result in results] == [False, False,
+                                                           True, True]
+    assert sorted(metrics) == ["link0", "link1", "link2", "link3"]
+    for link in metrics.values():
+        assert link["particles"] == 10000
+        assert link["throughput"] > 0
+
+def test_busy_time():
+    """
+    Test that simulations at the same time are counted once in the busy
+    time, but all in the latency
+
+    Given simulations of a link from 0 to 3 and from 1 to 4 seconds, and
+    then from 10 to 12
+    When they are recorded in the metrics
+    Then the link was busy for 6 seconds, with a total latency of 8
+    """
+    metrics = service.LinkMetrics()
+    metrics.begin(0.)
+    metrics.begin(1.)
+    metrics.end(3.)
+    assert metrics.busy_seconds == 3.
+    metrics.end(4.)
+    metrics.begin(10.)
+    metrics.end(12.)
+    assert metrics.busy_seconds == 6.
+    assert metrics.active == 0
+
+async def _same_link(executor):
+    """Simulate three runs of the same link at once"""
+    async with service.LinkService(chunk_size=1024,
+                                   executor=executor) as links:
+        await asyncio.gather(*[links.simulate("link", 10000, seed=i)
+                               for i in range(3)])
+        return links.metrics()["link"]
+
+def test_same_link_throughput():
+    """
+    Test that runs of the same link at once are not counted twice
+
+    Given three runs of a link simulated at once
+    When the metrics are read
+    Then the busy time is shorter than the sum of the latencies
+    """
+    with ThreadPoolExecutor(2) as executor:
+        metrics = asyncio.run(_same_link(executor))
+    assert metrics["requests"] == 3
+    assert 0 < metrics["busy_seconds"] < metrics["total_latency"]
+    assert metrics["throughput"] == 30000/metrics["busy_seconds"]
+
+async def _request(port, request):
+    """Send an HTTP request and return the status and the JSON answer"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(request)
+    await writer.drain()
+    answer = await reader.read()
+    writer.close()
+    head, _, body = answer.partition(b"\r\n\r\n")
+    return head.split()[1].decode(), json.loads(body)
+
+async def _serve(executor):
+    """Ask a simulation and the metrics over HTTP"""
+    async with service.LinkService(executor=executor) as links:
+        server = await links.serve(port=0)
+        port = server.sockets[0].getsockname()[1]
+        body = json.dumps({"n_particles": 1000, "seed": 1}).encode()
+        simulated = await _request(port, b"POST /links/a HTTP/1.1\r\n"
+                                   b"Content-Length: %d\r\n\r\n%s"
+                                   % (len(body), body))
+        metrics = await _request(port, b"GET /metrics HTTP/1.1\r\n\r\n")
+        missing = await _request(port, b"GET /keys HTTP/1.1\r\n\r\n")
+        invalid = []
+        for request in (b"\r\n\r\n", b"GET\r\n\r\n",
+                        b"POST /links/a HTTP/1.1\r\nContent-Length: 24"
+                        b"\r\n\r\n{\"channel\": {\"loss\": 1}}",
+                        b"POST /links/a HTTP/1.1\r\nContent-Length: 23"
+                        b"\r\n\r\n{\"n_particles\": \"many\"}",
+                        b"POST /links/a HTTP/1.1\r\nContent-Length: 2"
+                        b"\r\n\r\n[]"):
+            invalid.append(await asyncio.wait_for(_request(port, request),
+                                                  timeout=5))
+        server.close()
+        await server.wait_closed()
+    return simulated, metrics, missing, invalid
+
+def test_http():
+    """
+    Test the HTTP endpoint
+
+    Given a service listening on a local port
+    When a simulation, the metrics and a missing resource are asked
+    Then the answers have the right status and content, and malformed
+    requests or parameters get an error without hanging
+    """
+    with ThreadPoolExecutor(1) as executor:
+        simulated, metrics, missing, invalid = asyncio.run(_serve(executor))
+    assert simulated[0] == "200"
+    assert simulated[1]["interference"] is False
+    assert metrics[0] == "200"
+    assert metrics[1]["a"]["requests"] == 1
+    assert missing[0] == "404"
+    for status, answer in invalid:
+        assert status == "400"
+        assert "error" in answer
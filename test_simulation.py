@@ -1,6 +1,7 @@
 """
 Module that contains tests for the functions in the simulation.
 """
+import math
 from numpy.random import seed
 import pytest
 import simulation
@@ -141,4 +142,87 @@ def test_compare_keys_eve(n_particles,detection):
     seed(3)
     #Test with eavesdropping that the simulation detects it
     interference = simulation.run(n_particles,eavesdropping=True)
-    assert interference == detection
\ No newline at end of file
+    assert interference == detection
+
+@pytest.mark.parametrize("n_particles,eavesdropping", [(100,False),(100,True)])
+def test_run_protocol_quiet(n_particles,eavesdropping,capsys):
+    """
+    Test that without a reporter the simulation prints nothing and
+    returns all the numbers of the comparison of the keys.
+
+    Given a number of particles, with or without Eve
+    When the simulation runs without a reporter
+    Then nothing is printed and the result is consistent
+    """
+    seed(3)
+    result = simulation.run_protocol(n_particles, eavesdropping=eavesdropping,
+                                     reporter=None)
+    assert capsys.readouterr().out == ""
+    assert result.sample_size == round(0.5*result.sifted_length)
+    assert result.mismatches <= result.errors
+    assert result.interference == eavesdropping
+    assert result.qber == result.mismatches/result.sample_size
+
+@pytest.mark.parametrize("n_particles,eavesdropping",
+                         [(100,False),(1000,True)])
+def test_check_keys_indexed(n_particles,eavesdropping):
+    """
+    Test that the comparison reading only the sampled bits gives the
+    same numbers as the scan of all the values, and that the key is made
+    of the shared bits that were not compared.
+
+    Given the results of the sender and of the receiver
+    When the keys are compared with and without the indexed mode
+    Then the sizes and the errors match and the key is the remainder
+    """
+    seed(3)
+    result = simulation.run_protocol(n_particles, eavesdropping=eavesdropping,
+                                     reporter=None, rng=5, indexed=True)
+    seed(3)
+    scanned = simulation.run_protocol(n_particles,
+                                      eavesdropping=eavesdropping,
+                                      reporter=None, rng=5)
+    assert result.sifted_length == scanned.sifted_length
+    assert result.sample_size == scanned.sample_size
+    assert result.errors == scanned.errors
+    assert result.interference == eavesdropping
+    #The key is what is left of the shared bits after the sample
+    assert len(result.key_indexes) == (result.sifted_length
+                                       - result.sample_size)
+    assert len(set(result.key_indexes)) == len(result.key_indexes)
+
+@pytest.mark.parametrize("sender_z,receiver_z,base", [(0.5,0.5,None),
+                                                      (0.9,0.8,"X"),
+                                                      (0.2,0.1,"Z"),
+                                                      (0.5,0.9,"X")])
+def test_rare_base(sender_z,receiver_z,base):
+    """
+    Test the base used to check the key
+
+    Given the probabilities of the base Z of the sender and receiver
+    When the rare base is found
+    Then it's the one in which they agree less often, None if unbiased
+    """
+    assert simulation.rare_base(sender_z, receiver_z) == base
+
+@pytest.mark.parametrize("indexed", [(False),(True)])
+@pytest.mark.parametrize("eavesdropping", [(False),(True)])
+def test_biased_bases(indexed,eavesdropping):
+    """
+    Test the protocol with biased bases
+
+    Given a sender and a receiver who choose Z with probability 0.9
+    When the protocol runs
+    Then 82% of the bits are shared, only the ones of the rare base X
+    are compared, and Eve is detected
+    """
+    result = simulation.run_protocol(20000, eavesdropping=eavesdropping,
+                                     reporter=None, rng=5, indexed=indexed,
+                                     sender_z_probability=0.9,
+                                     receiver_z_probability=0.9)
+    assert math.isclose(result.sifted_length/20000, 0.82, abs_tol=0.02)
+    #Half of the 1% of the particles shared in the base X
+    assert math.isclose(result.sample_size/20000, 0.005, abs_tol=0.002)
+    assert len(result.key_indexes) == (result.sifted_length
+                                       - result.sample_size)
+    assert result.interference == eavesdropping
@@ -0,0 +1,178 @@
+"""
+Module that contains the statistical tests of the simulation. The fast
+paths run a million particles, and their sifted fraction and error rates
+must fall in binomial confidence intervals around the theoretical values
+that are so narrow that a bug in the physics can't hide in them, while
+the seeds are fixed so that the tests never fail by chance. The
+DataFrame version is slower, so it is compared with the engine in
+distribution over many small runs.
+"""
+import math
+import numpy as np
+import pytest
+import confidence
+import engine
+import graph
+import packed
+import simulation
+
+#Confidence of the intervals, so that a correct simulation falls out of
+#them once in a million tests
+CONFIDENCE = 1 - 1e-6
+
+#Critical value of the two-sample Kolmogorov-Smirnov test at level 0.001
+KS_CRITICAL = 1.95
+
+LARGE = 10**6
+
+#Particles of every chunk of the stream, which rounds the sample of
+#every chunk on its own
+STREAM_CHUNK = 1 << 18
+ROUNDING = 0.5*-(-LARGE//STREAM_CHUNK)
+
+#The fast paths, with the same arguments
+FAST_PATHS = {
+    "engine": lambda n, eavesdropping, seed: engine.run_protocol(
+        n, eavesdropping, rng=seed),
+    "packed": lambda n, eavesdropping, seed: packed.run(
+        n, eavesdropping, rng=seed),
+    "stream": lambda n, eavesdropping, seed: engine.run_stream(
+        n, eavesdropping, chunk_size=STREAM_CHUNK, rng=seed),
+}
+
+def _contains(successes, trials, rate):
+    """True if the interval of successes/trials contains the rate"""
+    lower, upper = confidence.wilson_interval(successes, trials, CONFIDENCE)
+    return lower <= rate <= upper
+
+def _ks_distance(first, second):
+    """Largest distance between the empirical distributions of samples"""
+    values = np.union1d(first, second)
+    first_cdf = np.searchsorted(np.sort(first), values, side="right")
+    second_cdf = np.searchsorted(np.sort(second), values, side="right")
+    return np.max(np.abs(first_cdf/len(first) - second_cdf/len(second)))
+
+@pytest.mark.parametrize("path", list(FAST_PATHS))
+@pytest.mark.parametrize("seed", [(1),(2)])
+def test_no_eve(path,seed):
+    """
+    Test the sifted fraction and the error rate without Eve
+
+    Given a million particles and a fast path
+    When the protocol runs without eavesdropping
+    Then half of the particles are shared and there are no errors at all
+    """
+    result = FAST_PATHS[path](LARGE, False, seed)
+    assert _contains(result.sifted_length, LARGE, 0.5)
+    assert result.errors == result.mismatches == 0
+    assert not result.interference
+
+@pytest.mark.parametrize("path", list(FAST_PATHS))
+@pytest.mark.parametrize("seed", [(1),(2)])
+def test_intercept_resend(path,seed):
+    """
+    Test the sifted fraction and the error rate with Eve
+
+    Given a million particles and a fast path
+    When Eve measures and resends every particle
+    Then half of the particles are shared and a quarter of them are
+    wrong, in the whole key and in the compared sample
+    """
+    result = FAST_PATHS[path](LARGE, True, seed)
+    assert _contains(result.sifted_length, LARGE, 0.5)
+    assert _contains(result.errors, result.sifted_length, 0.25)
+    assert _contains(result.mismatches, result.sample_size, 0.25)
+    assert abs(result.sample_size - 0.5*result.sifted_length) <= ROUNDING
+    assert result.interference
+
+@pytest.mark.parametrize("particles", [(4),(16)])
+def test_batch_failure_rate(particles):
+    """
+    Test that the runs in batch detect Eve as often as the theory says
+
+    Given a small number of particles
+    When 10^5 runs are simulated in batch
+    Then the detection rate is in the interval around the exact one
+    """
+    runs = 10**5
+    detections = int(np.count_nonzero(engine.run_batch(particles, runs,
+                                                       rng=4)))
+    assert _contains(detections, runs, graph.analytic_failure_rate(particles))
+
+@pytest.mark.parametrize("particles", [(4),(16)])
+def test_biased_batch_failure_rate(particles):
+    """
+    Test that the biased runs in batch detect Eve as the theory says
+
+    Given a small number of particles and bases chosen Z with
+    probability 0.8 by both parties
+    When 10^5 runs are simulated in batch
+    Then the detection rate is in the interval around the exact one
+    """
+    runs = 10**5
+    biases = {"sender_z_probability": 0.8, "receiver_z_probability": 0.8}
+    detections = int(np.count_nonzero(engine.run_batch(particles, runs,
+                                                       rng=4, **biases)))
+    assert _contains(detections, runs,
+                     graph.analytic_failure_rate(particles, **biases))
+
+def test_biased_engine():
+    """
+    Test the sifted fraction and the sample of the biased engine
+
+    Given a million particles and bases chosen Z with probability 0.8
+    When Eve measures and resends every particle
+    Then 0.8^2 + 0.2^2 of the particles are shared, and a quarter of the
+    compared bits are wrong
+    """
+    result = engine.run_protocol(LARGE, True, rng=5, sender_z_probability=0.8,
+                                 receiver_z_probability=0.8)
+    assert _contains(result.sifted_length, LARGE, 0.68)
+    assert _contains(result.sample_size, LARGE, 0.5*0.04)
+    assert _contains(result.mismatches, result.sample_size, 0.25)
+
+@pytest.mark.parametrize("seed", [(0),(1),(2),(3)])
+@pytest.mark.parametrize("eavesdropping", [(False),(True)])
+def test_consistent_counters(seed,eavesdropping):
+    """
+    Test properties that every run must have, for many seeds
+
+    Given a seed and a few numbers of particles, with or without Eve
+    When the fast paths run
+    Then the counters of every run are consistent
+    """
+    for n_particles in (1, 63, 64, 65, 1000):
+        for run in FAST_PATHS.values():
+            result = run(n_particles, eavesdropping, seed)
+            assert 0 <= result.sifted_length <= n_particles
+            assert result.sample_size == round(0.5*result.sifted_length)
+            assert result.mismatches <= min(result.errors,
+                                            result.sample_size)
+            assert eavesdropping or result.errors == 0
+
+def test_dataframe_and_engine_distribution():
+    """
+    Test that the DataFrame version and the engine agree in distribution
+
+    Given many runs of a few particles with Eve
+    When they are simulated by 'simulation.py' and by the engine
+    Then the distributions of the shared bits and of the mismatches pass
+    the Kolmogorov-Smirnov test, and both detection rates are in the
+    interval around the exact one
+    """
+    runs, particles = 400, 16
+    rng = np.random.default_rng(6)
+    dataframe = [simulation.run_protocol(particles, eavesdropping=True,
+                                         reporter=None, rng=rng)
+                 for _ in range(runs)]
+    arrays = [engine.run_protocol(particles, True, rng=rng)
+              for _ in range(runs)]
+    critical = KS_CRITICAL*math.sqrt(2/runs)
+    for field in ("sifted_length", "mismatches"):
+        assert _ks_distance([getattr(result, field) for result in dataframe],
+                            [getattr(result, field) for result in arrays]
+                            ) < critical
+    expected = graph.analytic_failure_rate(particles)
+    for results in (dataframe, arrays):
+        detections = sum(result.interference for result in results)
+        assert _contains(detections, runs, expected)
@@ -0,0 +1,69 @@
+"""
+Module that contains tests for the parallel sweep of simulations.
+"""
+import numpy as np
+import cache
+import sweep
+
+def test_same_seed_any_workers():
+    """
+    Test that the results depend only on the seed
+
+    Given a master seed
+    When the same sweep is run with one or more processes
+    Then the number of detections is identical
+    """
+    particles = [1, 5, 20]
+    runs = 2*sweep.BLOCK_RUNS + 10
+    serial = sweep.count_detections(runs, particles, seed=3, workers=1)
+    parallel = sweep.count_detections(runs, particles, seed=3, workers=2)
+    assert np.array_equal(serial, parallel)
+    assert serial[0] == runs
+
+def test_different_seeds():
+    """
+    Test that different seeds give different streams of runs
+
+    Given two different master seeds
+    When the same sweep is run
+    Then the number of detections is different
+    """
+    first = sweep.count_detections(1000, [10], seed=1, workers=1)
+    second = sweep.count_detections(1000, [10], seed=2, workers=1)
+    assert not np.array_equal(first, second)
+
+def test_biased_cache(tmp_path):
+    """
+    Test that biased and unbiased runs are different points of the cache
+
+    Given a cache filled by an unbiased sweep
+    When the same sweep is run with biased bases
+    Then its detections are simulated with the biased bases, and don't
+    come from the cache
+    """
+    biases = {"sender_z_probability": 0.9, "receiver_z_probability": 0.9}
+    with cache.ResultCache(tmp_path/"cache.sqlite") as results:
+        unbiased = sweep.count_detections(1000, [4], seed=1, workers=1,
+                                          cache=results)
+        biased = sweep.count_detections(1000, [4], seed=1, workers=1,
+                                        cache=results, **biases)
+    assert np.array_equal(biased, sweep.count_detections(
+        1000, [4], seed=1, workers=1, **biases))
+    assert not np.array_equal(biased, unbiased)
+
+def test_first_runs():
+    """
+    Test that the first runs of a block don't depend on the runs done
+
+    Given a master seed
+    When fewer runs than a block, and the runs of a block and more, are
+    simulated
+    Then the outcomes of the first runs are the same
+    """
+    few = sweep._simulate_block((20, 0, 0, 10, True, 0.5, 3, (0.5, 0.5)))
+    more = sweep._simulate_block((20, 0, 0, sweep.BLOCK_RUNS, True, 0.5, 3,
+                                  (0.5, 0.5)))
+    later = sweep._simulate_block((20, 0, 5, 100, True, 0.5, 3, (0.5, 0.5)))
+    assert len(few) == 10 and len(later) == 95
+    assert np.array_equal(few, more[:10])
+    assert np.array_equal(later, more[5:100])
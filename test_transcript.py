@@ -0,0 +1,111 @@
+"""
+Module that contains tests for the binary transcripts of the protocol.
+"""
+import numpy as np
+import pytest
+import transcript
+
+@pytest.mark.parametrize("n_particles,chunk", [(1,64),(1001,128),(5000,1024)])
+def test_record_columns(n_particles,chunk,tmp_path):
+    """
+    Test that the saved columns are consistent with each other
+
+    Given a number of particles and a size of the chunks
+    When a run without Eve is recorded
+    Then the shared positions are where the bases match, the sample is
+    among them and there are no errors
+    """
+    saved = transcript.record(tmp_path/"run.bb84", n_particles, seed=3,
+                              chunk_particles=chunk)
+    sifted = saved.bits("sifted")
+    assert np.array_equal(sifted, saved.bits("sender_bases")
+                          == saved.bits("receiver_bases"))
+    assert not (saved.bits("sample") & ~sifted.astype(bool)).any()
+    assert saved.sift() == 0
+    result = saved.score()
+    assert result.sample_size == round(0.5*result.sifted_length)
+    assert result.errors == 0
+
+def test_same_seed(tmp_path):
+    """
+    Test that the parameters in the header give the same transcript
+
+    Given a seed
+    When the same run is recorded twice with the same chunks, and once
+    with chunks of a different size
+    Then the same header gives the same results, and the different
+    chunks are saved in the header
+    """
+    first = transcript.record(tmp_path/"first.bb84", 3000, True, seed=5,
+                              chunk_particles=3008)
+    second = transcript.record(tmp_path/"second.bb84", 3000, True, seed=5,
+                               chunk_particles=3008)
+    other = transcript.record(tmp_path/"other.bb84", 3000, True, seed=5,
+                              chunk_particles=1024)
+    assert first.header == {**second.header,
+                            "columns": first.header["columns"]}
+    assert first.score() == second.score()
+    assert other.header["chunk_particles"] == 1024
+    assert first.header == {**other.header,
+                            "columns": first.header["columns"],
+                            "chunk_particles": 3008}
+
+@pytest.mark.parametrize("percentage", [(0.1),(0.5),(1.)])
+def test_rescore(percentage,tmp_path):
+    """
+    Test that a new sample of a recorded run with Eve has the right size
+    and an error rate close to 25%
+
+    Given a run with Eve saved in small chunks
+    When it's sampled again with another percentage
+    Then the size of the sample and the error rate are right
+    """
+    saved = transcript.record(tmp_path/"eve.bb84", 100000, True, seed=4,
+                              chunk_particles=4096)
+    result = saved.rescore(percentage, rng=1, chunk_particles=4096)
+    assert result.sample_size == round(percentage*result.sifted_length)
+    assert abs(result.qber - 0.25) < 0.02
+    assert result.interference
+    assert result.mismatches <= result.errors
+
+def test_not_a_transcript(tmp_path):
+    """
+    Test that a file that is not a transcript is refused
+
+    Given a file with other content
+    When it's opened as a transcript
+    Then a ValueError is raised
+    """
+    path = tmp_path/"other.bin"
+    path.write_bytes(b"0"*100)
+    with pytest.raises(ValueError):
+        transcript.Transcript(path)
+
+@pytest.mark.parametrize("chunk", [(0),(100)])
+def test_invalid_chunks(chunk,tmp_path):
+    """
+    Test that chunks that are not a multiple of 64 particles are refused
+
+    Given a number of particles per chunk that is not a multiple of 64
+    When a transcript is recorded with it
+    Then a ValueError is raised before the file is created
+    """
+    path = tmp_path/"bad.bb84"
+    with pytest.raises(ValueError):
+        transcript.record(path, 1000, chunk_particles=chunk)
+    assert not path.exists()
+
+def test_count(tmp_path):
+    """
+    Test the counts of the columns, in all the positions or in a mask
+
+    Given a transcript without Eve
+    When its columns are counted
+    Then the sample is in the shared bits, and there are no errors
+    """
+    saved = transcript.record(tmp_path/"run.bb84", 1000, seed=2,
+                              chunk_particles=128)
+    shared = saved.count("sifted", mask=None, chunk_particles=128)
+    assert shared == saved.sifted_length()
+    assert saved.count("sample") == saved.count("sample", mask=None)
+    assert saved.count("sender_values", "receiver_values") == 0
@@ -0,0 +1,308 @@
+"""
+This module contains a compact binary format for the transcripts of the
+protocol, with the bases and the values of the sender and of the
+receiver, the shared positions and the positions compared. Every column
+has one bit per particle, packed like 'packed.py' does, so a billion
+particles take 750 MB. The file starts with the magic bytes, the length
+of a JSON header with the parameters of the run, including the size of
+the chunks that the random numbers depend on, and the positions of the
+columns, and the header; then the columns follow, each starting at a
+multiple of 8 bytes.
+A 'Transcript' opens the file with numpy.memmap and reads it a chunk at
+a time, so even transcripts larger than the memory can be sifted again,
+or sampled and scored again with a different percentage, in place.
+"""
+import json
+import numpy as np
+import engine
+import packed
+import randomness
+from engine import ProtocolResult
+
+#First bytes of every transcript, with the version of the format
+MAGIC = b"BB84TRN1"
+
+#Columns of a transcript, in the order they are saved
+COLUMNS = ("sender_bases", "sender_values", "receiver_bases",
+           "receiver_values", "sifted", "sample")
+
+#Default number of particles read or written at a time, a multiple of 64
+CHUNK_PARTICLES = 1 << 23
+
+def _check_chunks(chunk_particles):
+    """Refuse chunks that are not a positive multiple of 64 particles"""
+    if chunk_particles < 64 or chunk_particles % 64:
+        raise ValueError("The chunks must have a multiple of 64 particles")
+
+def _chunks(n_particles, chunk_particles):
+    """Ranges of bytes of the packed columns, a chunk at a time"""
+    _check_chunks(chunk_particles)
+    total_bytes = packed.packed_size(n_particles)
+    step = chunk_particles//8
+    for start in range(0, total_bytes, step):
+        stop = min(start + step, total_bytes)
+        yield start, stop, min(stop*8, n_particles) - start*8
+
+def _sample_chunks(transcript, samples_number, rng, chunk_particles):
+    """
+    Choose 'samples_number' of the shared positions without replacement,
+    a chunk at a time: the number chosen in every chunk is drawn from
+    the hypergeometric distribution, and then the positions in it.
+    Yields the range of bytes and the packed mask of every chunk.
+    """
+    #Counted a chunk at a time, to never load the whole column
+    remaining_shared = transcript.count("sifted", mask=None,
+                                        chunk_particles=chunk_particles)
+    remaining_samples = samples_number
+    for start, stop, length in _chunks(transcript.n_particles,
+                                       chunk_particles):
+        shared = np.flatnonzero(np.unpackbits(
+            transcript.column("sifted")[start:stop], count=length))
+        chosen = 0
+        if remaining_samples:
+            chosen = int(rng.hypergeometric(len(shared),
+                                            remaining_shared - len(shared),
+                                            remaining_samples))
+        remaining_shared -= len(shared)
+        remaining_samples -= chosen
+        mask = np.zeros(stop*8 - start*8, dtype=np.uint8)
+        mask[shared[rng.choice(len(shared), chosen)]] = 1
+        yield start, stop, np.packbits(mask)
+
+def record(path, n_particles, eavesdropping=False, percentage=0.5,
+           seed=None, chunk_particles=CHUNK_PARTICLES):
+    """
+    Simulate a run of the protocol with the arrays of the engine and save
+    its transcript, a chunk of particles at a time.
+
+    Parameters
+    ----------
+        path : string
+            The file of the transcript
+        n_particles : int
+            How many particles will be used
+        eavesdropping : bool, optional
+            Flag to start the simulation with or without eavesdropping
+        percentage : float, optional
+            Percentage of the shared bits compared, defaults to 0.5
+        seed : int, optional
+            The seed of the run, saved in the header, by default a
+            random one
+        chunk_particles : int, optional
+            The number of particles simulated at a time, a multiple of 64.
+            The random numbers are drawn a chunk at a time, so the same
+            seed gives the same transcript only with the same chunks, and
+            the size is saved in the header too
+
+    Returns
+    -------
+        transcript : Transcript
+            The transcript saved, opened for reading
+    """
+    if n_particles<1:
+        raise ValueError("Invalid number of particles, use at least 1")
+    #Checked before the file is created, to never leave it half written
+    _check_chunks(chunk_particles)
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    column_bytes = packed.packed_size(n_particles)
+    header = {"n_particles": n_particles, "eavesdropping": eavesdropping,
+              "percentage": percentage, "seed": seed,
+              "chunk_particles": chunk_particles, "columns": {}}
+    #The header is written with the positions of the columns, so its
+    #length is fixed before the positions are known
+    header_bytes = len(json.dumps(header)) + 64*len(COLUMNS)
+    header_bytes += -header_bytes % 8
+    offset = len(MAGIC) + 8 + header_bytes
+    for name in COLUMNS:
+        header["columns"][name] = offset
+        offset += column_bytes
+    encoded = json.dumps(header).encode().ljust(header_bytes)
+    with open(path, "wb") as file:
+        file.write(MAGIC + np.uint64(header_bytes).tobytes() + encoded)
+        file.truncate(offset)
+    rng = randomness.as_source(seed)
+    transcript = Transcript(path, mode="r+")
+    for start, stop, length in _chunks(n_particles, chunk_particles):
+        sender_bases, sender_values = engine.prepare(length, rng)
+        sent_bases, sent_values = sender_bases, sender_values
+        if eavesdropping:
+            sent_bases, sent_values = engine.measure(sender_bases,
+                                                     sender_values, rng)
+        receiver_bases, receiver_values = engine.measure(sent_bases,
+                                                         sent_values, rng)
+        for name, bits in (("sender_bases", sender_bases),
+                           ("sender_values", sender_values),
+                           ("receiver_bases", receiver_bases),
+                           ("receiver_values", receiver_values),
+                           ("sifted", sender_bases == receiver_bases)):
+            transcript.column(name)[start:stop] = packed.pack(bits)[:stop
+                                                                   - start]
+    samples_number = round(percentage*transcript.sifted_length())
+    for start, stop, mask in _sample_chunks(transcript, samples_number, rng,
+                                            chunk_particles):
+        transcript.column("sample")[start:stop] = mask
+    transcript.flush()
+    return Transcript(path)
+
+class Transcript:
+    """
+    Transcript of a run saved by 'record', memory-mapped.
+
+    Parameters
+    ----------
+        path : string
+            The file of the transcript
+        mode : string, optional
+            The mode of numpy.memmap, "r" by default
+
+    Attributes
+    ----------
+        header : dict
+            The parameters of the run and the positions of the columns
+        n_particles : int
+            The number of particles of the run
+    """
+    def __init__(self, path, mode="r"):
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a transcript")
+            header_bytes = int(np.frombuffer(file.read(8), dtype=np.uint64)[0])
+            self.header = json.loads(file.read(header_bytes))
+        self.n_particles = self.header["n_particles"]
+        self._buffer = np.memmap(path, dtype=np.uint8, mode=mode)
+
+    def column(self, name):
+        """The packed bits of a column, as a view of the file"""
+        start = self.header["columns"][name]
+        return self._buffer[start:start + packed.packed_size(self.n_particles)]
+
+    def bits(self, name, start=0, stop=None):
+        """Unpack the bits of a column from 'start' to 'stop'"""
+        if stop is None:
+            stop = self.n_particles
+        first_byte = start//8
+        unpacked = np.unpackbits(self.column(name)[first_byte:-(-stop//8)],
+                                 count=stop - first_byte*8)
+        return unpacked[start - first_byte*8:]
+
+    def flush(self):
+        """Write the changes to the file"""
+        self._buffer.flush()
+
+    def count(self, name, other=None, mask="sifted",
+              chunk_particles=CHUNK_PARTICLES):
+        """
+        Count the set bits of a column, or of the XOR of two, where the
+        mask is set, reading a chunk of particles at a time.
+
+        Parameters
+        ----------
+            name : string
+                The column counted
+            other : string, optional
+                A column compared with the first one, to count the bits
+                that differ
+            mask : string, optional
+                The column of the positions counted, by default the
+                shared bits, all the positions if None
+            chunk_particles : int, optional
+                The number of particles read at a time, a multiple of 64
+
+        Returns
+        -------
+            total : int
+                The number of bits counted
+        """
+        total = 0
+        for start, stop, _ in _chunks(self.n_particles, chunk_particles):
+            words = self.column(name)[start:stop].view(np.uint64)
+            if other is not None:
+                words = words ^ self.column(other)[start:stop].view(np.uint64)
+            if mask is not None:
+                words = words & self.column(mask)[start:stop].view(np.uint64)
+            total += int(engine.popcount(words))
+        return total
+
+    def sifted_length(self):
+        """Number of shared bits"""
+        return self.count("sifted", mask=None)
+
+    def sift(self, chunk_particles=CHUNK_PARTICLES):
+        """
+        Compare again the bases of the sender and of the receiver, and
+        return the number of positions where the saved 'sifted' column
+        is wrong, 0 for an intact transcript.
+        """
+        wrong = 0
+        for start, stop, _ in _chunks(self.n_particles, chunk_particles):
+            shared = ~(self.column("sender_bases")[start:stop].view(np.uint64)
+                       ^ self.column("receiver_bases")[start:stop]
+                       .view(np.uint64))
+            saved = self.column("sifted")[start:stop].view(np.uint64)
+            wrong += int(engine.popcount(shared ^ saved))
+        #The padding after the last particle is never shared
+        return wrong - (packed.packed_size(self.n_particles)*8
+                        - self.n_particles)
+
+    def score(self, threshold=0., chunk_particles=CHUNK_PARTICLES):
+        """
+        Compare the keys in the saved sample.
+
+        Parameters
+        ----------
+            threshold : float, optional
+                Highest error rate in the sample that is accepted
+
+        Returns
+        -------
+            result : ProtocolResult
+                The numbers of the comparison of the keys
+        """
+        return self._result(self.count("sample", mask=None,
+                                       chunk_particles=chunk_particles),
+                            self.count("sender_values", "receiver_values",
+                                       "sample", chunk_particles),
+                            threshold, chunk_particles)
+
+    def rescore(self, percentage, rng=None, threshold=0.,
+                chunk_particles=CHUNK_PARTICLES):
+        """
+        Draw a new sample of the shared bits and compare the keys in it,
+        reading the file a chunk at a time and without changing it.
+
+        Parameters
+        ----------
+            percentage : float
+                Percentage of the shared bits compared
+            rng : RandomSource, Generator or int, optional
+                The source of randomness of the new sample
+            threshold : float, optional
+                Highest error rate in the sample that is accepted
+
+        Returns
+        -------
+            result : ProtocolResult
+                The numbers of the comparison of the keys
+        """
+        rng = randomness.as_source(rng)
+        samples_number = round(percentage*self.sifted_length())
+        mismatches = 0
+        for start, stop, mask in _sample_chunks(self, samples_number, rng,
+                                                chunk_particles):
+            mismatches += packed.count_errors(
+                self.column("sender_values")[start:stop],
+                self.column("receiver_values")[start:stop], mask)
+        return self._result(samples_number, mismatches, threshold,
+                            chunk_particles)
+
+    def _result(self, samples_number, mismatches, threshold, chunk_particles):
+        """Summary of a comparison, with the rules of engine.compare_keys"""
+        interference = (samples_number == 0
+                        or mismatches > threshold*samples_number)
+        return ProtocolResult(
+            sifted_length=self.sifted_length(),
+            errors=self.count("sender_values", "receiver_values",
+                               chunk_particles=chunk_particles),
+            sample_size=samples_number, mismatches=mismatches,
+            interference=interference)